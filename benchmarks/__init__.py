@@ -0,0 +1,10 @@
+"""Micro-benchmarks for the Splunk tracer.
+
+Run the whole suite from the repository root, writing JSON results:
+
+    python -m benchmarks --output results.json
+
+or individual benchmarks, printing a table, e.g.
+
+    python -m benchmarks.record_span_contention
+"""
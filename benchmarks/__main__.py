@@ -0,0 +1,88 @@
+"""Runs the benchmark suite and writes the results as JSON.
+
+    python -m benchmarks [--quick] [--output results.json] [name ...]
+
+Everything runs offline; benchmarks that flush use a local stub HEC server.
+The output is one JSON document: the environment the suite ran in, and the
+result dicts of every benchmark, so runs can be compared across releases.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+
+from splunktracing import version
+
+# Benchmark modules, in run order.
+BENCHMARKS = (
+    'tracer_overhead',
+    'record_span_contention',
+    'flush_workers',
+    'span_conversion',
+    'binary_propagation',
+    'serialization',
+    'compression',
+    'memory',
+)
+
+# Smaller workloads for --quick, e.g. as a smoke test in CI.
+_QUICK_ARGS = {
+    'tracer_overhead': {'span_count': 2000},
+    'record_span_contention': {'thread_counts': (1, 4), 'spans_per_thread': 1000},
+    'flush_workers': {'worker_counts': (1, 4), 'seconds': 0.5},
+    'span_conversion': {'span_count': 1000, 'repeat': 3},
+    'binary_propagation': {'count': 2000, 'repeat': 3},
+    'serialization': {'span_count': 200, 'repeat': 2},
+    'compression': {'span_count': 200, 'repeat': 2, 'levels': (1, 6)},
+    'memory': {'max_span_records': 2000},
+}
+
+
+def run(names=BENCHMARKS, quick=False):
+    """Run the named benchmarks; returns the JSON-ready result document."""
+    results = []
+    for name in names:
+        module = importlib.import_module('benchmarks.' + name)
+        kwargs = _QUICK_ARGS.get(name, {}) if quick else {}
+        start = time.time()
+        results.extend(module.run(**kwargs))
+        print('{0}: done in {1:.1f}s'.format(name, time.time() - start), file=sys.stderr)
+    return {
+        'tracer_version': version.SPLUNK_PYTHON_TRACER_VERSION,
+        'python_version': platform.python_version(),
+        'python_implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmarks to run (default: all of %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true',
+                        help='run smaller workloads')
+    parser.add_argument('--output', '-o',
+                        help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark: %s' % ', '.join(unknown))
+    document = run(args.names or BENCHMARKS, args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    else:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Measures the cost of injecting a span context into, and extracting it from,
+a SPLUNK_BINARY carrier.
+
+"protobuf" re-creates the original propagator, which went through the
+BinaryCarrier protobuf message; "codec" is the current
+SplunkTracingBinaryPropagator with its hand-rolled encoding.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import time
+from base64 import standard_b64decode, standard_b64encode
+
+from basictracer.context import SpanContext
+
+from splunktracing import util
+from splunktracing.lightstep_carrier_pb2 import BinaryCarrier
+from splunktracing.splunk_binary_propagator import SplunkTracingBinaryPropagator
+
+
+class _ProtobufBinaryPropagator(object):
+
+    def inject(self, span_context, carrier):
+        state = BinaryCarrier()
+        basic_ctx = state.basic_ctx
+        basic_ctx.trace_id = span_context.trace_id
+        basic_ctx.span_id = span_context.span_id
+        basic_ctx.sampled = span_context.sampled
+        if span_context.baggage is not None:
+            for key in span_context.baggage:
+                basic_ctx.baggage_items[key] = span_context.baggage[key]
+        carrier.extend(standard_b64encode(state.SerializeToString()))
+
+    def extract(self, carrier):
+        state = BinaryCarrier()
+        state.ParseFromString(bytes(standard_b64decode(carrier)))
+        baggage = {}
+        for k in state.basic_ctx.baggage_items:
+            baggage[k] = state.basic_ctx.baggage_items[k]
+        return SpanContext(span_id=state.basic_ctx.span_id,
+                           trace_id=state.basic_ctx.trace_id,
+                           baggage=baggage,
+                           sampled=state.basic_ctx.sampled)
+
+
+def _best(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count=20000, baggage_sizes=(0, 4), repeat=5):
+    """Returns a list of result dicts, one per propagator and baggage size."""
+    results = []
+    for baggage_size in baggage_sizes:
+        context = SpanContext(
+            trace_id=util._generate_guid(), span_id=util._generate_guid(), sampled=True,
+            baggage=dict(('key-%d' % i, 'value-%d' % i) for i in range(baggage_size)))
+        for name, propagator in (('protobuf', _ProtobufBinaryPropagator()),
+                                 ('codec', SplunkTracingBinaryPropagator())):
+            carrier = bytearray()
+            propagator.inject(context, carrier)
+
+            def inject():
+                for _ in range(count):
+                    propagator.inject(context, bytearray())
+
+            def extract():
+                for _ in range(count):
+                    propagator.extract(carrier)
+
+            inject_seconds = _best(inject, repeat)
+            extract_seconds = _best(extract, repeat)
+            results.append({
+                'benchmark': 'binary_propagation',
+                'variant': name,
+                'baggage_items': baggage_size,
+                'carrier_bytes': len(carrier),
+                'inject_ns': inject_seconds * 1e9 / count,
+                'extract_ns': extract_seconds * 1e9 / count,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--baggage-sizes', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('{0:>9} {1:>8} {2:>8} {3:>10} {4:>11}'.format(
+        'variant', 'baggage', 'bytes', 'inject ns', 'extract ns'))
+    for result in run(args.count, tuple(args.baggage_sizes), args.repeat):
+        print('{variant:>9} {baggage_items:>8} {carrier_bytes:>8} '
+              '{inject_ns:>10.0f} {extract_ns:>11.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
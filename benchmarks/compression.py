@@ -0,0 +1,69 @@
+"""Measures the CPU time versus bytes-on-wire tradeoff of report compression.
+
+Each report is serialized and encoded exactly as _HTTPConnection.report does
+it, once uncompressed and once per gzip level.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from splunktracing.http_connection import _HTTPConnection
+
+from benchmarks.serialization import make_report
+
+
+def _encode(connection, report):
+    body, _, _ = connection._encode_body(report)
+    if isinstance(body, bytes):
+        return len(body)
+    return sum(len(chunk) for chunk in body)
+
+
+def run(span_count=1000, logs_per_span=1, repeat=5, levels=range(1, 10)):
+    """Returns a list of result dicts, one per codec and level."""
+    report = make_report(span_count, logs_per_span)
+    settings = [('none', None)] + [('gzip', level) for level in levels]
+    results = []
+    raw_bytes = None
+    for codec, level in settings:
+        connection = _HTTPConnection('http://localhost', 1,
+                                     compression=codec,
+                                     compression_level=level or 1,
+                                     compression_min_bytes=0)
+        best = None
+        for _ in range(repeat):
+            start = time.process_time()
+            size = _encode(connection, report)
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if raw_bytes is None:
+            raw_bytes = size
+        results.append({
+            'benchmark': 'compression',
+            'codec': codec,
+            'level': level,
+            'spans': span_count,
+            'cpu_seconds': best,
+            'bytes': size,
+            'ratio': float(raw_bytes) / size,
+            'input_bytes_per_second': raw_bytes / best,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--spans', type=int, default=1000)
+    parser.add_argument('--logs-per-span', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('{0:>6} {1:>6} {2:>12} {3:>10} {4:>8}'.format(
+        'codec', 'level', 'cpu ms', 'bytes', 'ratio'))
+    for result in run(args.spans, args.logs_per_span, args.repeat):
+        print('{codec:>6} {level!s:>6} {ms:>12.2f} {bytes:>10} {ratio:>8.1f}'.format(
+            ms=result['cpu_seconds'] * 1000, **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Measures how flush throughput scales with flush_workers when every
+request to the collector takes a while.
+
+The stub collector answers each report after a fixed delay. Spans are
+recorded as fast as the buffer accepts them, and the reports are capped at
+max_report_bytes, so the number of reports in flight bounds throughput.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+import warnings
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.recorder
+import splunktracing.tracer
+from benchmarks.stub_collector import StubCollector
+
+
+def _make_span(tracer, i):
+    span = BasicSpan(
+        tracer,
+        operation_name='op-%d' % (i % 10),
+        context=SpanContext(trace_id=1000 + i, span_id=2000 + i),
+        start_time=time.time())
+    span.tags = {'component': 'benchmark', 'index': i}
+    span.duration = 0.001
+    return span
+
+
+def run(worker_counts=(1, 2, 4, 8), seconds=2.0, latency_seconds=0.05,
+        max_report_bytes=64 * 1024):
+    """Returns a list of result dicts, one per worker count."""
+    warnings.simplefilter('ignore', UserWarning)
+    collector = StubCollector(latency_seconds)
+    results = []
+    try:
+        for workers in worker_counts:
+            recorder = splunktracing.recorder.Recorder(
+                collector_encryption='none',
+                collector_host='127.0.0.1',
+                collector_port=collector.port,
+                component_name='benchmark',
+                periodic_flush_seconds=0.1,
+                max_span_records=10000,
+                flush_workers=workers,
+                max_report_bytes=max_report_bytes)
+            tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+            spans = [_make_span(tracer, i) for i in range(1000)]
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                for span in spans:
+                    recorder.record_span(span)
+                time.sleep(0.001)
+            flushed = recorder.stats()['spans_flushed']
+            recorder.shutdown(flush=False)
+            stats = recorder.stats()
+            results.append({
+                'benchmark': 'flush_workers',
+                'flush_workers': workers,
+                'latency_seconds': latency_seconds,
+                'max_report_bytes': max_report_bytes,
+                'seconds': seconds,
+                'spans_flushed': flushed,
+                'spans_per_second': flushed / seconds,
+                'spans_dropped': stats['spans_dropped'],
+                'reports_sent': stats['reports_sent'],
+            })
+    finally:
+        collector.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the stub collector takes per report')
+    parser.add_argument('--max-report-bytes', type=int, default=64 * 1024)
+    args = parser.parse_args()
+    print('{0:>8} {1:>14} {2:>14}'.format('workers', 'spans/sec', 'dropped'))
+    for result in run(args.workers, args.seconds, args.latency, args.max_report_bytes):
+        print('{flush_workers:>8} {spans_per_second:>14.0f} {spans_dropped:>14}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
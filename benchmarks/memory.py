@@ -0,0 +1,148 @@
+"""Measures the heap cost of each span buffered by Recorder.
+
+The recorder is filled up to max_span_records and the memory allocated while
+doing so (as seen by tracemalloc) is divided by the number of spans. The
+growth of the resident set size over a separate, untraced fill is reported
+too, where the platform exposes it. The
+"legacy" variant swaps in span record classes with a per-instance __dict__,
+as collector.Span and collector.SpanContext used to be, for comparison.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+import warnings
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.http_converter
+import splunktracing.recorder
+import splunktracing.tracer
+
+
+class _LegacySpan(object):
+    def __init__(self, span_context, operation_name, start_timestamp, duration_micros,
+                 tags=None, logs=None):
+        self.span_context = span_context
+        self.operation_name = operation_name
+        self.start_timestamp = start_timestamp
+        self.duration_micros = duration_micros
+        self.tags = {} if tags is None else tags
+        self.logs = [] if logs is None else logs
+
+
+class _LegacySpanContext(object):
+    def __init__(self, trace_id, span_id, parent_id, baggage=None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.baggage = {} if baggage is None else baggage
+
+
+def _make_spans(tracer, count, tags_per_span):
+    spans = []
+    for i in range(count):
+        span = BasicSpan(
+            tracer,
+            operation_name='op-%d' % (i % 10),
+            context=SpanContext(trace_id=1000 + i // 10, span_id=2000 + i),
+            parent_id=2000 + i - 1,
+            start_time=time.time())
+        span.tags = dict(('tag-%d' % n, 'value-%d' % i) for n in range(tags_per_span))
+        span.duration = 0.001
+        spans.append(span)
+    return spans
+
+
+def _rss_bytes():
+    """Return the resident set size of this process, or None where
+    /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _fill(max_span_records, tags_per_span, deferred_conversion, trace):
+    """Fill a recorder; returns the bytes per buffered span, as seen by
+    tracemalloc if `trace`, otherwise by the resident set size."""
+    recorder = splunktracing.recorder.Recorder(
+        collector_encryption='none',
+        collector_host='localhost',
+        component_name='benchmark',
+        periodic_flush_seconds=0,
+        max_span_records=max_span_records,
+        deferred_conversion=deferred_conversion)
+    tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+    spans = _make_spans(tracer, max_span_records, tags_per_span)
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+        measure = lambda: tracemalloc.get_traced_memory()[0]
+    else:
+        measure = _rss_bytes
+    try:
+        before = measure()
+        for span in spans:
+            recorder.record_span(span)
+        gc.collect()
+        after = measure()
+    finally:
+        if trace:
+            tracemalloc.stop()
+    buffered = len(recorder._span_records)
+    recorder.shutdown(flush=False)
+    if before is None:
+        return None
+    return float(after - before) / buffered
+
+
+def run(max_span_records=10000, tags_per_span=4):
+    """Returns a list of result dicts, one per record layout."""
+    warnings.simplefilter('ignore', UserWarning)
+    converter = splunktracing.http_converter
+    variants = [('slots', False, None), ('slots', True, None),
+                ('legacy', False, (_LegacySpan, _LegacySpanContext))]
+    results = []
+    for layout, deferred, classes in variants:
+        saved = converter.Span, converter.SpanContext
+        if classes is not None:
+            converter.Span, converter.SpanContext = classes
+        try:
+            rss_per_span = _fill(max_span_records, tags_per_span, deferred, False)
+            per_span = _fill(max_span_records, tags_per_span, deferred, True)
+        finally:
+            converter.Span, converter.SpanContext = saved
+        results.append({
+            'benchmark': 'memory',
+            'layout': layout,
+            'deferred_conversion': deferred,
+            'spans': max_span_records,
+            'tags_per_span': tags_per_span,
+            'bytes_per_span': per_span,
+            'rss_bytes_per_span': rss_per_span,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-span-records', type=int, default=10000)
+    parser.add_argument('--tags-per-span', type=int, default=4)
+    args = parser.parse_args()
+    print('{0:>8} {1:>9} {2:>10} {3:>14} {4:>14}'.format(
+        'layout', 'deferred', 'spans', 'bytes/span', 'rss bytes/span'))
+    for result in run(args.max_span_records, args.tags_per_span):
+        rss = result['rss_bytes_per_span']
+        print('{layout:>8} {deferred_conversion!s:>9} {spans:>10} '
+              '{bytes_per_span:>14.0f} {rss:>14}'.format(
+                  rss='n/a' if rss is None else '%.0f' % rss, **result))
+
+
+if __name__ == '__main__':
+    main()
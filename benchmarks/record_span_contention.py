@@ -0,0 +1,101 @@
+"""Measures Recorder.record_span throughput as the number of threads grows.
+
+A background thread keeps draining the buffer the way the flush thread does,
+so producers contend with each other and with the drain.
+"""
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+import warnings
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.recorder
+import splunktracing.tracer
+
+
+def _make_recorder(deferred_conversion):
+    warnings.simplefilter('ignore', UserWarning)
+    return splunktracing.recorder.Recorder(
+        collector_encryption='none',
+        collector_host='localhost',
+        component_name='benchmark',
+        periodic_flush_seconds=0,
+        max_span_records=1000000,
+        deferred_conversion=deferred_conversion)
+
+
+def _make_span(tracer, i):
+    span = BasicSpan(
+        tracer,
+        operation_name='op-%d' % (i % 10),
+        context=SpanContext(trace_id=1000 + i, span_id=2000 + i),
+        start_time=time.time())
+    span.tags = {'component': 'benchmark', 'index': i}
+    span.duration = 0.001
+    return span
+
+
+def run(thread_counts=(1, 2, 4, 8, 16), spans_per_thread=5000, deferred_conversion=False):
+    """Returns a list of result dicts, one per thread count."""
+    results = []
+    for thread_count in thread_counts:
+        recorder = _make_recorder(deferred_conversion)
+        tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        spans = [_make_span(tracer, i) for i in range(spans_per_thread)]
+        start_barrier = threading.Barrier(thread_count + 1)
+        done = threading.Event()
+
+        def produce():
+            start_barrier.wait()
+            for span in spans:
+                recorder.record_span(span)
+
+        def drain():
+            while not done.is_set():
+                recorder._construct_report_request()
+                time.sleep(0.001)
+
+        drainer = threading.Thread(target=drain)
+        drainer.start()
+        producers = [threading.Thread(target=produce) for _ in range(thread_count)]
+        for t in producers:
+            t.start()
+        start_barrier.wait()
+        start = time.perf_counter()
+        for t in producers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        drainer.join()
+        recorder._disabled_runtime = True
+
+        total = thread_count * spans_per_thread
+        results.append({
+            'benchmark': 'record_span_contention',
+            'threads': thread_count,
+            'deferred_conversion': deferred_conversion,
+            'spans': total,
+            'seconds': elapsed,
+            'spans_per_second': total / elapsed,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--spans-per-thread', type=int, default=5000)
+    parser.add_argument('--deferred', action='store_true',
+                        help='record with deferred_conversion=True')
+    args = parser.parse_args()
+    print('{0:>8} {1:>10} {2:>14}'.format('threads', 'spans', 'spans/sec'))
+    for result in run(args.threads, args.spans_per_thread, args.deferred):
+        print('{threads:>8} {spans:>10} {spans_per_second:>14.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Measures HEC event serialization throughput of collector.ReportRequest.
+
+The "legacy" variant re-creates the original per-event dict.update() of the
+reporter tags so the effect of the cached tag fragment can be compared. The
+current serializer is measured once per installed JSON encoder backend.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import time
+
+from splunktracing import collector
+from splunktracing import json_encoder
+from splunktracing.http_converter import HttpConverter
+
+
+def make_report(span_count=1000, logs_per_span=1):
+    """Build a report resembling a typical flush: a handful of tags per span
+    and a log or two."""
+    runtime = HttpConverter().create_runtime('benchmark', {'env': 'bench'}, 12345)
+    spans = []
+    for i in range(span_count):
+        context = collector.SpanContext(trace_id='%x' % (10 ** 12 + i // 10),
+                                        span_id='%x' % (10 ** 13 + i),
+                                        parent_id='%x' % (10 ** 13 + i - 1),
+                                        baggage={})
+        logs = [{'timestamp': 1500000000.25 + n, 'event': 'db.query',
+                 'statement': 'SELECT * FROM t WHERE id = %d' % i}
+                for n in range(logs_per_span)]
+        spans.append(collector.Span(span_context=context,
+                                    operation_name='op-%d' % (i % 20),
+                                    start_timestamp='1500000000.%d' % i,
+                                    duration_micros=1000 + i,
+                                    tags={'component': 'benchmark',
+                                          'http.method': 'GET',
+                                          'http.status_code': '200',
+                                          'http.url': '/api/items/%d' % i},
+                                    logs=logs))
+    return collector.ReportRequest(runtime, spans)
+
+
+def _legacy_iter_serialized(report):
+    for span in report.spans:
+        span_dict = {
+            "trace_id": span.span_context.trace_id,
+            "span_id": span.span_context.span_id,
+            "parent_span_id": span.span_context.parent_id,
+            "operation_name": span.operation_name,
+            "tags": span.tags,
+            "baggage": span.span_context.baggage
+        }
+        span_dict.update(report.reporter.tags)
+        for log in span.logs:
+            log_event = {
+                "time": log["timestamp"],
+                "sourcetype": "splunktracing:log",
+                "event": {"fields": log, "timestamp": log["timestamp"]}
+            }
+            log_event["event"].update(span_dict)
+            yield json.dumps(log_event)
+        span_dict["timestamp"] = span.start_timestamp
+        span_dict["duration"] = span.duration_micros
+        yield json.dumps({
+            "time": span.start_timestamp,
+            "sourcetype": "splunktracing:span",
+            "event": span_dict
+        })
+
+
+def _time_events(iter_events, report, repeat):
+    best = None
+    events = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        events = sum(1 for _ in iter_events(report))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return events, best
+
+
+def run(span_count=1000, logs_per_span=1, repeat=5):
+    """Returns a list of result dicts, one per serializer variant."""
+    report = make_report(span_count, logs_per_span)
+    variants = [('legacy', _legacy_iter_serialized, None)]
+    for name in ('json', 'ujson', 'orjson'):
+        try:
+            encoder = json_encoder.get_encoder(name)
+        except ImportError:
+            continue
+        variants.append((name, collector.ReportRequest.iter_serialized, encoder))
+    results = []
+    for name, iter_events, encoder in variants:
+        if encoder is not None:
+            report.encoder = encoder
+        events, seconds = _time_events(iter_events, report, repeat)
+        results.append({
+            'benchmark': 'serialization',
+            'variant': name,
+            'spans': span_count,
+            'events': events,
+            'seconds': seconds,
+            'events_per_second': events / seconds,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--spans', type=int, default=1000)
+    parser.add_argument('--logs-per-span', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('{0:>10} {1:>10} {2:>14}'.format('variant', 'events', 'events/sec'))
+    for result in run(args.spans, args.logs_per_span, args.repeat):
+        print('{variant:>10} {events:>10} {events_per_second:>14.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
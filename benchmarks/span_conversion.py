@@ -0,0 +1,105 @@
+"""Measures the per-span cost of turning a finished span into a span record.
+
+Only the record itself (ids, operation name, timestamp and duration) is
+timed, not tags or logs. "legacy" re-creates the original
+create_span_record, which formatted every id and time through the util
+helpers; "single" is the current create_span_record and "batch" is
+create_span_records over the whole list.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import math
+import time
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+from splunktracing import collector
+from splunktracing import util
+from splunktracing.http_converter import HttpConverter
+
+
+def _legacy_create_span_record(span):
+    if span.parent_id:
+        pid = '{0:x}'.format(int(span.parent_id))
+    else:
+        pid = span.parent_id
+    span_context = collector.SpanContext(trace_id='{0:x}'.format(int(span.context.trace_id)),
+                                         span_id='{0:x}'.format(int(span.context.span_id)),
+                                         parent_id=pid)
+    seconds, nanos = util._time_to_seconds_nanos(span.start_time)
+    return collector.Span(span_context=span_context,
+                          operation_name=util._coerce_str(span.operation_name),
+                          start_timestamp="%d.%d" % (seconds, nanos),
+                          duration_micros=int(math.floor(round(span.duration * 1000000))),
+                          tags={},
+                          logs=[])
+
+
+def make_spans(span_count=10000, spans_per_trace=10):
+    """Build finished spans in traces of `spans_per_trace`, each span a child
+    of the trace's first span."""
+    spans = []
+    now = time.time()
+    for i in range(span_count):
+        root = (i // spans_per_trace) * spans_per_trace
+        span = BasicSpan(None, operation_name='op-%d' % (i % 20),
+                         context=SpanContext(trace_id=util._generate_guid() if i == root
+                                             else spans[root].context.trace_id,
+                                             span_id=util._generate_guid()),
+                         parent_id=None if i == root else spans[root].context.span_id,
+                         start_time=now + i * 0.001)
+        span.duration = 0.0012
+        spans.append(span)
+    return spans
+
+
+def run(span_count=10000, spans_per_trace=10, repeat=5):
+    """Returns a list of result dicts, one per conversion path."""
+    spans = make_spans(span_count, spans_per_trace)
+    variants = [
+        ('legacy', lambda converter: [_legacy_create_span_record(s) for s in spans]),
+        ('single', lambda converter: [converter.create_span_record(s, 0) for s in spans]),
+        ('batch', lambda converter: converter.create_span_records(spans, 0)),
+    ]
+    results = []
+    for name, convert in variants:
+        best = None
+        for _ in range(repeat):
+            # A fresh converter each time, so the id cache starts cold.
+            converter = HttpConverter()
+            # Like timeit, keep collector pauses out of the measurement.
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                convert(converter)
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({
+            'benchmark': 'span_conversion',
+            'variant': name,
+            'spans': span_count,
+            'spans_per_trace': spans_per_trace,
+            'seconds': best,
+            'ns_per_span': best * 1e9 / span_count,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--spans', type=int, default=10000)
+    parser.add_argument('--spans-per-trace', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print('{0:>8} {1:>10} {2:>12}'.format('variant', 'spans', 'ns/span'))
+    for result in run(args.spans, args.spans_per_trace, args.repeat):
+        print('{variant:>8} {spans:>10} {ns_per_span:>12.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
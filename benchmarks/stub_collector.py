@@ -0,0 +1,98 @@
+"""A local stand-in for a Splunk HTTP Event Collector, so benchmarks that
+flush reports run offline.
+
+Request bodies are read and discarded; only their number and size are kept.
+A response delay can be set to stand in for the round trip to a remote
+collector.
+"""
+from __future__ import print_function
+
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+_RESPONSE = b'{"text":"Success","code":0}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        size = 0
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            while True:
+                chunk_size = int(self.rfile.readline().strip(), 16)
+                self.rfile.read(chunk_size)
+                self.rfile.readline()
+                if chunk_size == 0:
+                    break
+                size += chunk_size
+        else:
+            size = int(self.headers['Content-Length'])
+            self.rfile.read(size)
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += size
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubCollector(object):
+    """Serves HEC requests on a free local port until stop() is called,
+    answering each after `latency_seconds`."""
+
+    def __init__(self, latency_seconds=0):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.latency_seconds = latency_seconds
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.bytes_received = 0
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def bytes_received(self):
+        return self.server.bytes_received
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    collector = StubCollector()
+    print('Stub HEC listening on http://127.0.0.1:%d/services/collector' % collector.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        collector.stop()
+
+
+if __name__ == '__main__':
+    main()
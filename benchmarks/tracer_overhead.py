@@ -0,0 +1,120 @@
+"""Measures what tracing costs the instrumented code: spans per second
+through Tracer.start_span() / finish(), and the latency each span adds.
+
+Every start_span() / finish() pair is timed; the "added" latencies are
+relative to the no-op opentracing.Tracer. The Splunk tracer buffers every
+span of the run (max_span_records is sized to hold them all, so the numbers
+never measure the drop path) and flushes them to a local stub HEC server
+afterwards. The run fails unless every span was flushed.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+import warnings
+
+import opentracing
+
+import splunktracing
+from benchmarks.stub_collector import StubCollector
+
+
+def _percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _time_spans(tracer, span_count):
+    """Returns the total elapsed time and the sorted per-span latencies."""
+    latencies = []
+    append = latencies.append
+    clock = time.perf_counter
+    tags = {'component': 'benchmark', 'http.method': 'GET'}
+    start = clock()
+    for i in range(span_count):
+        span_start = clock()
+        span = tracer.start_span('op-%d' % (i % 10), tags=tags)
+        span.set_tag('index', i)
+        span.finish()
+        append(clock() - span_start)
+    elapsed = clock() - start
+    latencies.sort()
+    return elapsed, latencies
+
+
+def run(span_count=20000, deferred_conversion=False):
+    """Returns a list of result dicts: the no-op baseline, then the Splunk
+    tracer."""
+    # periodic_flush_seconds=0 warns that nothing is flushed unless asked.
+    warnings.simplefilter('ignore', UserWarning)
+    collector = StubCollector()
+    variants = [
+        ('noop', lambda: opentracing.Tracer()),
+        ('splunk', lambda: splunktracing.Tracer(
+            component_name='benchmark',
+            access_token='benchmark',
+            collector_host='127.0.0.1',
+            collector_port=collector.port,
+            collector_encryption='none',
+            periodic_flush_seconds=0,
+            max_span_records=span_count,
+            max_buffer_bytes=None,
+            deferred_conversion=deferred_conversion)),
+    ]
+    results = []
+    baseline = None
+    try:
+        for name, make_tracer in variants:
+            tracer = make_tracer()
+            elapsed, latencies = _time_spans(tracer, span_count)
+            result = {
+                'benchmark': 'tracer_overhead',
+                'variant': name,
+                'deferred_conversion': deferred_conversion,
+                'spans': span_count,
+                'seconds': elapsed,
+                'spans_per_second': span_count / elapsed,
+                'p50_us': _percentile(latencies, 0.5) * 1e6,
+                'p99_us': _percentile(latencies, 0.99) * 1e6,
+            }
+            if baseline is None:
+                baseline = result
+            result['added_p50_us'] = result['p50_us'] - baseline['p50_us']
+            result['added_p99_us'] = result['p99_us'] - baseline['p99_us']
+            recorder = getattr(tracer, 'recorder', None)
+            if recorder is not None:
+                # Without a flush thread, the flush is done once this returns.
+                recorder.flush(recorder._create_connection())
+                stats = recorder.stats()
+                recorder.shutdown(flush=False)
+                result['spans_flushed'] = stats['spans_flushed']
+                result['spans_dropped'] = stats['spans_dropped']
+                if stats['spans_dropped'] or stats['spans_flushed'] != span_count:
+                    raise RuntimeError(
+                        '{0} of {1} spans flushed, {2} dropped; the results would '
+                        'not measure the recording path'.format(
+                            stats['spans_flushed'], span_count, stats['spans_dropped']))
+            results.append(result)
+    finally:
+        collector.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--spans', type=int, default=20000)
+    parser.add_argument('--deferred', action='store_true',
+                        help='record with deferred_conversion=True')
+    args = parser.parse_args()
+    print('{0:>8} {1:>12} {2:>9} {3:>9} {4:>12} {5:>12} {6:>9} {7:>9}'.format(
+        'variant', 'spans/sec', 'p50 us', 'p99 us', 'added p50', 'added p99',
+        'flushed', 'dropped'))
+    for result in run(args.spans, args.deferred):
+        print('{variant:>8} {spans_per_second:>12.0f} {p50_us:>9.1f} {p99_us:>9.1f} '
+              '{added_p50_us:>12.1f} {added_p99_us:>12.1f} {flushed:>9} {dropped:>9}'.format(
+                  flushed=result.get('spans_flushed', '-'),
+                  dropped=result.get('spans_dropped', '-'), **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,10 @@ setup(
     install_requires=['six',
                       'basictracer>=3.0,<4',
                       'requests>=2.19,<3.0'],
+    extras_require={
+        'fast-json': ['orjson; python_version >= "3.6"',
+                      'ujson; python_version >= "3.6"'],
+    },
     tests_require=['pytest',
                    'sphinx',
                    'sphinx-epytext'],
@@ -19,5 +23,10 @@ setup(
     ],
 
     keywords=[ 'opentracing', 'splunk', 'traceguide', 'tracing', 'microservices', 'distributed' ],
-    packages=find_packages(exclude=['docs*', 'tests*', 'sample*']),
+    packages=find_packages(exclude=['docs*', 'tests*', 'sample*', 'benchmarks*']),
+    entry_points={
+        'console_scripts': [
+            'splunktracing-aggregator = splunktracing.aggregator:main',
+        ],
+    },
 )
@@ -0,0 +1,361 @@
+"""
+A local aggregator process: it collects span events from the tracers of many
+worker processes over a UNIX domain socket, and uploads them to the Splunk
+collector in large, well-compressed reports.
+
+Workers then hold no connection to the collector and do no compression.
+Start the aggregator with the splunktracing-aggregator command (see main()),
+and create the tracers with Tracer(collector_socket=<the same socket path>).
+The socket path defaults to default_socket_path(), which only the user
+running the aggregator can reach.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import errno
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+
+import tempfile
+
+from six.moves import socketserver
+
+from . import constants
+from . import util
+from .http_connection import _HTTPConnection, _Payload
+from .metrics import _Stats
+from .retry_queue import _RetryQueue
+from .unix_connection import _read_frame
+
+
+def _private_directory(path):
+    """Create directory `path` readable by the current user only, or check
+    that it already is; a directory others can write to would let them
+    replace the socket and receive the workers' spans."""
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+            st.st_mode & 0o077):
+        raise ValueError('{0} must be a directory private to the current user'.format(path))
+    return path
+
+
+def default_socket_path():
+    """Return the default aggregator socket path of the current user.
+
+    It is in $XDG_RUNTIME_DIR if set, or else in a directory of the user's
+    own under the temporary directory, created with mode 0700.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        directory = _private_directory(os.path.join(runtime_dir, 'splunktracing'))
+    else:
+        directory = _private_directory(os.path.join(
+            tempfile.gettempdir(), 'splunktracing-{0}'.format(os.getuid())))
+    return os.path.join(directory, constants.AGGREGATOR_SOCKET_NAME)
+
+
+def _socket_in_use(path):
+    """Return whether something accepts connections on UNIX socket `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Reads frames from one worker connection until it closes."""
+
+    def handle(self):
+        aggregator = self.server.aggregator
+        while True:
+            try:
+                frame = _read_frame(self.rfile)
+            except ValueError as e:
+                aggregator._fine("Dropping worker connection: {0}", (e,))
+                return
+            if frame is None:
+                return
+            aggregator.add(frame.body, frame.span_count)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Aggregator(object):
+    """Batches the events received from workers and uploads them.
+
+    A report is uploaded every `flush_seconds`, or as soon as `report_bytes`
+    worth of events (uncompressed) is waiting. Events beyond
+    `max_buffer_bytes` are dropped. Uploads that fail are kept, compressed,
+    for retry with backoff, like Recorder does.
+
+    Reporter tags are those of each worker: they are part of the events it
+    serialized. `access_token` is the one used for every upload.
+    """
+
+    def __init__(self,
+                 socket_path=None,
+                 access_token='',
+                 collector_host='127.0.0.1',
+                 collector_port=8088,
+                 collector_encryption='tls',
+                 flush_seconds=constants.FLUSH_PERIOD_SECS,
+                 report_bytes=constants.AGGREGATOR_REPORT_BYTES,
+                 max_buffer_bytes=constants.AGGREGATOR_MAX_BUFFER_BYTES,
+                 compression_level=constants.DEFAULT_COMPRESSION_LEVEL,
+                 timeout_seconds=30,
+                 retry_buffer_bytes=constants.DEFAULT_RETRY_BUFFER_BYTES,
+                 verbosity=0):
+        self.verbosity = verbosity
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self._socket_path = socket_path
+        self._auth = access_token
+        self._flush_seconds = flush_seconds
+        self._report_bytes = report_bytes
+        self._max_buffer_bytes = max_buffer_bytes
+        self._compression_level = compression_level
+        self._stats = _Stats()
+        collector_url = util._collector_url_from_hostport(
+            collector_encryption != 'none', collector_host, collector_port)
+        self._connection = _HTTPConnection(collector_url, timeout_seconds,
+                                           pool_size=1, stats=self._stats)
+        self._retry_queue = _RetryQueue(retry_buffer_bytes,
+                                        constants.RETRY_INITIAL_BACKOFF_SECS,
+                                        constants.RETRY_MAX_BACKOFF_SECS)
+        self._lock = threading.Lock()
+        # (body, span_count) blocks as received from the workers.
+        self._blocks = []
+        self._buffered_bytes = 0
+        self._flush_event = threading.Event()
+        self._stopped = False
+        self._server = None
+        self._threads = []
+
+    def _fine(self, fmt, args):
+        if self.verbosity >= 1:
+            print("[Splunk Aggregator]: ", fmt.format(*args))
+
+    def add(self, body, span_count):
+        """Buffer a block of serialized events received from a worker."""
+        with self._lock:
+            if self._buffered_bytes + len(body) > self._max_buffer_bytes:
+                self._stats.incr('spans_dropped', span_count)
+                return
+            self._blocks.append((body, span_count))
+            self._buffered_bytes += len(body)
+            full = self._buffered_bytes >= self._report_bytes
+        self._stats.incr('spans_recorded', span_count)
+        if full:
+            self._flush_event.set()
+
+    def _take_batches(self):
+        """Remove the buffered blocks, grouped into batches of about
+        report_bytes each."""
+        with self._lock:
+            blocks = self._blocks
+            self._blocks = []
+            self._buffered_bytes = 0
+        batches = []
+        batch = []
+        size = 0
+        for block in blocks:
+            batch.append(block)
+            size += len(block[0])
+            if size >= self._report_bytes:
+                batches.append(batch)
+                batch = []
+                size = 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _encode(self, batch):
+        body = b''.join(_HTTPConnection._gzip_chunks((b for b, _ in batch),
+                                                     self._compression_level))
+        return _Payload(body, 'gzip',
+                        sum(n for _, n in batch),
+                        sum(len(b) for b, _ in batch))
+
+    def _send(self, payload):
+        """Upload a payload; returns whether it went through."""
+        start = time.time()
+        try:
+            self._connection.send(self._auth, payload)
+        except Exception as e:
+            self._fine("Caught exception during upload: {0}", (e,))
+            self._stats.last_error = repr(e)
+            self._stats.incr('reports_failed')
+            self._retry_queue.record_failure(time.time())
+            return False
+        self._stats.observe_flush(time.time() - start)
+        self._stats.incr('reports_sent')
+        self._stats.incr('spans_flushed', payload.span_count)
+        self._retry_queue.record_success()
+        return True
+
+    def _queue_retry(self, payload, front=False):
+        push = self._retry_queue.push_front if front else self._retry_queue.push
+        self._stats.incr('spans_retried', payload.span_count)
+        dropped = push(payload)
+        if dropped:
+            self._stats.incr('spans_retry_dropped', sum(p.span_count for p in dropped))
+
+    def flush(self, respect_backoff=False):
+        """Upload everything buffered, after any earlier uploads that failed.
+
+        Returns whether everything went through.
+        """
+        if respect_backoff and not self._retry_queue.ready(time.time()):
+            return False
+        while True:
+            payload = self._retry_queue.pop()
+            if payload is None:
+                break
+            if not self._send(payload):
+                self._queue_retry(payload, front=True)
+                break
+        ok = len(self._retry_queue) == 0
+        for batch in self._take_batches():
+            payload = self._encode(batch)
+            if not (ok and self._send(payload)):
+                ok = False
+                self._queue_retry(payload)
+        return ok
+
+    def stats(self):
+        """Return the counters of splunktracing.metrics.COUNTERS that apply,
+        the flush_duration_seconds histogram, the last upload error, and the
+        current buffered_bytes, retry_queue_reports and retry_queue_bytes."""
+        result = self._stats.snapshot()
+        result['buffered_bytes'] = self._buffered_bytes
+        result['retry_queue_reports'] = len(self._retry_queue)
+        result['retry_queue_bytes'] = self._retry_queue.bytes
+        return result
+
+    def _upload_periodically(self):
+        while not self._stopped:
+            backoff = self._retry_queue.backoff_remaining(time.time())
+            self._flush_event.wait(backoff or self._flush_seconds)
+            self._flush_event.clear()
+            if not self._stopped:
+                self.flush(respect_backoff=True)
+
+    def start(self):
+        """Listen on the socket and start uploading in the background.
+
+        Raises OSError (EADDRINUSE) if another aggregator is listening on
+        the socket already.
+        """
+        try:
+            is_socket = stat.S_ISSOCK(os.stat(self._socket_path).st_mode)
+        except OSError:
+            is_socket = False
+        if is_socket:
+            if _socket_in_use(self._socket_path):
+                raise OSError(errno.EADDRINUSE, 'another aggregator is listening on {0}'.format(
+                    self._socket_path))
+            # Left behind by an aggregator that did not exit cleanly.
+            try:
+                os.unlink(self._socket_path)
+            except OSError:
+                pass
+        self._server = _Server(self._socket_path, _WorkerHandler)
+        self._server.aggregator = self
+        self._connection.open()
+        for target in (self._server.serve_forever, self._upload_periodically):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop listening, upload what is left and close the connection.
+
+        Returns whether the final upload went through.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            try:
+                os.unlink(self._socket_path)
+            except OSError:
+                pass
+        self._stopped = True
+        self._flush_event.set()
+        for thread in self._threads:
+            thread.join()
+        flushed = self.flush()
+        self._connection.close()
+        return flushed
+
+
+def main(argv=None):
+    """Entry point of the splunktracing-aggregator command."""
+    parser = argparse.ArgumentParser(
+        prog='splunktracing-aggregator',
+        description='Collect spans from local tracers over a UNIX socket '
+                    'and upload them to a Splunk HTTP Event Collector.')
+    parser.add_argument('--socket',
+                        help='path of the UNIX socket to listen on (default: '
+                             'aggregator.sock in $XDG_RUNTIME_DIR/splunktracing, or in '
+                             'a private directory under the temporary directory)')
+    parser.add_argument('--access-token', default=os.environ.get('SPLUNK_ACCESS_TOKEN', ''),
+                        help='HEC token (default: $SPLUNK_ACCESS_TOKEN)')
+    parser.add_argument('--collector-host', default='127.0.0.1')
+    parser.add_argument('--collector-port', type=int, default=8088)
+    parser.add_argument('--collector-encryption', choices=('tls', 'none'), default='tls')
+    parser.add_argument('--flush-seconds', type=float, default=constants.FLUSH_PERIOD_SECS)
+    parser.add_argument('--report-bytes', type=int, default=constants.AGGREGATOR_REPORT_BYTES,
+                        help='uncompressed size of each upload')
+    parser.add_argument('--max-buffer-bytes', type=int,
+                        default=constants.AGGREGATOR_MAX_BUFFER_BYTES)
+    parser.add_argument('--compression-level', type=int, choices=range(1, 10),
+                        default=constants.DEFAULT_COMPRESSION_LEVEL)
+    parser.add_argument('--timeout-seconds', type=float, default=30)
+    parser.add_argument('--verbosity', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        aggregator = Aggregator(socket_path=args.socket,
+                                access_token=args.access_token,
+                                collector_host=args.collector_host,
+                                collector_port=args.collector_port,
+                                collector_encryption=args.collector_encryption,
+                                flush_seconds=args.flush_seconds,
+                                report_bytes=args.report_bytes,
+                                max_buffer_bytes=args.max_buffer_bytes,
+                                compression_level=args.compression_level,
+                                timeout_seconds=args.timeout_seconds,
+                                verbosity=args.verbosity)
+        aggregator.start()
+    except (OSError, ValueError) as e:
+        print('splunktracing-aggregator: {0}'.format(e), file=sys.stderr)
+        return 1
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    while not stop.is_set():
+        # A timeout keeps the wait interruptible by signals on Python 2.
+        stop.wait(1)
+    return 0 if aggregator.stop() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
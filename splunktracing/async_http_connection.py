@@ -0,0 +1,193 @@
+"""Connection class sending reports to the collector from an asyncio event
+loop. Requires Python 3.5 or newer.
+"""
+import asyncio
+import ssl
+import time
+
+from six.moves.urllib.parse import urlsplit
+
+from .http_connection import _HTTPConnection
+
+
+class _AsyncHTTPConnection(_HTTPConnection):
+    """Counterpart of _HTTPConnection for use on an asyncio event loop.
+
+    report() and send() are coroutines; they never block the loop on the
+    network. Requests go out over a small HTTP/1.1 client built on asyncio
+    streams, which keeps up to `pool_size` keep-alive connections open
+    between reports. Bodies are encoded exactly as _HTTPConnection encodes
+    them (same compression, same chunked streaming of large reports), and
+    the payloads from encode() can be sent by either class.
+
+    Instances are not thread-safe: use them from the event loop they were
+    first used on.
+    """
+
+    def __init__(self, collector_url, timeout_seconds, **kwargs):
+        super(_AsyncHTTPConnection, self).__init__(collector_url, timeout_seconds, **kwargs)
+        url = urlsplit(collector_url)
+        self._secure = url.scheme == 'https'
+        self._host = url.hostname
+        self._port = url.port or (443 if self._secure else 80)
+        self._netloc = url.netloc
+        self._path = url.path or '/'
+        # Idle keep-alive connections, as (reader, writer, last_used) tuples.
+        self._idle = []
+
+    def open(self):
+        """Mark the connection usable; sockets are opened on demand."""
+        self.ready = True
+
+    def close(self):
+        """Close every idle connection to the server."""
+        self.ready = False
+        idle, self._idle = self._idle, []
+        for _, writer, _ in idle:
+            try:
+                writer.close()
+            except RuntimeError:
+                # Its event loop is closed already; the socket is closed
+                # when the transport is collected.
+                pass
+
+    async def _acquire(self):
+        """Return a (reader, writer) pair, reusing an idle connection unless it
+        has been closed by the server or sat unused for too long."""
+        now = time.time()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if reader.at_eof() or (self._idle_seconds is not None and
+                                   now - last_used > self._idle_seconds):
+                writer.close()
+                continue
+            return reader, writer
+        # Honors certificate_verification=False, see Recorder.
+        ssl_context = ssl._create_default_https_context() if self._secure else None
+        return await asyncio.open_connection(self._host, self._port, ssl=ssl_context)
+
+    def _release(self, reader, writer, keep_alive):
+        if keep_alive and self.ready and len(self._idle) < self._pool_size:
+            self._idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    async def _exchange(self, reader, writer, auth, body, content_encoding):
+        """Write one request and read its response.
+
+        Returns (status, response body, whether the connection can be reused).
+        """
+        chunked = not isinstance(body, bytes)
+        head = ['POST {0} HTTP/1.1'.format(self._path),
+                'Host: {0}'.format(self._netloc),
+                'Content-Type: application/json',
+                'Authorization: Splunk {0}'.format(auth)]
+        if content_encoding is not None:
+            head.append('Content-Encoding: {0}'.format(content_encoding))
+        if chunked:
+            head.append('Transfer-Encoding: chunked')
+        else:
+            head.append('Content-Length: {0}'.format(len(body)))
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if chunked:
+            # Each chunk is serialized and compressed as the previous one
+            # drains, so the loop gets to run other tasks in between.
+            for chunk in body:
+                if chunk:
+                    writer.write(b'%x\r\n' % len(chunk))
+                    writer.write(chunk)
+                    writer.write(b'\r\n')
+                    await writer.drain()
+            writer.write(b'0\r\n\r\n')
+        else:
+            writer.write(body)
+        await writer.drain()
+        return await self._read_response(reader)
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('collector closed the connection')
+        version, status = status_line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = (version == b'HTTP/1.1' and
+                      headers.get(b'connection', b'').lower() != b'close')
+        if headers.get(b'transfer-encoding', b'').lower() == b'chunked':
+            content = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip any trailers.
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                content.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(content)
+        elif b'content-length' in headers:
+            content = await reader.readexactly(int(headers[b'content-length']))
+        else:
+            content = await reader.read()
+            keep_alive = False
+        return int(status), content, keep_alive
+
+    async def _post(self, auth, body, content_encoding):
+        """POST a report body to the collector and return the response body.
+
+        Raises an exception when the collector cannot be reached, does not
+        answer within timeout_seconds, or answers that it is overloaded or
+        broken (HTTP 429 or 5xx).
+        """
+        # Connecting counts against the timeout too, so a collector that
+        # silently drops packets cannot hold up the flush for the OS's
+        # connect timeout.
+        status, content = await asyncio.wait_for(
+            self._round_trip(auth, body, content_encoding), self._timeout_seconds)
+        if status == 429 or status >= 500:
+            raise IOError('collector responded with HTTP {0}'.format(status))
+        return content
+
+    async def _round_trip(self, auth, body, content_encoding):
+        """Acquire a connection, POST `body` and return the status and body
+        of the response."""
+        reader, writer = await self._acquire()
+        try:
+            status, content, keep_alive = await self._exchange(
+                reader, writer, auth, body, content_encoding)
+        except BaseException:
+            # The connection is in an unknown state; never reuse it.
+            writer.close()
+            raise
+        self._last_used = time.time()
+        self._release(reader, writer, keep_alive)
+        return status, content
+
+    # May throw an Exception on failure.
+    async def report(self, auth, report):
+        """Report to the server."""
+        if not self.ready:
+            self.open()
+        if len(report.spans) == 0 and not report.metrics:
+            return None
+        start = time.time()
+        body, content_encoding, size = self._encode_body(report)
+        resp = await self._post(auth, body, content_encoding)
+        self._count_sent(size[0], size[1])
+        self._adapt_compression_level(time.time() - start)
+        return resp
+
+    # May throw an Exception on failure.
+    async def send(self, auth, payload):
+        """Send a _Payload produced by encode() to the server."""
+        if not self.ready:
+            self.open()
+        resp = await self._post(auth, payload.body, payload.content_encoding)
+        self._count_sent(payload.raw_size, len(payload.body))
+        return resp
@@ -0,0 +1,258 @@
+"""
+A Recorder for applications running on an asyncio event loop. Requires
+Python 3.5 or newer.
+"""
+import asyncio
+import itertools
+import time
+
+from splunktracing.async_http_connection import _AsyncHTTPConnection
+from splunktracing.recorder import Recorder
+
+
+def _running_loop():
+    """Return the event loop running in the current thread, or None."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    except AttributeError:  # Python < 3.7
+        return asyncio._get_running_loop()
+
+
+class AsyncRecorder(Recorder):
+    """Recorder that reports from a task on the running asyncio event loop
+    instead of from a background thread.
+
+    Spans are buffered exactly as Recorder buffers them, and every option of
+    Recorder applies. The periodic flush task is created by the first span
+    finished on the loop's thread; reports go out over non-blocking HTTP
+    with keep-alive connection reuse (see _AsyncHTTPConnection).
+
+    flush() and shutdown() called from a coroutine schedule the work on the
+    loop and return the task, which can be awaited; called while no loop is
+    running (e.g. at interpreter exit), they send synchronously like
+    Recorder does. flush_async() and shutdown_async() are the coroutine
+    forms.
+    """
+
+    def __init__(self, **kwargs):
+        for option in ('collector_socket', 'collector_endpoints'):
+            if kwargs.get(option) is not None:
+                raise ValueError('{0} is not supported with asyncio'.format(option))
+        super(AsyncRecorder, self).__init__(**kwargs)
+        self._loop = None
+        self._flush_task = None
+        self._async_connection = None
+        # The loop _async_connection's sockets belong to.
+        self._async_connection_loop = None
+        # asyncio counterparts of _flush_event and _shutdown_event, created
+        # on the loop along with the flush task.
+        self._wakeup = None
+        self._stopping = None
+
+    def _maybe_init_flush_thread(self):
+        """Start the periodic flush task if periodic_flush_seconds > 0 and a
+        loop is running in this thread.
+
+        The task is started again on the running loop once it has finished,
+        e.g. because the loop it ran on was closed by asyncio.run(), or when
+        spans are finished on a different loop.
+        """
+        if self._periodic_flush_seconds <= 0 or self._disabled_runtime:
+            return
+        loop = _running_loop()
+        if loop is None:
+            return
+        task = self._flush_task
+        if task is not None and loop is self._loop and not task.done():
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_task = loop.create_task(self._flush_periodically_async())
+
+    def _after_fork(self):
+        super(AsyncRecorder, self)._after_fork()
+        # Event loops do not carry over into a forked child.
+        self._loop = None
+        self._flush_task = None
+        self._async_connection = None
+        self._async_connection_loop = None
+        self._wakeup = None
+        self._stopping = None
+
+    def _get_async_connection(self):
+        """Return the connection for the running loop. Pooled sockets cannot
+        be used from another loop, so a new loop gets a new connection."""
+        loop = _running_loop()
+        if self._async_connection is None or self._async_connection_loop is not loop:
+            if self._async_connection is not None:
+                self._async_connection.close()
+            self._async_connection = self._create_connection(_AsyncHTTPConnection)
+            self._async_connection.open()
+            self._async_connection_loop = loop
+        return self._async_connection
+
+    def _request_flush(self):
+        wakeup = self._wakeup
+        loop = self._loop
+        if wakeup is None or wakeup.is_set():
+            return
+        running = _running_loop()
+        if running is loop:
+            wakeup.set()
+        elif running is None and not loop.is_closed():
+            # Spans finished in executor threads.
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # The loop was closed in the meantime.
+                pass
+        # Spans finished on another loop have started a flush task there
+        # already (see _maybe_init_flush_thread).
+
+    def flush(self, connection=None):
+        """Immediately send unreported data to the server.
+
+        Inside a coroutine this returns a task wrapping flush_async();
+        otherwise it flushes synchronously and returns whether data was sent.
+        """
+        if self._disabled_runtime:
+            return False
+        if _running_loop() is not None:
+            return asyncio.ensure_future(self.flush_async(connection))
+        if connection is not None:
+            return self._flush_worker(connection, respect_backoff=False)
+        if self._flush_connection is None:
+            self._flush_connection = self._create_connection()
+            self._flush_connection.open()
+        return self._flush_worker(self._flush_connection, respect_backoff=False)
+
+    async def flush_async(self, connection=None):
+        """Coroutine form of flush(). `connection` must have coroutine
+        report() and send() methods, like _AsyncHTTPConnection."""
+        if self._disabled_runtime:
+            return False
+        if connection is None:
+            self._maybe_init_flush_thread()
+            connection = self._get_async_connection()
+        return await self._flush_worker_async(connection, respect_backoff=False)
+
+    def shutdown(self, flush=True):
+        """Flush (optionally) and disable the recorder.
+
+        Inside a coroutine this returns a task wrapping shutdown_async().
+        """
+        if self._disabled_runtime:
+            return False
+        if _running_loop() is not None:
+            return asyncio.ensure_future(self.shutdown_async(flush))
+        flushed = super(AsyncRecorder, self).shutdown(flush)
+        if self._async_connection is not None:
+            self._async_connection.close()
+        if self._flush_task is not None and not self._flush_task.done() and \
+                not self._loop.is_closed():
+            # Let the flush task notice once the loop runs again.
+            try:
+                self._loop.call_soon_threadsafe(self._wake_for_shutdown)
+            except RuntimeError:
+                pass
+        return flushed
+
+    async def shutdown_async(self, flush=True):
+        """Coroutine form of shutdown()."""
+        if self._disabled_runtime:
+            return False
+        flushed = False
+        self._draining = True
+        if flush:
+            flushed = await self.flush_async()
+        self._disabled_runtime = True
+        if self._flush_task is not None and self._loop is _running_loop():
+            self._wake_for_shutdown()
+            try:
+                await self._flush_task
+            except Exception as e:
+                self._fine("Flush task failed: {0}", (e,))
+        if self._async_connection is not None:
+            self._async_connection.close()
+        if self._flush_connection is not None:
+            self._flush_connection.close()
+        return flushed
+
+    def _wake_for_shutdown(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def _flush_periodically_async(self):
+        """Send reports to the server every periodic_flush_seconds, or sooner
+        when record_span() signals that the buffer is filling up.
+
+        Runs as a task on the event loop (self._flush_task).
+        """
+        connection = self._get_async_connection()
+        while not self._disabled_runtime:
+            await self._flush_worker_async(connection)
+            backoff = self._retry_queue.backoff_remaining(time.time())
+            # Waking up early for a full buffer would only spin against the
+            # backoff, so sit it out.
+            event = self._stopping if backoff > 0 else self._wakeup
+            try:
+                await asyncio.wait_for(event.wait(),
+                                       backoff or self._periodic_flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _flush_worker_async(self, connection, respect_backoff=True):
+        """Coroutine form of Recorder._flush_worker()."""
+        if respect_backoff and not self._retry_queue.ready(time.time()):
+            return False
+        if not await self._send_retries_async(connection):
+            return False
+
+        # Up to flush_workers reports are sent concurrently.
+        flushed = False
+        report_requests = self._iter_report_requests()
+        while True:
+            batch = list(itertools.islice(report_requests, self._flush_workers))
+            if not batch:
+                return flushed
+            sent = await asyncio.gather(*[self._send_report_async(connection, r)
+                                          for r in batch])
+            if not all(sent):
+                return False
+            flushed = flushed or any(self.converter.num_span_records(r) > 0
+                                     for r in batch)
+
+    async def _send_report_async(self, connection, report_request):
+        """Coroutine form of Recorder._send_report()."""
+        start = time.time()
+        try:
+            self._finest("Attempting to send report to collector: {0}", (report_request,))
+            resp = await connection.report(self._auth, report_request)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._report_failed(connection, report_request, e)
+            return False
+        self._report_succeeded(report_request, resp, start)
+        return True
+
+    async def _send_retries_async(self, connection):
+        """Coroutine form of Recorder._send_retries()."""
+        while True:
+            payload = self._pop_retry()
+            if payload is None:
+                return True
+            start = time.time()
+            try:
+                await connection.send(self._auth, payload)
+            except asyncio.CancelledError:
+                self._retry_queue.push_front(payload)
+                raise
+            except Exception as e:
+                self._retry_failed(payload, e)
+                return False
+            self._retry_succeeded(payload, start)
@@ -0,0 +1,182 @@
+"""Connection class spreading reports over several collector endpoints."""
+import threading
+import time
+
+from . import constants
+from .http_connection import _HTTPConnection
+
+
+class _Endpoint(object):
+    """A collector URL, its connection and its passive health state."""
+
+    def __init__(self, url, connection):
+        self.url = url
+        self.connection = connection
+        # Reports being sent to this endpoint right now.
+        self.outstanding = 0
+        # Consecutive failed reports, and consecutive ejections.
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        # Moving average of the report latency in seconds, None until the
+        # first report went through.
+        self.latency = None
+
+
+class _BalancedConnection(object):
+    """Sends reports to several collector endpoints (e.g. HEC indexers with
+    no load balancer in front), one _HTTPConnection each.
+
+    Each report goes to the endpoint with the fewest reports in flight, ties
+    being broken round robin. A report that fails is tried on the other
+    healthy endpoints in turn before the failure is passed on, to be queued
+    for retry.
+
+    Health is checked passively. An endpoint is ejected from the rotation
+    after ENDPOINT_EJECT_FAILURES consecutive failures, or when its average
+    latency is over ENDPOINT_SLOW_SECS and ENDPOINT_SLOW_FACTOR times that
+    of the fastest other endpoint. It is brought back after
+    ENDPOINT_EJECT_SECS, doubling with each consecutive ejection up to
+    ENDPOINT_MAX_EJECT_SECS; a report that goes through resets that. While
+    every endpoint is ejected, the one due back first is used anyway.
+    """
+
+    def __init__(self, collector_urls, timeout_seconds, stats=None,
+                 clock=time.time, **kwargs):
+        if not collector_urls:
+            raise ValueError('at least one collector endpoint is required')
+        self._endpoints = [
+            _Endpoint(url, _HTTPConnection(url, timeout_seconds, stats=stats, **kwargs))
+            for url in collector_urls]
+        self._stats = stats
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Where the round robin tie-break starts next.
+        self._next = 0
+
+    @property
+    def ready(self):
+        return any(e.connection.ready for e in self._endpoints)
+
+    def open(self):
+        """Open the connection to every endpoint."""
+        for endpoint in self._endpoints:
+            endpoint.connection.open()
+
+    def close(self):
+        """Close the connection to every endpoint."""
+        for endpoint in self._endpoints:
+            endpoint.connection.close()
+
+    def healthy_endpoints(self):
+        """Return the URLs of the endpoints currently in the rotation."""
+        now = self._clock()
+        with self._lock:
+            return [e.url for e in self._endpoints if e.ejected_until <= now]
+
+    def _acquire(self, tried):
+        """Pick the endpoint for the next attempt, skipping those in `tried`.
+
+        Returns None once no healthy endpoint is left to try.
+        """
+        now = self._clock()
+        with self._lock:
+            count = len(self._endpoints)
+            candidates = []
+            for i in range(count):
+                index = (self._next + i) % count
+                endpoint = self._endpoints[index]
+                if endpoint not in tried and endpoint.ejected_until <= now:
+                    candidates.append((endpoint.outstanding, i, index))
+            if candidates:
+                _, _, index = min(candidates)
+            elif tried:
+                return None
+            else:
+                # Everything is ejected; use the endpoint due back first.
+                index = min(range(count), key=lambda i: self._endpoints[i].ejected_until)
+            self._next = (index + 1) % count
+            endpoint = self._endpoints[index]
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint, latency):
+        """Account for an attempt on `endpoint` that took `latency` seconds,
+        or failed if latency is None."""
+        now = self._clock()
+        with self._lock:
+            endpoint.outstanding -= 1
+            if latency is None:
+                endpoint.failures += 1
+                if endpoint.failures >= constants.ENDPOINT_EJECT_FAILURES:
+                    self._eject(endpoint, now)
+                return
+            endpoint.failures = 0
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                alpha = constants.ENDPOINT_LATENCY_ALPHA
+                endpoint.latency = alpha * latency + (1 - alpha) * endpoint.latency
+            others = [e.latency for e in self._endpoints
+                      if e is not endpoint and e.latency is not None and e.ejected_until <= now]
+            if others and endpoint.latency > max(constants.ENDPOINT_SLOW_SECS,
+                                                 constants.ENDPOINT_SLOW_FACTOR * min(others)):
+                self._eject(endpoint, now)
+            elif endpoint.ejected_until <= now:
+                endpoint.ejections = 0
+
+    def _eject(self, endpoint, now):
+        """Take an endpoint out of the rotation. Must be called with
+        self._lock held."""
+        endpoint.ejections += 1
+        delay = min(constants.ENDPOINT_MAX_EJECT_SECS,
+                    constants.ENDPOINT_EJECT_SECS * (2 ** min(endpoint.ejections - 1, 32)))
+        endpoint.ejected_until = now + delay
+        endpoint.failures = 0
+        # Judged afresh once it is back.
+        endpoint.latency = None
+        if self._stats is not None:
+            self._stats.incr('endpoint_ejections')
+
+    def _attempt(self, fn):
+        """Call fn(connection) on endpoints in turn until it succeeds; raise
+        the last error if it fails on every healthy endpoint."""
+        tried = []
+        error = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise error
+            tried.append(endpoint)
+            start = self._clock()
+            try:
+                result = fn(endpoint.connection)
+            except Exception as e:
+                self._release(endpoint, None)
+                error = e
+                continue
+            self._release(endpoint, self._clock() - start)
+            return result
+
+    def encode(self, report):
+        """Serialize and compress `report` into a _Payload for send()."""
+        return self._endpoints[0].connection.encode(report)
+
+    # May throw an Exception on failure.
+    def report(self, auth, report):
+        """Send a report to one of the endpoints.
+
+        With several endpoints, the report is encoded once up front so that
+        it can be sent again on failover.
+        """
+        if len(report.spans) == 0 and not report.metrics:
+            return None
+        if len(self._endpoints) == 1:
+            return self._attempt(lambda connection: connection.report(auth, report))
+        payload = self.encode(report)
+        return self.send(auth, payload)
+
+    # May throw an Exception on failure.
+    def send(self, auth, payload):
+        """Send a _Payload produced by encode() to one of the endpoints."""
+        return self._attempt(lambda connection: connection.send(auth, payload))
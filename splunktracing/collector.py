@@ -1,14 +1,52 @@
-import json
-import copy
+from . import json_encoder
+
+# Keys that every span or log event sets itself. Reporter tags with these
+# names are left out of the events rather than clobbering span data.
+_EVENT_KEYS = frozenset(["trace_id", "span_id", "parent_span_id", "operation_name",
+                         "tags", "baggage", "timestamp", "duration", "fields"])
+
+
+def _splice_tags(encoded_object, tags_fragment):
+    """Add pre-encoded reporter tags to a JSON-encoded object."""
+    if not tags_fragment:
+        return encoded_object
+    if encoded_object == b"{}":
+        return b"".join((b"{", tags_fragment, b"}"))
+    return b"".join((encoded_object[:-1], b",", tags_fragment, b"}"))
+
+
+def _envelope(dumps, timestamp, sourcetype, event, tags_fragment):
+    """Encode a HEC event around `event`, with the reporter tags added to it.
+
+    The envelope is written out key by key rather than encoded as a dict, so
+    the splice does not depend on the order the encoder puts keys in.
+    """
+    return b"".join((b'{"time":', dumps(timestamp),
+                     b',"sourcetype":', dumps(sourcetype),
+                     b',"event":', _splice_tags(dumps(event), tags_fragment), b"}"))
 
 
 class ReportRequest(object):
-    def __init__(self, reporter, spans):
+    def __init__(self, reporter, spans, encoder=None, metrics=None):
         self.reporter = reporter
         self.spans = spans
+        self.metrics = metrics
+        if encoder is None:
+            encoder = json_encoder.StdlibJSONEncoder()
+        self.encoder = encoder
 
-    def serialize_to_string(self):
-        report_objs = []
+    def iter_serialized(self):
+        """Yield the report's HEC events one UTF-8 encoded JSON document at a
+        time.
+
+        Each span contributes one event per log followed by the span event
+        itself. Only a single event is materialized at any point, so callers
+        can stream arbitrarily large reports.
+        """
+        dumps = self.encoder.dumps
+        tags_fragment = self.reporter.tags_fragment(self.encoder)
+        if self.metrics is not None:
+            yield self.metrics.encode(dumps, tags_fragment)
         for span in self.spans:
             span_dict = {
                 "trace_id": span.span_context.trace_id,
@@ -18,50 +56,105 @@ class ReportRequest(object):
                 "tags": span.tags,
                 "baggage": span.span_context.baggage
             }
-            span_dict.update(self.reporter.tags)
             for log in span.logs:
-                log_event = {
-                    "time": log["timestamp"],
-                    "sourcetype": "splunktracing:log",
-                    "event": {"fields": log , "timestamp": log["timestamp"]}
-                }
-                log_event["event"].update(span_dict)
-                report_objs.append(log_event)
+                log_dict = {"fields": log, "timestamp": log["timestamp"]}
+                log_dict.update(span_dict)
+                yield _envelope(dumps, log["timestamp"], "splunktracing:log",
+                                log_dict, tags_fragment)
             span_dict["timestamp"] = span.start_timestamp
             span_dict["duration"] = span.duration_micros
-            span_event = {
-                "time": span.start_timestamp,
-                "sourcetype": "splunktracing:span",
-                "event": span_dict
-            }
-            report_objs.append(span_event)
-        return "\n".join([json.dumps(obj) for obj in report_objs])
+            yield _envelope(dumps, span.start_timestamp, "splunktracing:span",
+                            span_dict, tags_fragment)
+
+    def serialize_to_string(self):
+        return b"\n".join(self.iter_serialized()).decode('utf-8')
+
+
+class MetricSet(object):
+    """A set of tracer self-telemetry values, sent as a single multiple-metric
+    HEC event with the reporter tags as dimensions."""
+
+    def __init__(self, timestamp, values, index=None):
+        self.timestamp = timestamp
+        self.values = values
+        self.index = index
+
+    def encode(self, dumps, tags_fragment):
+        """Encode the event, with the reporter tags added to its fields."""
+        fields = dict(("metric_name:" + name, value)
+                      for name, value in self.values.items())
+        parts = [b'{"time":', dumps(self.timestamp),
+                 b',"event":"metric","sourcetype":"splunktracing:metrics"']
+        if self.index is not None:
+            parts.extend((b',"index":', dumps(self.index)))
+        parts.extend((b',"fields":', _splice_tags(dumps(fields), tags_fragment), b"}"))
+        return b"".join(parts)
 
 
 class Span(object):
-    def __init__(self, span_context, operation_name, start_timestamp, duration_micros, tags={}, logs=[]):
+    """A span record buffered for the next report.
+
+    Recorders keep up to max_span_records of these, so they have no
+    per-instance __dict__.
+    """
+    __slots__ = ('span_context', 'operation_name', 'start_timestamp',
+                 'duration_micros', 'tags', 'logs')
+
+    def __init__(self, span_context, operation_name, start_timestamp, duration_micros,
+                 tags=None, logs=None):
         self.span_context = span_context
         self.operation_name = operation_name
         self.start_timestamp = start_timestamp
         self.duration_micros = duration_micros
-        self.tags = tags
-        self.logs = logs
+        self.tags = {} if tags is None else tags
+        self.logs = [] if logs is None else logs
 
 
 class Reporter(object):
+    __slots__ = ('reporter_id', 'tags', '_tags_fragments')
+
     def __init__(self, reporter_id, tags):
         self.reporter_id = reporter_id
         self.tags = tags
+        self._tags_fragments = {}
+
+    def tags_fragment(self, encoder):
+        """Return the reporter tags encoded with `encoder` as the members of a
+        JSON object, without the surrounding braces.
+
+        The tags rarely change once the runtime is created, so the encoding
+        is computed on first use and reused for every event of every report.
+        """
+        fragments = self._tags_fragments
+        fragment = fragments.get(encoder.name)
+        if fragment is None:
+            tags = dict((k, v) for k, v in self.tags.items() if k not in _EVENT_KEYS)
+            fragment = encoder.dumps(tags)[1:-1]
+            fragments[encoder.name] = fragment
+        return fragment
+
+    def set_tag(self, key, value):
+        """Set a reporter tag after the fact, e.g. once the host metadata is
+        known. Safe to call while reports are being serialized."""
+        tags = dict(self.tags)
+        tags[key] = value
+        self.tags = tags
+        self._tags_fragments = {}
 
 
 class SpanContext(object):
-    def __init__(self, trace_id, span_id, parent_id, baggage={}):
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'baggage')
+
+    def __init__(self, trace_id, span_id, parent_id, baggage=None):
         self.trace_id = trace_id
         self.span_id = span_id
         self.parent_id = parent_id
-        self.baggage = baggage
+        self.baggage = {} if baggage is None else baggage
+
 
 class Timestamp(object):
+    __slots__ = ('seconds', 'nanos')
+
     def __init__(self, seconds, nanos):
         self.seconds = seconds
         self.nanos = nanos
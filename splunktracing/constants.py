@@ -2,8 +2,45 @@
 
 # Runtime constants
 FLUSH_THREAD_NAME = 'Flush Thread'
+FLUSH_WORKER_THREAD_NAME = 'Flush Worker'
+DEFAULT_FLUSH_WORKERS = 1
 FLUSH_PERIOD_SECS = 2.5
 DEFAULT_MAX_SPAN_RECORDS = 1000
+DEFAULT_MAX_BUFFER_BYTES = 4 * 1024 * 1024
+# Fraction of max_span_records / max_buffer_bytes at which the flush thread
+# is woken up ahead of its next periodic flush.
+DEFAULT_FLUSH_HIGH_WATER_MARK = 0.5
+
+# Connection constants
+DEFAULT_CONNECTION_POOL_SIZE = 2
+DEFAULT_CONNECTION_IDLE_SECS = 30
+# Serialized events are gathered into blocks of about this many bytes before
+# being handed to the compressor and sent as one chunk of the request body.
+REPORT_CHUNK_BYTES = 64 * 1024
+
+# Compression constants
+COMPRESSION_CODECS = ('gzip', 'none')
+DEFAULT_COMPRESSION_LEVEL = 6
+# Reports smaller than this are sent uncompressed.
+DEFAULT_COMPRESSION_MIN_BYTES = 1024
+
+# Collector endpoint health (see Recorder collector_endpoints). An endpoint
+# is ejected after this many consecutive failed reports, or when its average
+# report latency is over ENDPOINT_SLOW_SECS and ENDPOINT_SLOW_FACTOR times
+# that of the fastest other endpoint. It is brought back after a delay that
+# doubles with every consecutive ejection.
+ENDPOINT_EJECT_FAILURES = 3
+ENDPOINT_SLOW_SECS = 0.5
+ENDPOINT_SLOW_FACTOR = 4.0
+# Weight of the latest report in the average latency.
+ENDPOINT_LATENCY_ALPHA = 0.3
+ENDPOINT_EJECT_SECS = 5.0
+ENDPOINT_MAX_EJECT_SECS = 300.0
+
+# Retry constants
+DEFAULT_RETRY_BUFFER_BYTES = 4 * 1024 * 1024
+RETRY_INITIAL_BACKOFF_SECS = 1.0
+RETRY_MAX_BACKOFF_SECS = 60.0
 
 # Reserved Span keys
 PARENT_SPAN_GUID = 'parent_span_guid'
@@ -29,6 +66,43 @@ SECONDS_TO_MICRO = 1000000
 SECONDS_TO_NANOS = 1000000000
 
 # Recorder constants
+# Upper bound on the fields of a single log, in bytes.
 MAX_LOG_MEMORY = 1024
+# Upper bound on a single tag value or log field value, in characters.
 MAX_LOG_LEN = 984
+# Approximate buffer cost of a span record (ids, timestamps and container
+# overhead) and of a log record, not counting their tags and fields.
+SPAN_RECORD_OVERHEAD_BYTES = 256
+LOG_RECORD_OVERHEAD_BYTES = 64
+# Buffer cost assumed for a tag and a log before deferred conversion
+# measures them.
+ESTIMATED_TAG_BYTES = 64
+ESTIMATED_LOG_BYTES = 256
 JOIN_ID_TAG_PREFIX = "join:"
+# Number of span and trace ids whose hex form the converter keeps around.
+HEX_ID_CACHE_SIZE = 4096
+# How long creating a Recorder waits for the IP address of the host to be
+# looked up. Reports carry it once known either way.
+DEFAULT_METADATA_TIMEOUT_SECS = 0.0
+
+# Tail sampling: a trace is decided once it has been quiet this long, and at
+# most this many traces and spans are held waiting for a decision.
+TAIL_DECISION_WAIT_SECS = 5.0
+DEFAULT_TAIL_MAX_TRACES = 10000
+DEFAULT_TAIL_MAX_SPANS = 100000
+
+# Sidecar aggregation (see splunktracing.aggregator).
+# Name of the aggregator socket in its default, per-user directory (see
+# aggregator.default_socket_path()).
+AGGREGATOR_SOCKET_NAME = 'aggregator.sock'
+# Largest frame a worker may send to the aggregator.
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+# Uncompressed size the aggregator aims for in each upload, and the most it
+# holds waiting for one.
+AGGREGATOR_REPORT_BYTES = 4 * 1024 * 1024
+AGGREGATOR_MAX_BUFFER_BYTES = 64 * 1024 * 1024
+
+# Disk spill of reports that failed to send (see Recorder spill_directory).
+DEFAULT_SPILL_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_SPILL_MAX_AGE_SECS = 3600
+SPILL_SEGMENT_BYTES = 4 * 1024 * 1024
@@ -19,6 +19,9 @@ class Converter(object):
     def create_span_record(self, span, guid):
         pass
 
+    def create_span_records(self, spans, guid):
+        return [self.create_span_record(span, guid) for span in spans]
+
     @abstractmethod
     def append_attribute(self, span_record, key, value):
         pass
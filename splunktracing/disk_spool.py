@@ -0,0 +1,305 @@
+"""Queue of encoded reports waiting to be re-sent, kept on disk."""
+import errno
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from . import constants
+from .http_connection import _Payload
+from .retry_queue import _RetryQueue
+
+# Each record in a segment file is this header followed by the body: the
+# time it was written, the body length, the span count, the uncompressed
+# size and the index of the Content-Encoding in _ENCODINGS.
+_RECORD_HEADER = struct.Struct('>dIIIB')
+_ENCODINGS = (None, 'gzip')
+_SEGMENT_SUFFIX = '.seg'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _segment_owner(name):
+    """Return the pid in a segment file name, or None for other files."""
+    if not name.endswith(_SEGMENT_SUFFIX):
+        return None
+    pid, _, seq = name[:-len(_SEGMENT_SUFFIX)].partition('-')
+    if not (pid.isdigit() and seq.isdigit()):
+        return None
+    return int(pid)
+
+
+class _DiskSpool(_RetryQueue):
+    """A _RetryQueue that keeps its payloads in files under `directory`
+    instead of on the heap, so a long collector outage costs disk rather
+    than memory.
+
+    Payloads are appended to segment files of about `segment_bytes`. They
+    are replayed oldest first by memory-mapping one finished segment at a
+    time; a segment is deleted once it has been replayed. When the
+    segments take more than `max_bytes`, the oldest are deleted, and
+    payloads older than `max_age_seconds` are skipped on replay.
+
+    Each process writes segments named after its pid. Segments left behind
+    by processes that are no longer running, e.g. before a restart, are
+    taken over when the spool first replays (so a pre-fork server's workers
+    adopt them, not its master) and go before any payloads of its own.
+    Payloads dropped by replay rather than by push(), for their age or
+    because the adopted segments do not fit, are handed out by
+    take_dropped(). Writes are not fsync'ed: spilled reports
+    survive a crash of the process, not of the machine.
+    """
+
+    def __init__(self, directory, max_bytes, max_age_seconds,
+                 initial_backoff_seconds, max_backoff_seconds,
+                 segment_bytes=constants.SPILL_SEGMENT_BYTES, rng=None):
+        super(_DiskSpool, self).__init__(max_bytes, initial_backoff_seconds,
+                                         max_backoff_seconds, rng)
+        self._directory = directory
+        self._max_age_seconds = max_age_seconds
+        self._segment_bytes = min(segment_bytes, max(1, max_bytes // 4))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._next_seq = 0
+        # [path, size] of each segment, oldest first.
+        self._segments = deque()
+        self._writer = None
+        self._reader = None
+        self._read_offset = 0
+        # Payloads put back by push_front(); they were read already.
+        self._front = deque()
+        self._count = 0
+        self._bytes = 0
+        self._adopted = False
+        # Stand-ins for the payloads dropped since the last take_dropped().
+        self._dropped = []
+
+    def __len__(self):
+        return self._count
+
+    def _new_segment_path(self):
+        while True:
+            path = os.path.join(self._directory, '{0}-{1:012d}{2}'.format(
+                self._pid, self._next_seq, _SEGMENT_SUFFIX))
+            self._next_seq += 1
+            # Skip the names of segments an earlier process with the same
+            # pid left behind.
+            if not os.path.exists(path):
+                return path
+
+    def _adopt_orphans(self):
+        """Take over the segments of processes that are gone, ahead of our
+        own. Must be called with self._lock held."""
+        self._adopted = True
+        own = set(path for path, _ in self._segments)
+        orphans = []
+        for name in os.listdir(self._directory):
+            pid = _segment_owner(name)
+            path = os.path.join(self._directory, name)
+            if pid is not None and path not in own and (
+                    pid == self._pid or not _pid_alive(pid)):
+                try:
+                    orphans.append((os.path.getmtime(path), name, path))
+                except OSError:
+                    pass
+        adopted = []
+        for _, _, path in sorted(orphans):
+            new_path = self._new_segment_path()
+            try:
+                os.rename(path, new_path)
+            except OSError:
+                # Another process adopted it first.
+                continue
+            count, size = self._scan(new_path)
+            adopted.append([new_path, size])
+            self._count += count
+            self._bytes += size
+        # The segment being appended to has to stay last.
+        self._segments.extendleft(reversed(adopted))
+        self._dropped.extend(self._enforce_limit())
+
+    @staticmethod
+    def _records(buf, offset=0):
+        """Yield the (offset, header fields) of the complete records in buf."""
+        while offset + _RECORD_HEADER.size <= len(buf):
+            fields = _RECORD_HEADER.unpack_from(buf, offset)
+            end = offset + _RECORD_HEADER.size + fields[1]
+            if end > len(buf):
+                return
+            yield offset, fields
+            offset = end
+
+    def _scan(self, path):
+        """Count the records of a segment, cutting off a record torn by a
+        crash. Returns the count and the resulting file size."""
+        with open(path, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return 0, 0
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                count = 0
+                valid = 0
+                for offset, fields in self._records(buf):
+                    count += 1
+                    valid = offset + _RECORD_HEADER.size + fields[1]
+            finally:
+                buf.close()
+            if valid < size:
+                f.truncate(valid)
+            return count, valid
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _drop_oldest_segment(self):
+        """Delete the oldest segment; returns stand-ins for the payloads it
+        still held, for the caller to count."""
+        path, size = self._segments.popleft()
+        if self._reader is not None:
+            buf, offset = self._reader, self._read_offset
+            self._reader = None
+        else:
+            if not self._segments:
+                self._close_writer()
+            buf, offset = None, 0
+            try:
+                with open(path, 'rb') as f:
+                    if size:
+                        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (IOError, OSError):
+                pass
+        dropped = []
+        if buf is not None:
+            for _, fields in self._records(buf, offset):
+                dropped.append(_Payload(b'', _ENCODINGS[fields[4]], fields[2], fields[3]))
+            buf.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._count -= len(dropped)
+        self._bytes -= size
+        return dropped
+
+    def _enforce_limit(self):
+        dropped = []
+        while self._bytes > self._max_bytes and self._segments:
+            dropped.extend(self._drop_oldest_segment())
+        self.dropped_payloads += len(dropped)
+        return dropped
+
+    def _add(self, payload, append):
+        # Only push() gets here; push_front() keeps its payload in memory.
+        record_size = _RECORD_HEADER.size + len(payload.body)
+        with self._lock:
+            if record_size > self._max_bytes:
+                self.dropped_payloads += 1
+                return [payload]
+            if self._writer is None or self._segments[-1][1] >= self._segment_bytes:
+                self._close_writer()
+                path = self._new_segment_path()
+                # Unbuffered, so a forked child never flushes leftovers of
+                # the parent's writes.
+                self._writer = open(path, 'ab', 0)
+                self._segments.append([path, 0])
+            self._writer.write(_RECORD_HEADER.pack(
+                time.time(), len(payload.body), payload.span_count,
+                payload.raw_size, _ENCODINGS.index(payload.content_encoding)) +
+                payload.body)
+            self._segments[-1][1] += record_size
+            self._count += 1
+            self._bytes += record_size
+            return self._enforce_limit()
+
+    def push_front(self, payload):
+        """Put back a payload that was just popped and failed again."""
+        with self._lock:
+            self._front.appendleft(payload)
+            self._count += 1
+        return []
+
+    def _read_next(self):
+        """Return the (written_at, payload) of the next record on disk, or
+        None. Must be called with self._lock held."""
+        while self._segments:
+            if self._reader is None:
+                path, size = self._segments[0]
+                if len(self._segments) == 1:
+                    # Never replay a segment that is still being appended to.
+                    self._close_writer()
+                if size == 0:
+                    self._drop_oldest_segment()
+                    continue
+                with open(path, 'rb') as f:
+                    self._reader = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._read_offset = 0
+            for offset, fields in self._records(self._reader, self._read_offset):
+                start = offset + _RECORD_HEADER.size
+                self._read_offset = start + fields[1]
+                body = self._reader[start:self._read_offset]
+                self._count -= 1
+                return fields[0], _Payload(body, _ENCODINGS[fields[4]], fields[2], fields[3])
+            # Replayed in full.
+            self._drop_oldest_segment()
+        return None
+
+    def pop(self):
+        """Remove and return the oldest payload, or None if the spool is
+        empty. Payloads past max_age_seconds are discarded on the way."""
+        with self._lock:
+            if not self._adopted:
+                self._adopt_orphans()
+            if self._front:
+                self._count -= 1
+                return self._front.popleft()
+            now = time.time()
+            while True:
+                record = self._read_next()
+                if record is None:
+                    return None
+                written_at, payload = record
+                if self._max_age_seconds is None or now - written_at <= self._max_age_seconds:
+                    return payload
+                self.dropped_payloads += 1
+                self._dropped.append(_Payload(b'', payload.content_encoding,
+                                              payload.span_count, payload.raw_size))
+
+    def take_dropped(self):
+        """Return and forget the payloads pop() dropped along the way."""
+        with self._lock:
+            dropped, self._dropped = self._dropped, []
+        return dropped
+
+    def _after_fork(self):
+        """Start an empty spool of the child's own; the parent keeps its
+        segments and file handles. The child adopts the orphaned segments
+        on its first replay."""
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._next_attempt = 0
+        self.dropped_payloads = 0
+        self._reset()
+
+    def clear(self):
+        """Drop every queued payload and delete the segments."""
+        with self._lock:
+            self._front.clear()
+            while self._segments:
+                self._drop_oldest_segment()
+            self._count = 0
+            self._bytes = 0
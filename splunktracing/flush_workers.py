@@ -0,0 +1,75 @@
+"""Threads that send reports concurrently for the Recorder."""
+import threading
+import time
+
+from six.moves import queue
+
+
+class _FlushWorkers(object):
+    """A fixed set of daemon threads running submitted jobs, so several
+    reports can be in flight to the collector at once.
+
+    submit() blocks while every worker is busy and `count` more jobs are
+    already waiting. The flush thread submitting reports is thereby held
+    back, and spans stay in the buffer (and its limits), rather than piling
+    up in drained reports.
+    """
+
+    def __init__(self, count, name):
+        self._queue = queue.Queue(maxsize=count)
+        self._idle = threading.Condition()
+        # Jobs submitted and not finished yet.
+        self._pending = 0
+        self._threads = []
+        for i in range(count):
+            thread = threading.Thread(target=self._run, name='{0} {1}'.format(name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __len__(self):
+        return len(self._threads)
+
+    def submit(self, fn, *args):
+        """Have a worker call fn(*args)."""
+        with self._idle:
+            self._pending += 1
+        self._queue.put((fn, args))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            fn, args = job
+            try:
+                fn(*args)
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait until every submitted job has finished. Returns whether they
+        did within `timeout` seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._pending:
+                if deadline is None:
+                    self._idle.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self):
+        """Let the workers exit once the jobs already submitted are done."""
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                # Busy until the process exits; they are daemon threads.
+                break
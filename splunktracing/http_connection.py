@@ -1,52 +1,260 @@
 """Connection class establishes HTTP connection with server.
     Utilized to send Proto Report Requests.
 """
+import itertools
 import threading
-import requests
+import time
 import zlib
 
+from collections import namedtuple
+
+from . import constants
+
+# A report that has already been serialized and compressed.
+_Payload = namedtuple('_Payload', ['body', 'content_encoding', 'span_count', 'raw_size'])
+
 
 class _HTTPConnection(object):
     """Instances of _Connection are used to establish a connection to the
     server via HTTP protocol.
+
+    Reports are sent through a pooled requests.Session so that consecutive
+    flushes reuse warm keep-alive (and TLS) connections. Connections that
+    have sat unused for longer than `idle_seconds` are dropped before the
+    next report rather than risking a send on a socket the collector has
+    already closed.
+
+    Report bodies are gzip-compressed at `compression_level` unless they are
+    smaller than `compression_min_bytes` or `compression` is 'none'. With
+    `adaptive_compression`, the level is lowered one step whenever a report
+    takes longer than `latency_budget_seconds`, and raised back towards
+    `compression_level` once reports comfortably fit the budget again.
+
+    Reports may be sent from several threads at once, each over its own
+    pooled connection. At most `pool_size` connections are open; further
+    requests wait for one to free up. The lock only guards the session and
+    the bookkeeping around it, not the requests themselves.
     """
 
-    def __init__(self, collector_url, timeout_seconds):
+    def __init__(self, collector_url, timeout_seconds,
+                 pool_size=constants.DEFAULT_CONNECTION_POOL_SIZE,
+                 idle_seconds=constants.DEFAULT_CONNECTION_IDLE_SECS,
+                 compression='gzip',
+                 compression_level=constants.DEFAULT_COMPRESSION_LEVEL,
+                 compression_min_bytes=constants.DEFAULT_COMPRESSION_MIN_BYTES,
+                 adaptive_compression=False,
+                 latency_budget_seconds=None,
+                 stats=None):
         self._collector_url = collector_url
         self._lock = threading.Lock()
-        self.ready = True
+        self.ready = False
         self._timeout_seconds = timeout_seconds
+        self._pool_size = pool_size
+        self._idle_seconds = idle_seconds
+        self._session = None
+        self._last_used = None
+        # Reports being sent right now; idle connections are only reaped
+        # when there are none.
+        self._in_flight = 0
+        self._compression = compression
+        self._max_compression_level = compression_level
+        self.compression_level = compression_level
+        self._compression_min_bytes = compression_min_bytes
+        self._adaptive_compression = adaptive_compression and bool(latency_budget_seconds)
+        self._latency_budget_seconds = latency_budget_seconds
+        self._stats = stats
 
     def open(self):
         """Establish HTTP connection to the server."""
-        pass
+        with self._lock:
+            if self._session is None:
+                # Imported on first use; requests (and urllib3, certifi) is
+                # the bulk of what importing the tracer used to cost.
+                import requests
+                from requests.adapters import HTTPAdapter
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self._pool_size,
+                                      pool_block=True)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._last_used = None
+            self.ready = True
+
+    def _reap_idle_connections(self, now):
+        """Drop pooled connections that have been idle for too long.
+
+        Must be called with self._lock held. The session stays usable; its
+        pools are simply emptied and repopulated on the next request.
+        """
+        if self._idle_seconds is None or self._last_used is None or self._in_flight:
+            return
+        if now - self._last_used > self._idle_seconds:
+            self._session.close()
+            self._last_used = None
+
+    @staticmethod
+    def _blocks(events):
+        """Gather serialized events into newline-delimited blocks of about
+        REPORT_CHUNK_BYTES each."""
+        block = []
+        block_size = 0
+        for event in events:
+            block.append(event)
+            block.append(b'\n')
+            block_size += len(event) + 1
+            if block_size >= constants.REPORT_CHUNK_BYTES:
+                yield b''.join(block)
+                block = []
+                block_size = 0
+        if block:
+            yield b''.join(block)
+
+    @staticmethod
+    def _gzip_chunks(blocks, level):
+        """Yield the gzip-compressed form of `blocks` piece by piece, so memory
+        use stays bounded by the block size rather than the report size."""
+        gzip_compress = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for block in blocks:
+            chunk = gzip_compress.compress(block)
+            if chunk:
+                yield chunk
+        yield gzip_compress.flush()
+
+    @staticmethod
+    def _counted(chunks, size, index):
+        """Pass `chunks` through, adding their lengths to size[index]."""
+        for chunk in chunks:
+            size[index] += len(chunk)
+            yield chunk
+
+    def _encode_body(self, report):
+        """Return the request body for `report`, its Content-Encoding, and a
+        [raw, encoded] list of body sizes.
+
+        Events are serialized lazily. Until compression_min_bytes worth of them
+        have been produced the report may still turn out small enough to send
+        as is; past that point the body becomes a generator that compresses
+        (or, with compression 'none', just blocks) the rest as it is sent,
+        and the sizes are only final once it has been consumed.
+        """
+        events = report.iter_serialized()
+        head = []
+        head_size = 0
+        for event in events:
+            head.append(event)
+            head_size += len(event) + 1
+            if head_size >= self._compression_min_bytes:
+                size = [0, 0]
+                blocks = self._counted(self._blocks(itertools.chain(head, events)), size, 0)
+                if self._compression == 'none':
+                    return self._counted(blocks, size, 1), None, size
+                body = self._gzip_chunks(blocks, self.compression_level)
+                return self._counted(body, size, 1), 'gzip', size
+        body = b''.join(self._blocks(head))
+        return body, None, [len(body), len(body)]
+
+    def _count_sent(self, raw_size, encoded_size):
+        if self._stats is not None:
+            self._stats.incr('bytes_uncompressed', raw_size)
+            self._stats.incr('bytes_compressed', encoded_size)
+
+    def _adapt_compression_level(self, elapsed):
+        """Trade compression ratio for flush latency, see the class docstring.
+
+        Must be called with self._lock held.
+        """
+        if not self._adaptive_compression:
+            return
+        if elapsed > self._latency_budget_seconds:
+            self.compression_level = max(1, self.compression_level - 1)
+        elif elapsed < self._latency_budget_seconds / 4:
+            self.compression_level = min(self._max_compression_level,
+                                         self.compression_level + 1)
+
+    def _post(self, auth, body, content_encoding):
+        """POST a report body to the collector and return the response body.
+
+        Raises a RequestException when
+        the collector cannot be reached or answers that it is overloaded or
+        broken (HTTP 429 or 5xx), i.e. whenever sending again later might
+        succeed.
+        """
+        headers = {"Content-Type": "application/json",
+                   "Authorization": "Splunk %s" % auth}
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+        r = self._session.post(
+            self._collector_url,
+            headers=headers,
+            data=body,
+            timeout=self._timeout_seconds)
+        if r.status_code == 429 or r.status_code >= 500:
+            r.raise_for_status()
+        return r.content
+
+    def encode(self, report):
+        """Serialize and compress `report` into a _Payload that can be sent,
+        possibly several times, with send()."""
+        body, content_encoding, size = self._encode_body(report)
+        if not isinstance(body, bytes):
+            body = b''.join(body)
+        return _Payload(body, content_encoding, len(report.spans), size[0])
+
+    def _begin(self):
+        """Prepare for a request; pair with _end()."""
+        if self._session is None:
+            self.open()
+        with self._lock:
+            self._reap_idle_connections(time.time())
+            self._in_flight += 1
+
+    def _end(self, elapsed=None):
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.time()
+            if elapsed is not None:
+                self._adapt_compression_level(elapsed)
 
     # May throw an Exception on failure.
     def report(self, *args, **kwargs):
-        """Report to the server."""
+        """Report to the server.
+
+        Large bodies are streamed to the collector with chunked transfer
+        encoding as they are serialized and compressed.
+        """
         auth = args[0]
         report = args[1]
-        with self._lock:
-            try:
-                data = report.serialize_to_string()
-                if len(data) > 0:
-                    gzip_compress = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
-                    payload = gzip_compress.compress(data) + gzip_compress.flush()
-                    headers = {"Content-Type": "application/json",
-                               "Content-Encoding": 'gzip',
-                               "Content-Length": str(len(payload)),
-                               "Authorization": "Splunk %s" % auth}
-                    r = requests.post(
-                        self._collector_url,
-                        headers=headers,
-                        data=payload,
-                        timeout=self._timeout_seconds)
-                    resp = r.content
-                    return resp
-            except requests.exceptions.RequestException as err:
-                raise err
+        if not (len(report.spans) > 0 or report.metrics):
+            return None
+        self._begin()
+        elapsed = None
+        try:
+            start = time.time()
+            body, content_encoding, size = self._encode_body(report)
+            resp = self._post(auth, body, content_encoding)
+            self._count_sent(size[0], size[1])
+            elapsed = time.time() - start
+            return resp
+        finally:
+            self._end(elapsed)
+
+    # May throw an Exception on failure.
+    def send(self, auth, payload):
+        """Send a _Payload produced by encode() to the server."""
+        self._begin()
+        try:
+            resp = self._post(auth, payload.body, payload.content_encoding)
+            self._count_sent(payload.raw_size, len(payload.body))
+            return resp
+        finally:
+            self._end()
 
     def close(self):
         """Close HTTP connection to the server."""
-        self.ready = False
-        pass
+        with self._lock:
+            self.ready = False
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -1,6 +1,8 @@
-import socket
 import sys
 
+from . import constants
+from . import json_encoder
+from . import runtime_metadata
 from . import util
 from . import version as tracer_version
 
@@ -10,13 +12,36 @@ from splunktracing.converter import Converter
 
 class HttpConverter(Converter):
 
-
-    def create_runtime(self, component_name, tags, guid):
+    def __init__(self, encoder='auto'):
+        self.encoder = json_encoder.get_encoder(encoder)
+        # Hex form of recently converted ids. The spans of a trace share its
+        # trace id and siblings share their parent id, so most lookups hit.
+        self._hex_ids = {}
+
+    def _hex_id(self, id):
+        hex_ids = self._hex_ids
+        value = hex_ids.get(id)
+        if value is None:
+            if len(hex_ids) >= constants.HEX_ID_CACHE_SIZE:
+                hex_ids.clear()
+            value = hex_ids[id] = '%x' % int(id)
+        return value
+
+    def create_runtime(self, component_name, tags, guid, hostname=None,
+                       ip_address=None,
+                       metadata_timeout_seconds=constants.DEFAULT_METADATA_TIMEOUT_SECS):
+        """Create the Reporter for a tracer.
+
+        The host name and IP address are taken from `hostname` and
+        `ip_address` when given, and from the process-wide
+        runtime_metadata.host otherwise. An IP address that is not known
+        within `metadata_timeout_seconds` is left out of the tags and added
+        once the lookup finishes.
+        """
         if component_name is None:
             component_name = sys.argv[0]
 
-        host_name = socket.gethostname()
-        ip_address = util.local_ip()
+        host_name = hostname if hostname is not None else runtime_metadata.host.hostname()
         python_version = '.'.join(map(str, sys.version_info[0:3]))
 
         if tags is None:
@@ -30,28 +55,55 @@ class HttpConverter(Converter):
             'component_name': component_name,
             'guid': util._id_to_hex(guid),
             'device': host_name,
-            'ip_address': ip_address
         })
 
         # Convert tracer_tags to a list of KeyValue pairs.
         runtime_attrs = tracer_tags
 
-        return Reporter(reporter_id=guid, tags=runtime_attrs)
+        reporter = Reporter(reporter_id=guid, tags=runtime_attrs)
+        if ip_address is None:
+            ip_address = runtime_metadata.host.ip_address(
+                metadata_timeout_seconds,
+                callback=lambda ip: reporter.set_tag('ip_address', ip))
+            if ip_address is None:
+                return reporter
+        reporter.set_tag('ip_address', ip_address)
+        return reporter
 
     def create_span_record(self, span, guid):
-        if span.parent_id:
-            pid = util._id_to_hex(int(span.parent_id))
-        else:
-            pid = span.parent_id
-        span_context = SpanContext(trace_id=util._id_to_hex(int(span.context.trace_id)),
-                                   span_id=util._id_to_hex(int(span.context.span_id)),
-                                   parent_id=pid)
-        seconds, nanos = util._time_to_seconds_nanos(span.start_time)
-        span_record = Span(span_context=span_context,
-                           operation_name=util._coerce_str(span.operation_name),
-                           start_timestamp="%d.%d" % (seconds, nanos),
-                           duration_micros=int(util._time_to_micros(span.duration)))
-        return span_record
+        hex_id = self._hex_id
+        parent_id = span.parent_id
+        span_context = SpanContext(trace_id=hex_id(span.context.trace_id),
+                                   span_id=hex_id(span.context.span_id),
+                                   parent_id=hex_id(parent_id) if parent_id else parent_id)
+        return Span(span_context=span_context,
+                    operation_name=util._coerce_str(span.operation_name),
+                    start_timestamp=util._format_timestamp(span.start_time),
+                    duration_micros=util._time_to_micros(span.duration),
+                    tags={},
+                    logs=[])
+
+    def create_span_records(self, spans, guid):
+        """Same as create_span_record for each of `spans`, in one pass with
+        the helpers looked up once."""
+        hex_id = self._hex_id
+        coerce_str = util._coerce_str
+        format_timestamp = util._format_timestamp
+        to_micros = util._time_to_micros
+        records = []
+        append = records.append
+        for span in spans:
+            context = span.context
+            parent_id = span.parent_id
+            append(Span(SpanContext(hex_id(context.trace_id),
+                                    hex_id(context.span_id),
+                                    hex_id(parent_id) if parent_id else parent_id),
+                        coerce_str(span.operation_name),
+                        format_timestamp(span.start_time),
+                        to_micros(span.duration),
+                        {},
+                        []))
+        return records
 
     def append_attribute(self, span_record, key, value):
         span_record.tags[key] = value
@@ -65,8 +117,9 @@ class HttpConverter(Converter):
             log_dict.update(log.key_values)
             span_record.logs.append(log_dict)
 
-    def create_report(self, runtime, span_records):
-        return ReportRequest(reporter=runtime, spans=span_records)
+    def create_report(self, runtime, span_records, metrics=None):
+        return ReportRequest(reporter=runtime, spans=span_records, encoder=self.encoder,
+                             metrics=metrics)
 
     def combine_span_records(self, report_request, span_records):
         report_request.spans.extend(span_records)
@@ -0,0 +1,136 @@
+"""JSON encoder backends used to serialize HEC events.
+
+Every backend produces the same compact, UTF-8 encoded output for strings,
+integers, booleans, None and floats written in positional notation, which
+covers the timestamps and durations the tracer itself emits. Floats passed
+in by the application, e.g. as log fields, may come out differently:
+
+- exponent form: orjson writes 1e16 and 1e-7, ujson 1e+16 and 1e-7, where
+  the json module writes 1e+16 and 1e-07;
+- NaN and infinity: orjson writes null, the others NaN and Infinity (which
+  are not valid JSON).
+
+Both forms decode to the same values, but not to the same bytes.
+"""
+import json
+
+from . import util
+
+ENCODER_NAMES = ('auto', 'orjson', 'ujson', 'json')
+
+
+def _default(obj):
+    """Encode values the backends do not understand (e.g. an exception object
+    passed to log_kv) as their string form instead of failing the report."""
+    return util._coerce_str(obj)
+
+
+class JSONEncoder(object):
+    """Base class for encoder backends.
+
+    dumps() takes a JSON-compatible object and returns its UTF-8 encoded,
+    compact (no whitespace) JSON representation as bytes.
+    """
+
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+
+class StdlibJSONEncoder(JSONEncoder):
+    """Encoder backed by the standard library json module."""
+
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'),
+                                         ensure_ascii=False,
+                                         default=_default)
+
+    def dumps(self, obj):
+        # Lone surrogates (e.g. from a path decoded with 'surrogateescape')
+        # cannot be encoded as UTF-8; they are written as \uXXXX escapes,
+        # as with ensure_ascii.
+        return self._encoder.encode(obj).encode('utf-8', 'backslashreplace')
+
+
+class _FallbackEncoder(JSONEncoder):
+    """Base class for the third-party backends: values they refuse (e.g.
+    orjson with integers beyond 64 bits, for which `default` is not called,
+    or strings holding lone surrogates) are encoded by the standard library
+    instead of failing the report."""
+
+    _fallback = None
+
+    def dumps(self, obj):
+        try:
+            return self._backend_dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            # ValueError includes the UnicodeEncodeError of ujson's output.
+            if self._fallback is None:
+                self._fallback = StdlibJSONEncoder()
+            return self._fallback.dumps(obj)
+
+    def _backend_dumps(self, obj):
+        raise NotImplementedError
+
+
+class OrjsonEncoder(_FallbackEncoder):
+    """Encoder backed by orjson."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def _backend_dumps(self, obj):
+        # orjson.JSONEncodeError is a TypeError.
+        return self._dumps(obj, default=_default, option=self._option)
+
+
+class UjsonEncoder(_FallbackEncoder):
+    """Encoder backed by ujson (5.x or newer)."""
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._dumps = ujson.dumps
+
+    def _backend_dumps(self, obj):
+        return self._dumps(obj,
+                           ensure_ascii=False,
+                           escape_forward_slashes=False,
+                           default=_default).encode('utf-8')
+
+
+_BACKENDS = {
+    'json': StdlibJSONEncoder,
+    'orjson': OrjsonEncoder,
+    'ujson': UjsonEncoder,
+}
+
+
+def get_encoder(name='auto'):
+    """Return a JSONEncoder for the given backend name.
+
+    `name` may be 'orjson', 'ujson', 'json', or 'auto' to pick the fastest
+    installed backend. An existing JSONEncoder instance is returned as is.
+    Asking for a specific backend that is not installed raises ImportError.
+    """
+    if isinstance(name, JSONEncoder):
+        return name
+    if name == 'auto':
+        for backend in (OrjsonEncoder, UjsonEncoder):
+            try:
+                return backend()
+            except ImportError:
+                pass
+        return StdlibJSONEncoder()
+    if name not in _BACKENDS:
+        raise ValueError('json_encoder must be one of {0}, got {1!r}'.format(
+            ', '.join(ENCODER_NAMES), name))
+    return _BACKENDS[name]()
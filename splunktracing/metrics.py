@@ -0,0 +1,136 @@
+"""Self-telemetry for the Recorder: counters and a flush latency histogram."""
+import threading
+import weakref
+
+# Upper bounds, in seconds, of the flush duration histogram buckets.
+FLUSH_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                          5.0, 10.0, float('inf'))
+
+COUNTERS = (
+    # Spans accepted into the buffer by record_span.
+    'spans_recorded',
+    # Spans turned away by record_span because the buffer was full.
+    'spans_dropped',
+    # Spans of traces the tail sampler decided not to keep.
+    'spans_sampled_out',
+    # Spans delivered to the collector, first attempt or retry.
+    'spans_flushed',
+    # Spans of failed reports kept for another attempt.
+    'spans_retried',
+    # Spans of failed reports given up on (retry buffer full).
+    'spans_retry_dropped',
+    'reports_sent',
+    'reports_failed',
+    # Times a collector endpoint was taken out of rotation as unhealthy.
+    'endpoint_ejections',
+    # Report body bytes delivered, before and after compression.
+    'bytes_uncompressed',
+    'bytes_compressed',
+    # Bytes of tag values and log fields cut by the size limits.
+    'bytes_truncated',
+)
+
+
+class _Histogram(object):
+    """Cumulative-bucket histogram, as used by Prometheus and friends."""
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum,
+                'max': self.max}
+
+
+class _Stats(object):
+    """Counters and histograms describing what a Recorder has done.
+
+    Counters are sharded per thread: each thread only ever increments its own
+    shard, so record_span can count without taking a lock and without losing
+    concurrent updates. Reading sums up all shards.
+
+    Once its thread has exited, a shard is folded into the counts of dead
+    threads, so thread-per-request servers do not pile up shards.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (weak reference to the thread, shard) for each thread counting.
+        self._shards = []
+        # Counts of the threads that have exited.
+        self._base = dict.fromkeys(COUNTERS, 0)
+        self._flush_duration = _Histogram(FLUSH_DURATION_BUCKETS)
+        self.last_error = None
+
+    def _new_shard(self):
+        shard = dict.fromkeys(COUNTERS, 0)
+        with self._lock:
+            self._fold_dead_shards()
+            self._shards.append((weakref.ref(threading.current_thread()), shard))
+        self._local.counts = shard
+        return shard
+
+    def _fold_dead_shards(self):
+        """Add the shards of exited threads to self._base and drop them. Must
+        be called with self._lock held."""
+        live = []
+        for ref, shard in self._shards:
+            thread = ref()
+            if thread is not None and thread.is_alive():
+                live.append((ref, shard))
+            else:
+                # The thread is gone, so nothing increments the shard anymore.
+                for name in COUNTERS:
+                    self._base[name] += shard[name]
+        self._shards = live
+
+    def incr(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        try:
+            counts = self._local.counts
+        except AttributeError:
+            counts = self._new_shard()
+        counts[name] += value
+
+    def observe_flush(self, seconds):
+        """Record the duration of a flush."""
+        with self._lock:
+            self._flush_duration.observe(seconds)
+
+    def get(self, name):
+        """Return the current value of the counter `name`."""
+        with self._lock:
+            self._fold_dead_shards()
+            return self._base[name] + sum(shard[name] for _, shard in self._shards)
+
+    def snapshot(self):
+        """Return a dict with every counter and the flush_duration_seconds
+        histogram."""
+        with self._lock:
+            self._fold_dead_shards()
+            result = dict(self._base)
+            for _, shard in self._shards:
+                for name in COUNTERS:
+                    result[name] += shard[name]
+            result['flush_duration_seconds'] = self._flush_duration.snapshot()
+        result['last_error'] = self.last_error
+        return result
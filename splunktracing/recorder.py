@@ -7,18 +7,54 @@ See the API definition for comments.
 """
 
 import atexit
-import ssl
+import os
+from collections import deque, namedtuple
 import threading
 import time
 import traceback
 import warnings
+import weakref
 
+import six
 from basictracer.recorder import SpanRecorder
+from basictracer.span import LogData
 
+from splunktracing.balanced_connection import _BalancedConnection
+from splunktracing.collector import MetricSet
+from splunktracing.disk_spool import _DiskSpool
+from splunktracing.flush_workers import _FlushWorkers
 from splunktracing.http_converter import HttpConverter
 from . import constants
 from . import util
 from splunktracing.http_connection import _HTTPConnection
+from splunktracing.metrics import _Stats
+from splunktracing.retry_queue import _RetryQueue
+from splunktracing.tail_sampling import _has_error
+from splunktracing.unix_connection import _UnixSocketConnection
+
+
+# The fields of a finished BasicSpan that span conversion reads. Capturing
+# them is all record_span does when deferred_conversion is on.
+_SpanSnapshot = namedtuple('_SpanSnapshot', [
+    'operation_name', 'context', 'parent_id', 'start_time', 'duration',
+    'tags', 'logs'])
+
+
+# Recorders alive in this process, reset in the child after a fork().
+_recorders = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    util._reseed_guid_rng()
+    for recorder in list(_recorders):
+        recorder._after_fork()
+
+
+# Without os.register_at_fork (Python < 3.7), recorders notice a fork by
+# comparing process ids as spans are recorded.
+_FORK_HOOKS = hasattr(os, 'register_at_fork')
+if _FORK_HOOKS:
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 class Recorder(SpanRecorder):
@@ -29,7 +65,15 @@ class Recorder(SpanRecorder):
     For parameter semantics, see Tracer() documentation; Recorder() respects
     component_name, access_token, collector_host, collector_port,
     collector_encryption, tags, max_span_records, periodic_flush_seconds,
-    verbosity, and certificate_verification,
+    verbosity, certificate_verification, timeout_seconds,
+    connection_pool_size, connection_idle_seconds, deferred_conversion,
+    json_encoder, compression, compression_level, compression_min_bytes,
+    adaptive_compression, retry_buffer_bytes, retry_initial_backoff_seconds,
+    retry_max_backoff_seconds, max_buffer_bytes, max_value_length,
+    max_log_bytes, flush_high_water_mark, emit_metrics, metrics_index,
+    tail_sampler, collector_socket, spill_directory, spill_max_bytes,
+    spill_max_age_seconds, flush_workers, max_report_bytes,
+    collector_endpoints, hostname, ip_address, and metadata_timeout_seconds.
     """
     def __init__(self,
                  component_name=None,
@@ -42,34 +86,130 @@ class Recorder(SpanRecorder):
                  periodic_flush_seconds=constants.FLUSH_PERIOD_SECS,
                  verbosity=0,
                  certificate_verification=True,
-                 timeout_seconds=30):
+                 timeout_seconds=30,
+                 connection_pool_size=constants.DEFAULT_CONNECTION_POOL_SIZE,
+                 connection_idle_seconds=constants.DEFAULT_CONNECTION_IDLE_SECS,
+                 deferred_conversion=False,
+                 json_encoder='auto',
+                 compression='gzip',
+                 compression_level=constants.DEFAULT_COMPRESSION_LEVEL,
+                 compression_min_bytes=constants.DEFAULT_COMPRESSION_MIN_BYTES,
+                 adaptive_compression=False,
+                 retry_buffer_bytes=constants.DEFAULT_RETRY_BUFFER_BYTES,
+                 retry_initial_backoff_seconds=constants.RETRY_INITIAL_BACKOFF_SECS,
+                 retry_max_backoff_seconds=constants.RETRY_MAX_BACKOFF_SECS,
+                 max_buffer_bytes=constants.DEFAULT_MAX_BUFFER_BYTES,
+                 max_value_length=constants.MAX_LOG_LEN,
+                 max_log_bytes=constants.MAX_LOG_MEMORY,
+                 flush_high_water_mark=constants.DEFAULT_FLUSH_HIGH_WATER_MARK,
+                 emit_metrics=False,
+                 metrics_index=None,
+                 tail_sampler=None,
+                 collector_socket=None,
+                 spill_directory=None,
+                 spill_max_bytes=constants.DEFAULT_SPILL_MAX_BYTES,
+                 spill_max_age_seconds=constants.DEFAULT_SPILL_MAX_AGE_SECS,
+                 flush_workers=constants.DEFAULT_FLUSH_WORKERS,
+                 max_report_bytes=None,
+                 collector_endpoints=None,
+                 hostname=None,
+                 ip_address=None,
+                 metadata_timeout_seconds=constants.DEFAULT_METADATA_TIMEOUT_SECS):
         self.verbosity = verbosity
         # Fail fast on a bad access token
         if not isinstance(access_token, str):
             raise Exception('access_token must be a string')
+        if compression not in constants.COMPRESSION_CODECS:
+            raise ValueError('compression must be one of {0}, got {1!r}'.format(
+                ', '.join(constants.COMPRESSION_CODECS), compression))
+        if not 1 <= compression_level <= 9:
+            raise ValueError('compression_level must be between 1 and 9')
+        if flush_workers < 1:
+            raise ValueError('flush_workers must be at least 1')
+        if collector_endpoints is not None:
+            if not collector_endpoints:
+                raise ValueError('collector_endpoints must not be empty')
+            if collector_socket is not None:
+                raise ValueError('collector_endpoints and collector_socket are exclusive')
 
         if certificate_verification is False:
             warnings.warn('SSL CERTIFICATE VERIFICATION turned off. ALL FUTURE HTTPS calls will be unverified.')
+            import ssl
             ssl._create_default_https_context = ssl._create_unverified_context
 
-        self.converter = HttpConverter()
+        self.converter = HttpConverter(json_encoder)
+        self._component_name = component_name
+        self._tags = tags
+        self._hostname = hostname
+        self._ip_address = ip_address
+        self._metadata_timeout_seconds = metadata_timeout_seconds
+        self._pid = os.getpid()
         self.guid = util._generate_guid()
-        self._runtime = self.converter.create_runtime(component_name, tags, self.guid)
+        self._runtime = self._create_runtime()
         self._finest("Initialized with Tracer runtime: {0}", (self._runtime,))
         secure = collector_encryption != 'none'  # the default is 'tls'
         self._collector_url = util._collector_url_from_hostport(
                 secure,
                 collector_host,
                 collector_port)
+        # With collector_endpoints, reports are spread over these instead.
+        self._collector_urls = None
+        if collector_endpoints is not None:
+            self._collector_urls = [
+                util._collector_url_from_hostport(
+                    secure, *util._split_hostport(endpoint, collector_port))
+                for endpoint in collector_endpoints]
+            self._collector_url = self._collector_urls[0]
+        self._collector_socket = collector_socket
         self._timeout_seconds = timeout_seconds
+        self._connection_pool_size = connection_pool_size
+        self._connection_idle_seconds = connection_idle_seconds
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_min_bytes = compression_min_bytes
+        self._adaptive_compression = adaptive_compression
         self._auth = access_token
-        self._mutex = threading.Lock()
-        self._span_records = []
+        # Finished span records are handed from the application threads to
+        # the flush thread through a deque: append() and popleft() are atomic,
+        # so neither side ever has to take a lock. Each entry is a
+        # (size, record) pair, size being the approximate number of bytes the
+        # record accounts for against max_buffer_bytes.
+        self._span_records = deque()
         self._max_span_records = max_span_records
+        self._max_buffer_bytes = max_buffer_bytes
+        # Updated without a lock, so concurrent updates can be lost; the
+        # drift is discarded whenever the buffer is found empty.
+        self._buffered_bytes = 0
+        self._max_value_length = max_value_length
+        self._max_log_bytes = max_log_bytes
+        self._stats = _Stats()
+        self._reported_truncated_bytes = 0
+        self._emit_metrics = emit_metrics
+        self._metrics_index = metrics_index
+        self._deferred_conversion = deferred_conversion
+        self._flush_workers = flush_workers
+        self._max_report_bytes = max_report_bytes
+        self._tail_sampler = tail_sampler
+        # Set by shutdown() so that the last flush decides every trace still
+        # held by the tail sampler.
+        self._draining = False
+        # Reports that failed to send wait here, already encoded, until the
+        # collector accepts them again.
+        if spill_directory is not None:
+            self._retry_queue = _DiskSpool(spill_directory,
+                                           spill_max_bytes,
+                                           spill_max_age_seconds,
+                                           retry_initial_backoff_seconds,
+                                           retry_max_backoff_seconds)
+        else:
+            self._retry_queue = _RetryQueue(retry_buffer_bytes,
+                                            retry_initial_backoff_seconds,
+                                            retry_max_backoff_seconds)
 
         self._disabled_runtime = False
 
         atexit.register(self.shutdown)
+        _recorders.add(self)
 
         self._periodic_flush_seconds = periodic_flush_seconds
         # _flush_connection and _flush_thread are created lazily since some
@@ -77,6 +217,18 @@ class Recorder(SpanRecorder):
         # reporting machinery up otherwise.
         self._flush_connection = None
         self._flush_thread = None
+        # With flush_workers > 1, the flush thread hands reports to these
+        # threads instead of sending them itself.
+        self._flush_pool = None
+        # The flush thread waits on _flush_event between flushes; it is set
+        # early once the buffer passes the high-water mark, so bursts get
+        # flushed rather than dropped.
+        self._flush_event = threading.Event()
+        self._shutdown_event = threading.Event()
+        self._high_water_records = max(1, int(max_span_records * flush_high_water_mark))
+        self._high_water_bytes = None
+        if max_buffer_bytes is not None:
+            self._high_water_bytes = int(max_buffer_bytes * flush_high_water_mark)
         if self._periodic_flush_seconds <= 0:
             warnings.warn(
                 'Runtime(periodic_flush_seconds={0}) means we will never flush to Splunk unless explicitly requested.'.format(
@@ -92,14 +244,71 @@ class Recorder(SpanRecorder):
         We do these things lazily because things like `tornado` break if the
         background flush thread starts before `fork()` calls happen.
         """
+        if not _FORK_HOOKS and self._pid != os.getpid():
+            util._reseed_guid_rng()
+            self._after_fork()
         if (self._periodic_flush_seconds > 0) and (self._flush_thread is None):
-            self._flush_connection = _HTTPConnection(self._collector_url, self._timeout_seconds)
-            self._flush_connection.open()
+            # Opened by the flush thread, so the first span recorded does not
+            # wait on the transport being imported and set up.
+            self._flush_connection = self._create_connection()
+            if self._flush_workers > 1:
+                self._flush_pool = _FlushWorkers(self._flush_workers,
+                                                 constants.FLUSH_WORKER_THREAD_NAME)
             self._flush_thread = threading.Thread(target=self._flush_periodically,
                                                   name=constants.FLUSH_THREAD_NAME)
             self._flush_thread.daemon = True
             self._flush_thread.start()
 
+    def _create_runtime(self):
+        return self.converter.create_runtime(
+            self._component_name, self._tags, self.guid, hostname=self._hostname,
+            ip_address=self._ip_address,
+            metadata_timeout_seconds=self._metadata_timeout_seconds)
+
+    def _after_fork(self):
+        """Reset the state inherited from the parent process after fork().
+
+        The child reports as a new reporter: it gets its own guid and runtime
+        tags, and starts with an empty buffer and retry queue, since those
+        spans are the parent's to report. Locks, events, the connection and
+        the flush thread are replaced too; the parent's threads do not exist
+        in the child and may have held the locks when it forked.
+        """
+        self._pid = os.getpid()
+        self.guid = util._generate_guid()
+        self._runtime = self._create_runtime()
+        self._span_records = deque()
+        self._buffered_bytes = 0
+        self._stats = _Stats()
+        self._reported_truncated_bytes = 0
+        self._retry_queue._after_fork()
+        if self._tail_sampler is not None:
+            self._tail_sampler._after_fork()
+        # Dropped rather than closed: the sockets are shared with the parent.
+        self._flush_connection = None
+        self._flush_thread = None
+        self._flush_pool = None
+        self._flush_event = threading.Event()
+        self._shutdown_event = threading.Event()
+
+    def _create_connection(self, connection_class=_HTTPConnection):
+        """Create the connection reports are sent through."""
+        if self._collector_socket is not None:
+            return _UnixSocketConnection(self._collector_socket,
+                                         self._timeout_seconds,
+                                         stats=self._stats)
+        kwargs = dict(pool_size=max(self._connection_pool_size, self._flush_workers),
+                      idle_seconds=self._connection_idle_seconds,
+                      compression=self._compression,
+                      compression_level=self._compression_level,
+                      compression_min_bytes=self._compression_min_bytes,
+                      adaptive_compression=self._adaptive_compression,
+                      latency_budget_seconds=self._periodic_flush_seconds,
+                      stats=self._stats)
+        if self._collector_urls is not None:
+            return _BalancedConnection(self._collector_urls, self._timeout_seconds, **kwargs)
+        return connection_class(self._collector_url, self._timeout_seconds, **kwargs)
+
     def _fine(self, fmt, args):
         if self.verbosity >= 1:
             fmt_args = fmt.format(*args)
@@ -113,39 +322,140 @@ class Recorder(SpanRecorder):
     def record_span(self, span):
         """Per BasicSpan.record_span, safely add a span to the buffer.
 
-        Will drop a previously-added span if the limit has been reached.
+        Will drop the span if the buffer limit has been reached. Spans of
+        traces that were not sampled are ignored.
         """
-        if self._disabled_runtime:
+        if self._disabled_runtime or not span.context.sampled:
             return
 
         # Lazy-init the flush loop (if need be).
         self._maybe_init_flush_thread()
 
-        # Checking the len() here *could* result in a span getting dropped that
-        # might have fit if a report started before the append(). This would only
-        # happen if the client lib was being saturated anyway (and likely
-        # dropping spans). But on the plus side, having the check here avoids
-        # doing a span conversion when the span will just be dropped while also
-        # keeping the lock scope minimized.
-        with self._mutex:
-            if len(self._span_records) >= self._max_span_records:
-                return
+        # The checks below are not synchronized with the append(), so a burst
+        # of concurrent callers can push the buffer a little past its limits.
+        # That is the price of never blocking a request thread on another;
+        # the checks still avoid converting spans that would be dropped
+        # anyway.
+        if len(self._span_records) >= self._max_span_records or (
+                self._max_buffer_bytes is not None and
+                self._buffered_bytes >= self._max_buffer_bytes):
+            self._stats.incr('spans_dropped')
+            return
+
+        if self._deferred_conversion:
+            # Size is only estimated here; the values are measured and
+            # truncated when the snapshot is converted on the flush thread.
+            tags = dict(span.tags) if span.tags else None
+            logs = tuple(span.logs)
+            size = (constants.SPAN_RECORD_OVERHEAD_BYTES +
+                    constants.ESTIMATED_TAG_BYTES * (len(tags) if tags else 0) +
+                    constants.ESTIMATED_LOG_BYTES * len(logs))
+            record = _SpanSnapshot(
+                span.operation_name,
+                span.context,
+                span.parent_id,
+                span.start_time,
+                span.duration,
+                tags,
+                logs)
+        else:
+            record, size = self._convert_span(span)
+        self._span_records.append((size, record))
+        self._buffered_bytes += size
+        self._stats.incr('spans_recorded')
+
+        if len(self._span_records) >= self._high_water_records or (
+                self._high_water_bytes is not None and
+                self._buffered_bytes >= self._high_water_bytes):
+            self._request_flush()
+
+    def _request_flush(self):
+        """Wake the flush thread ahead of its next periodic flush."""
+        if not self._flush_event.is_set():
+            self._flush_event.set()
+
+    def _truncate(self, value):
+        """Cut a string value to max_value_length characters.
+
+        Returns the (possibly shortened) value and the number of characters
+        removed.
+        """
+        if self._max_value_length is None or len(value) <= self._max_value_length:
+            return value, 0
+        return value[:self._max_value_length], len(value) - self._max_value_length
 
-        span_record = self.converter.create_span_record(span, self.guid)
+    def _truncate_log(self, log):
+        """Apply max_value_length to the fields of a log and drop fields past
+        max_log_bytes.
+
+        Returns a LogData holding the surviving fields, its approximate size
+        in bytes, and the number of bytes removed.
+        """
+        key_values = {}
+        size = constants.LOG_RECORD_OVERHEAD_BYTES
+        dropped = 0
+        for key, value in six.iteritems(log.key_values or {}):
+            if value is None or isinstance(value, (bool, float) + six.integer_types):
+                value_size = 8
+            else:
+                if isinstance(value, (six.text_type, six.binary_type)):
+                    text = value
+                else:
+                    text = util._coerce_str(value)
+                value_size = len(text)
+                if self._max_value_length is not None and value_size > self._max_value_length:
+                    value, cut = self._truncate(text)
+                    value_size -= cut
+                    dropped += cut
+            field_size = len(key) + value_size
+            if self._max_log_bytes is not None and size + field_size > self._max_log_bytes:
+                dropped += field_size
+                continue
+            key_values[key] = value
+            size += field_size
+        return LogData(key_values, log.timestamp), size, dropped
+
+    def _convert_span(self, span):
+        """Convert a BasicSpan (or a _SpanSnapshot of one) to a span record,
+        enforcing the tag and log size limits.
+
+        Returns the record and its approximate size in bytes.
+        """
+        return self._fill_span_record(
+            span, self.converter.create_span_record(span, self.guid))
+
+    def _convert_spans(self, spans):
+        """Convert many spans like _convert_span, creating the records (ids
+        and timestamps) in one batch. Returns the records only."""
+        span_records = self.converter.create_span_records(spans, self.guid)
+        fill = self._fill_span_record
+        return [fill(span, span_record)[0]
+                for span, span_record in zip(spans, span_records)]
+
+    def _fill_span_record(self, span, span_record):
+        """Add the tags and logs of `span` to its record; see _convert_span."""
+        size = constants.SPAN_RECORD_OVERHEAD_BYTES + len(span_record.operation_name)
+        dropped = 0
 
         if span.tags:
             for key in span.tags:
+                value, cut = self._truncate(util._coerce_str(span.tags[key]))
+                dropped += cut
+                size += len(key) + len(value)
                 if key[:len(constants.JOIN_ID_TAG_PREFIX)] == constants.JOIN_ID_TAG_PREFIX:
-                    self.converter.append_join_id(span_record, key, util._coerce_str(span.tags[key]))
+                    self.converter.append_join_id(span_record, key, value)
                 else:
-                    self.converter.append_attribute(span_record, key, util._coerce_str(span.tags[key]))
+                    self.converter.append_attribute(span_record, key, value)
 
         for log in span.logs:
+            log, log_size, cut = self._truncate_log(log)
+            dropped += cut
+            size += log_size
             self.converter.append_log(span_record, log)
 
-        with self._mutex:
-            if len(self._span_records) < self._max_span_records:
-                self._span_records.append(span_record)
+        if dropped:
+            self._stats.incr('bytes_truncated', dropped)
+        return span_record, size
 
     def flush(self, connection=None):
         """Immediately send unreported data to the server.
@@ -162,11 +472,13 @@ class Recorder(SpanRecorder):
         if self._disabled_runtime:
             return False
 
+        # An explicit flush is an attempt to get everything out now (e.g. at
+        # shutdown), so it does not wait for a retry backoff to run out.
         if connection is not None:
-            return self._flush_worker(connection)
+            return self._flush_worker(connection, respect_backoff=False)
         else:
             self._maybe_init_flush_thread()
-            return self._flush_worker(self._flush_connection)
+            return self._flush_worker(self._flush_connection, respect_backoff=False)
 
     def shutdown(self, flush=True):
         """Shutdown the Runtime's connection by (optionally) flushing the
@@ -181,34 +493,63 @@ class Recorder(SpanRecorder):
         if self._disabled_runtime:
             return False
 
+        flushed = False
+        self._draining = True
         if flush:
             flushed = self.flush()
+        pool = self._flush_pool
+        if pool is not None:
+            # Let the reports handed to the workers go out before the
+            # connection is closed.
+            pool.wait(self._timeout_seconds)
+            pool.stop()
 
         if self._flush_connection:
             self._flush_connection.close()
 
         self._disabled_runtime = True
+        # Wake the flush thread so it notices.
+        self._shutdown_event.set()
+        self._flush_event.set()
 
         return flushed
 
     def _flush_periodically(self):
-        """Periodically send reports to the server.
+        """Send reports to the server every periodic_flush_seconds, or sooner
+        when record_span() signals that the buffer is filling up.
 
         Runs in a dedicated daemon thread (self._flush_thread).
         """
         # Open the connection
+        self._flush_connection.open()
         while not self._disabled_runtime and not self._flush_connection.ready:
-            time.sleep(self._periodic_flush_seconds)
+            self._shutdown_event.wait(self._periodic_flush_seconds)
             self._flush_connection.open()
 
         # Send data until we get disabled
         while not self._disabled_runtime:
-            self._flush_worker(self._flush_connection)
-            time.sleep(self._periodic_flush_seconds)
-
-    def _flush_worker(self, connection):
-        """Use the given connection to transmit the current logs and spans as a
-        report request."""
+            self._flush_worker(self._flush_connection, pool=self._flush_pool)
+            backoff = self._retry_queue.backoff_remaining(time.time())
+            if backoff > 0:
+                # Waking up early for a full buffer would only spin against
+                # the backoff, so sit it out.
+                self._shutdown_event.wait(backoff)
+            else:
+                self._flush_event.wait(self._periodic_flush_seconds)
+            self._flush_event.clear()
+
+    def _flush_worker(self, connection, respect_backoff=True, pool=None):
+        """Use the given connection to transmit the current logs and spans as
+        report requests of at most max_report_bytes each.
+
+        Reports left over from earlier failures are re-sent first. While the
+        collector is failing, attempts are spaced out by the retry queue's
+        backoff unless respect_backoff is False.
+
+        With a _FlushWorkers `pool`, the reports are sent concurrently by its
+        workers; the return value then only says whether span data was handed
+        to them.
+        """
         if connection == None:
             return False
 
@@ -219,35 +560,260 @@ class Recorder(SpanRecorder):
         if not connection.ready:
             return False
 
-        report_request = self._construct_report_request()
+        if respect_backoff and not self._retry_queue.ready(time.time()):
+            # Spans stay buffered until the backoff runs out.
+            return False
+        if not self._send_retries(connection):
+            return False
+
+        flushed = False
+        for report_request in self._iter_report_requests():
+            has_spans = self.converter.num_span_records(report_request) > 0
+            if pool is not None:
+                pool.submit(self._send_report, connection, report_request)
+            elif not self._send_report(connection, report_request):
+                # What is left stays buffered for the next attempt.
+                return False
+            flushed = flushed or has_spans
+        return flushed
+
+    def _send_report(self, connection, report_request):
+        """Send one report. Returns whether it went through."""
+        start = time.time()
         try:
             self._finest("Attempting to send report to collector: {0}", (report_request,))
             resp = connection.report(self._auth, report_request)
-            self._finest("Received response from collector: {0}", (resp,))
-
-            # The resp may be None on failed reports
-            # if resp is not None:
-            #     if resp.commands is not None:
-            #         for command in resp.commands:
-            #             if command.disable:
-            #                 self.shutdown(flush=False)
-            # Return whether we sent any span data
-            return self.converter.num_span_records(report_request) > 0
-
         except Exception as e:
-            self._fine(
-                    "Caught exception during report: {0}, stack trace: {1}",
-                    (e, traceback.format_exc()))
-            self._restore_spans(report_request)
+            self._report_failed(connection, report_request, e)
             return False
+        self._report_succeeded(report_request, resp, start)
+        return True
+
+    def _report_succeeded(self, report_request, resp, start):
+        """Bookkeeping after `report_request`, sent at time `start`, went
+        through. Returns whether it carried any span data."""
+        self._finest("Received response from collector: {0}", (resp,))
+
+        # The resp may be None on failed reports
+        # if resp is not None:
+        #     if resp.commands is not None:
+        #         for command in resp.commands:
+        #             if command.disable:
+        #                 self.shutdown(flush=False)
+        # Return whether we sent any span data
+        if resp is not None:
+            self._stats.observe_flush(time.time() - start)
+            self._stats.incr('reports_sent')
+        span_count = self.converter.num_span_records(report_request)
+        if span_count > 0:
+            self._stats.incr('spans_flushed', span_count)
+            self._retry_queue.record_success()
+        return span_count > 0
+
+    def _report_failed(self, connection, report_request, e):
+        """Bookkeeping after sending `report_request` raised `e`."""
+        self._fine(
+                "Caught exception during report: {0}, stack trace: {1}",
+                (e, traceback.format_exc()))
+        self._stats.last_error = repr(e)
+        self._stats.incr('reports_failed')
+        self._retry_queue.record_failure(time.time())
+        self._queue_retry(connection, report_request)
+
+    def _send_retries(self, connection):
+        """Re-send queued payloads, oldest first.
+
+        Stops at the first failure, putting that payload back at the head of
+        the queue. Returns whether the queue was emptied.
+        """
+        while True:
+            payload = self._pop_retry()
+            if payload is None:
+                return True
+            start = time.time()
+            try:
+                connection.send(self._auth, payload)
+            except Exception as e:
+                self._retry_failed(payload, e)
+                return False
+            self._retry_succeeded(payload, start)
+
+    def _pop_retry(self):
+        """Pop the next queued payload, counting the spans of any the queue
+        dropped on the way (e.g. spilled reports past their max age)."""
+        payload = self._retry_queue.pop()
+        dropped = self._retry_queue.take_dropped()
+        if dropped:
+            self._fine("Dropped {0} queued report(s) on replay", (len(dropped),))
+            self._stats.incr('spans_retry_dropped', sum(p.span_count for p in dropped))
+        return payload
+
+    def _retry_succeeded(self, payload, start):
+        self._stats.observe_flush(time.time() - start)
+        self._stats.incr('reports_sent')
+        self._stats.incr('spans_flushed', payload.span_count)
+        self._retry_queue.record_success()
+
+    def _retry_failed(self, payload, e):
+        self._fine("Caught exception while re-sending report: {0}", (e,))
+        self._stats.last_error = repr(e)
+        self._stats.incr('reports_failed')
+        self._retry_queue.record_failure(time.time())
+        self._count_retry_drops(self._retry_queue.push_front(payload))
+
+    def _queue_retry(self, connection, report_request):
+        """Encode a report that failed to send and queue it for retry."""
+        span_count = self.converter.num_span_records(report_request)
+        if self._disabled_runtime or span_count == 0:
+            return
+        encode = getattr(connection, 'encode', None)
+        if encode is None:
+            # Connections that cannot encode payloads (e.g. test doubles)
+            # fall back to putting the spans back into the buffer.
+            self._restore_spans(report_request)
+            return
+        try:
+            payload = encode(report_request)
+        except Exception as e:
+            self._fine("Caught exception while encoding report for retry: {0}", (e,))
+            self._stats.incr('spans_retry_dropped', span_count)
+            return
+        self._stats.incr('spans_retried', span_count)
+        self._count_retry_drops(self._retry_queue.push(payload))
+
+    def _count_retry_drops(self, dropped):
+        if dropped:
+            self._fine("Retry buffer full, dropped {0} report(s)", (len(dropped),))
+            self._stats.incr('spans_retry_dropped', sum(p.span_count for p in dropped))
+
+    def stats(self):
+        """Return a dict describing what this recorder has done so far.
+
+        Besides the counters listed in splunktracing.metrics.COUNTERS, it has
+        the flush_duration_seconds histogram, the last report error (or
+        None), and the current buffered_spans, buffered_bytes,
+        retry_queue_reports and retry_queue_bytes, and the tail_traces and
+        tail_spans waiting for a tail sampling decision.
+        """
+        result = self._stats.snapshot()
+        result['buffered_spans'] = len(self._span_records)
+        result['buffered_bytes'] = max(0, self._buffered_bytes)
+        result['retry_queue_reports'] = len(self._retry_queue)
+        result['retry_queue_bytes'] = self._retry_queue.bytes
+        tail_sampler = self._tail_sampler
+        result['tail_traces'] = len(tail_sampler) if tail_sampler is not None else 0
+        result['tail_spans'] = tail_sampler.span_count if tail_sampler is not None else 0
+        return result
+
+    def _metric_values(self):
+        """Flatten stats() into the numeric values sent with emit_metrics."""
+        stats = self.stats()
+        flush_duration = stats.pop('flush_duration_seconds')
+        stats.pop('last_error')
+        values = dict(('splunktracing.' + name, value) for name, value in stats.items())
+        values['splunktracing.flush_duration_seconds.count'] = flush_duration['count']
+        values['splunktracing.flush_duration_seconds.sum'] = flush_duration['sum']
+        values['splunktracing.flush_duration_seconds.max'] = flush_duration['max']
+        return values
+
+    def _drain_span_records(self, max_bytes=None):
+        """Remove and return the records currently in the buffer, oldest first.
+
+        Only records present when the drain starts are taken, so producers
+        that keep appending cannot hold the flush thread here indefinitely.
+        With max_bytes, the drain stops before the records taken account for
+        more than that many bytes, though it always takes at least one.
+        """
+        records = []
+        drained_bytes = 0
+        span_records = self._span_records
+        popleft = span_records.popleft
+        for _ in range(len(span_records)):
+            try:
+                if (max_bytes is not None and records and
+                        drained_bytes + span_records[0][0] > max_bytes):
+                    break
+                size, record = popleft()
+            except IndexError:
+                # Another drainer (e.g. an explicit flush()) got there first.
+                break
+            records.append(record)
+            drained_bytes += size
+        if self._span_records:
+            self._buffered_bytes -= drained_bytes
+        else:
+            self._buffered_bytes = 0
+        return records
+
+    def _iter_report_requests(self):
+        """Drain the buffer into report requests of at most max_report_bytes
+        worth of records each.
+
+        Only the records buffered when iteration starts are taken. Records
+        stay buffered until their report is requested, so a caller that stops
+        early (e.g. after a failure) leaves the rest for the next flush.
+        Metrics go with the first report only.
+        """
+        remaining = len(self._span_records)
+        with_metrics = True
+        while True:
+            records = self._drain_span_records(self._max_report_bytes)
+            remaining -= len(records)
+            yield self._build_report_request(records, with_metrics)
+            with_metrics = False
+            if remaining <= 0 or not records:
+                return
 
     def _construct_report_request(self):
-        """Construct a report request."""
-        report = None
-        with self._mutex:
-            report = self.converter.create_report(self._runtime, self._span_records)
-            self._span_records = []
-        return report
+        """Construct a report request from every buffered record."""
+        return self._build_report_request(self._drain_span_records())
+
+    def _build_report_request(self, records, with_metrics=True):
+        """Construct a report request from drained records.
+
+        With deferred_conversion, this is where buffered snapshots are turned
+        into span records, in bulk and on the flushing thread. Records put
+        back by _restore_spans() are already converted.
+        """
+        if self._tail_sampler is not None:
+            records = self._tail_sample(records)
+        if self._deferred_conversion:
+            snapshots = [r for r in records if type(r) is _SpanSnapshot]
+            if snapshots:
+                converted = iter(self._convert_spans(snapshots))
+                records = [next(converted) if type(r) is _SpanSnapshot else r
+                           for r in records]
+        truncated = self._stats.get('bytes_truncated')
+        if truncated != self._reported_truncated_bytes:
+            self._fine("Truncated {0} bytes of span data since the last report",
+                       (truncated - self._reported_truncated_bytes,))
+            self._reported_truncated_bytes = truncated
+        metrics = None
+        if self._emit_metrics and with_metrics:
+            metrics = MetricSet(time.time(), self._metric_values(), self._metrics_index)
+        return self.converter.create_report(self._runtime, records, metrics)
+
+    def _tail_sample(self, records):
+        """Hand drained records to the tail sampler and return the records of
+        the traces it decided to keep.
+
+        This runs before deferred conversion, so dropped spans are never
+        converted.
+        """
+        spans = []
+        for record in records:
+            if type(record) is _SpanSnapshot:
+                spans.append((record.context.trace_id, record.duration,
+                              _has_error(record.tags), record))
+            else:
+                spans.append((int(record.span_context.trace_id, 16),
+                              record.duration_micros / float(constants.SECONDS_TO_MICRO),
+                              _has_error(record.tags), record))
+        kept, dropped = self._tail_sampler.process(spans, time.time(),
+                                                   flush_all=self._draining)
+        if dropped:
+            self._stats.incr('spans_sampled_out', dropped)
+        return kept
 
     def _restore_spans(self, report_request):
         """Called after a flush error to move records back into the buffer
@@ -255,8 +821,12 @@ class Recorder(SpanRecorder):
         if self._disabled_runtime:
             return
 
-        with self._mutex:
-            if len(self._span_records) >= self._max_span_records:
-                return
-            combined = self.converter.combine_span_records(report_request, self._span_records)
-            self._span_records = combined[-self._max_span_records:]
+        room = self._max_span_records - len(self._span_records)
+        if room <= 0:
+            return
+        records = self.converter.get_span_records(report_request)[-room:]
+        size = constants.SPAN_RECORD_OVERHEAD_BYTES
+        # The failed records predate anything buffered since, so they go back
+        # in at the front, keeping the newest of them if space is short.
+        self._span_records.extendleft((size, r) for r in reversed(records))
+        self._buffered_bytes += size * len(records)
@@ -0,0 +1,123 @@
+"""Queue of encoded reports waiting to be re-sent after a failed flush."""
+import random
+import threading
+from collections import deque
+
+
+class _RetryQueue(object):
+    """Holds already-serialized, already-compressed report payloads that
+    failed to send, oldest first, together with the backoff state shared by
+    every send to the collector.
+
+    Payloads are objects with a `body` bytes attribute. The queue keeps at
+    most `max_bytes` worth of bodies; when a new payload does not fit, the
+    oldest ones are dropped to make room.
+
+    After each consecutive failure, sends are held off for an exponentially
+    growing delay (starting at `initial_backoff_seconds`, capped at
+    `max_backoff_seconds`) of which a random half is jitter, so a fleet of
+    tracers that lost the collector at the same moment does not come back
+    to it in lockstep.
+    """
+
+    def __init__(self, max_bytes, initial_backoff_seconds, max_backoff_seconds,
+                 rng=None):
+        self._max_bytes = max_bytes
+        self._initial_backoff_seconds = initial_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._payloads = deque()
+        self._bytes = 0
+        self._failures = 0
+        self._next_attempt = 0
+        self.dropped_payloads = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    @property
+    def bytes(self):
+        """Total size of the queued payload bodies."""
+        return self._bytes
+
+    def push(self, payload):
+        """Queue a payload behind any already waiting.
+
+        Returns the list of payloads dropped to stay within max_bytes,
+        including `payload` itself if it is larger than the whole budget.
+        """
+        return self._add(payload, self._payloads.append)
+
+    def push_front(self, payload):
+        """Put back a payload that was just popped and failed again."""
+        return self._add(payload, self._payloads.appendleft)
+
+    def _add(self, payload, append):
+        size = len(payload.body)
+        with self._lock:
+            if size > self._max_bytes:
+                self.dropped_payloads += 1
+                return [payload]
+            dropped = []
+            while self._payloads and self._bytes + size > self._max_bytes:
+                oldest = self._payloads.popleft()
+                self._bytes -= len(oldest.body)
+                dropped.append(oldest)
+            append(payload)
+            self._bytes += size
+            self.dropped_payloads += len(dropped)
+            return dropped
+
+    def pop(self):
+        """Remove and return the oldest payload, or None if the queue is empty."""
+        with self._lock:
+            if not self._payloads:
+                return None
+            payload = self._payloads.popleft()
+            self._bytes -= len(payload.body)
+            return payload
+
+    def take_dropped(self):
+        """Return and forget the payloads pop() dropped along the way; this
+        queue drops payloads in push() only."""
+        return []
+
+    def ready(self, now):
+        """Whether the backoff period, if any, has elapsed at time `now`."""
+        return now >= self._next_attempt
+
+    def backoff_remaining(self, now):
+        """Seconds left in the backoff period at time `now`, or 0."""
+        return max(0, self._next_attempt - now)
+
+    def record_failure(self, now):
+        """Extend the backoff after a failed send at time `now`."""
+        with self._lock:
+            self._failures += 1
+            delay = min(self._max_backoff_seconds,
+                        self._initial_backoff_seconds * (2 ** min(self._failures - 1, 32)))
+            delay = delay / 2 + self._rng.uniform(0, delay / 2)
+            self._next_attempt = now + delay
+
+    def record_success(self):
+        """Reset the backoff after a successful send."""
+        with self._lock:
+            self._failures = 0
+            self._next_attempt = 0
+
+    def _after_fork(self):
+        """Forget the parent's payloads and backoff in a forked child, and
+        replace the lock, which the fork may have caught held."""
+        self._lock = threading.Lock()
+        self._payloads = deque()
+        self._bytes = 0
+        self._failures = 0
+        self._next_attempt = 0
+        self.dropped_payloads = 0
+
+    def clear(self):
+        """Drop every queued payload."""
+        with self._lock:
+            self._payloads.clear()
+            self._bytes = 0
@@ -0,0 +1,93 @@
+"""Facts about the host that every reporter reports in its runtime tags,
+looked up once per process."""
+import os
+import socket
+import threading
+
+from . import util
+
+
+class _HostMetadata(object):
+    """The host name and IP address of this machine.
+
+    The host name comes straight from the kernel. Finding the IP address may
+    block on DNS, interface ioctls and a UDP socket, so it is looked up in a
+    daemon thread started on first use, and the result is cached for the
+    life of the process (forked children included). Callers get the address
+    if it is known already, or within the time they are prepared to wait,
+    and can ask to be called back with it otherwise.
+    """
+
+    def __init__(self, resolve_ip=util.local_ip):
+        self._resolve_ip = resolve_ip
+        self._hostname = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._resolved = threading.Event()
+        self._ip_address = None
+        self._thread = None
+        self._callbacks = []
+
+    def hostname(self):
+        if self._hostname is None:
+            self._hostname = socket.gethostname()
+        return self._hostname
+
+    def ip_address(self, timeout_seconds=0, callback=None):
+        """Return the IP address of this machine, or None if it is not known
+        within `timeout_seconds`.
+
+        In that case `callback`, if given, is called with the address (or
+        None if the lookup failed) from the lookup thread once it is known.
+        """
+        if self._pid != os.getpid():
+            # Forked without os.register_at_fork.
+            self._after_fork()
+        with self._lock:
+            if not self._resolved.is_set():
+                if callback is not None:
+                    self._callbacks.append(callback)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._lookup,
+                                                    name='Splunk Tracer Metadata')
+                    self._thread.daemon = True
+                    self._thread.start()
+        if timeout_seconds:
+            self._resolved.wait(timeout_seconds)
+        return self._ip_address if self._resolved.is_set() else None
+
+    def _lookup(self):
+        try:
+            ip_address = self._resolve_ip()
+        except Exception:
+            ip_address = None
+        with self._lock:
+            self._ip_address = ip_address
+            self._resolved.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            try:
+                callback(ip_address)
+            except Exception:
+                pass
+
+    def _after_fork(self):
+        """Keep what is known in a forked child; restart a lookup that was
+        still running in the parent, whose thread the child does not have."""
+        if self._resolved.is_set():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._thread = None
+            self._callbacks = []
+        else:
+            self._reset()
+
+
+host = _HostMetadata()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=host._after_fork)
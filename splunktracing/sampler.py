@@ -0,0 +1,102 @@
+"""
+Head samplers, consulted once per trace when its root span starts.
+
+The decision is stored in SpanContext.sampled, inherited by every child span
+and carried across processes by the propagators, so a trace is either kept
+or dropped as a whole. Spans of unsampled traces are not recorded.
+
+Any basictracer Sampler can be used; subclasses of OperationSampler also
+receive the operation name of the root span.
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+from basictracer.recorder import Sampler
+
+
+class OperationSampler(Sampler):
+    """A Sampler whose sampled() also takes the operation name of the root
+    span (None when unknown)."""
+
+    def sampled(self, trace_id, operation_name=None):
+        raise NotImplementedError
+
+
+def _is_sampled(sampler, trace_id, operation_name):
+    if isinstance(sampler, OperationSampler):
+        return sampler.sampled(trace_id, operation_name)
+    return sampler.sampled(trace_id)
+
+
+class ProbabilisticSampler(OperationSampler):
+    """Samples a fixed fraction of traces.
+
+    The decision is derived from the trace_id alone, so every process using
+    the same rate makes the same decision for a given trace.
+    """
+
+    def __init__(self, rate):
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError('rate must be between 0 and 1, got {0!r}'.format(rate))
+        self.rate = rate
+        # trace_ids are uniformly distributed 64-bit integers.
+        self._boundary = int(rate * (1 << 64))
+
+    def sampled(self, trace_id, operation_name=None):
+        return trace_id < self._boundary
+
+
+class RateLimitingSampler(OperationSampler):
+    """Samples at most `traces_per_second` traces per second on average,
+    allowing bursts of up to `burst` traces (by default, one second's worth).
+
+    This is a token bucket: it fills at traces_per_second and each sampled
+    trace takes a token from it.
+    """
+
+    def __init__(self, traces_per_second, burst=None, clock=time.time):
+        if traces_per_second < 0:
+            raise ValueError('traces_per_second must not be negative')
+        self.traces_per_second = float(traces_per_second)
+        self._capacity = float(burst if burst is not None else max(1.0, traces_per_second))
+        self._tokens = self._capacity
+        self._clock = clock
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def sampled(self, trace_id, operation_name=None):
+        with self._lock:
+            now = self._clock()
+            elapsed = max(0.0, now - self._last_refill)
+            self._tokens = min(self._capacity,
+                               self._tokens + elapsed * self.traces_per_second)
+            self._last_refill = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class PerOperationSampler(OperationSampler):
+    """Delegates to a sampler chosen by the operation name of the root span.
+
+    `operation_samplers` maps operation names to Samplers, or to rates for a
+    ProbabilisticSampler. Other operations go to `default_sampler`, which
+    samples everything when None.
+    """
+
+    def __init__(self, operation_samplers, default_sampler=None):
+        self._samplers = {}
+        for name, sampler in operation_samplers.items():
+            if not isinstance(sampler, Sampler):
+                sampler = ProbabilisticSampler(sampler)
+            self._samplers[name] = sampler
+        self._default_sampler = default_sampler
+
+    def sampled(self, trace_id, operation_name=None):
+        sampler = self._samplers.get(operation_name, self._default_sampler)
+        if sampler is None:
+            return True
+        return _is_sampled(sampler, trace_id, operation_name)
@@ -1,50 +1,233 @@
 from __future__ import absolute_import
 
+import struct
+import threading
 from base64 import standard_b64decode
 from base64 import standard_b64encode
+
+import six
 from basictracer.context import SpanContext
 from basictracer.propagator import Propagator
-# This can cause problems when old versions of protobuf are installed
 from opentracing import InvalidCarrierException
+from opentracing import SpanContextCorruptedException
 
-from splunktracing.lightstep_carrier_pb2 import BinaryCarrier
-from splunktracing.lightstep_carrier_pb2 import BasicTracerCarrier
+# Field tags (field number << 3 | wire type) of the messages in
+# lightstep_carrier.proto. Only BinaryCarrier.basic_ctx is written;
+# text_ctx and unknown fields are skipped when reading.
+_BASIC_CTX_TAG = 0x12       # BinaryCarrier.basic_ctx, length-delimited
+_TRACE_ID_TAG = 0x09        # BasicTracerCarrier.trace_id, fixed64
+_SPAN_ID_TAG = 0x11         # BasicTracerCarrier.span_id, fixed64
+_SAMPLED_TAG = 0x18         # BasicTracerCarrier.sampled, varint
+_BAGGAGE_ITEM_TAG = 0x22    # BasicTracerCarrier.baggage_items, length-delimited
+_KEY_TAG = 0x0a             # BaggageItemsEntry.key, length-delimited
+_VALUE_TAG = 0x12           # BaggageItemsEntry.value, length-delimited
 
+_FIXED64 = struct.Struct('<Q')
+# Both ids, tagged, as written for any context with non-zero ids.
+_IDS = struct.Struct('<BQBQ')
 
-class SplunkTracingBinaryPropagator(Propagator):
-    """A BasicTracer Propagator for SplunkTracingFormat.SPLUNK_BINARY."""
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_FIXED32 = 5
 
-    def inject(self, span_context, carrier):
-        if type(carrier) is not bytearray:
-            raise InvalidCarrierException()
 
-        state = BinaryCarrier()
-        basic_ctx = state.basic_ctx
+def _varint_size(value):
+    size = 1
+    while value > 0x7f:
+        value >>= 7
+        size += 1
+    return size
 
-        basic_ctx.trace_id = span_context.trace_id
-        basic_ctx.span_id = span_context.span_id
-        basic_ctx.sampled = span_context.sampled
-        if span_context.baggage is not None:
-            for key in span_context.baggage:
-                basic_ctx.baggage_items[key] = span_context.baggage[key]
 
+def _append_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
 
-        serializedProto = state.SerializeToString()
-        encoded = standard_b64encode(serializedProto)
-        carrier.extend(encoded)
 
-    def extract(self, carrier):
+def _utf8(value):
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _encode_carrier(span_context, body, buf):
+    """Write the BinaryCarrier for `span_context` to `buf`, using `body` as
+    scratch space for the BasicTracerCarrier. Both are cleared first.
+
+    Like the protobuf runtime, fields holding their proto3 default are left
+    out, so the output is byte for byte what BinaryCarrier would serialize
+    (but for the order of baggage items, which protobuf leaves unspecified).
+    """
+    del body[:]
+    trace_id = span_context.trace_id
+    span_id = span_context.span_id
+    if trace_id and span_id:
+        body += _IDS.pack(_TRACE_ID_TAG, trace_id, _SPAN_ID_TAG, span_id)
+    else:
+        if trace_id:
+            body.append(_TRACE_ID_TAG)
+            body += _FIXED64.pack(trace_id)
+        if span_id:
+            body.append(_SPAN_ID_TAG)
+            body += _FIXED64.pack(span_id)
+    if span_context.sampled:
+        body.append(_SAMPLED_TAG)
+        body.append(1)
+    baggage = span_context.baggage
+    if baggage:
+        for key, value in six.iteritems(baggage):
+            key = _utf8(key)
+            value = _utf8(value)
+            body.append(_BAGGAGE_ITEM_TAG)
+            _append_varint(body, 2 + _varint_size(len(key)) + len(key) +
+                           _varint_size(len(value)) + len(value))
+            body.append(_KEY_TAG)
+            _append_varint(body, len(key))
+            body += key
+            body.append(_VALUE_TAG)
+            _append_varint(body, len(value))
+            body += value
+
+    del buf[:]
+    buf.append(_BASIC_CTX_TAG)
+    _append_varint(buf, len(body))
+    buf += body
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise ValueError('varint too long')
+
+
+def _read_length(data, pos, end):
+    """Read the length prefix of a length-delimited field; returns the
+    offsets of its start and end."""
+    length, pos = _read_varint(data, pos)
+    stop = pos + length
+    if stop > end:
+        raise ValueError('truncated field')
+    return pos, stop
+
+
+def _skip_field(data, pos, end, wire_type):
+    if wire_type == _WIRE_VARINT:
+        return _read_varint(data, pos)[1]
+    if wire_type == _WIRE_FIXED64:
+        pos += 8
+    elif wire_type == _WIRE_LENGTH_DELIMITED:
+        pos = _read_length(data, pos, end)[1]
+    elif wire_type == _WIRE_FIXED32:
+        pos += 4
+    else:
+        raise ValueError('unsupported wire type {0}'.format(wire_type))
+    if pos > end:
+        raise ValueError('truncated field')
+    return pos
+
+
+def _decode_baggage_item(data, pos, end):
+    key = value = u''
+    while pos < end:
+        tag, pos = _read_varint(data, pos)
+        if tag == _KEY_TAG or tag == _VALUE_TAG:
+            start, pos = _read_length(data, pos, end)
+            text = bytes(data[start:pos]).decode('utf-8')
+            if tag == _KEY_TAG:
+                key = text
+            else:
+                value = text
+        else:
+            pos = _skip_field(data, pos, end, tag & 7)
+    return key, value
+
+
+def _decode_basic_ctx(data, pos, end, state):
+    if (end - pos >= _IDS.size and data[pos] == _TRACE_ID_TAG and
+            data[pos + 9] == _SPAN_ID_TAG):
+        # The layout _encode_carrier (and protobuf) writes.
+        _, state[0], _, state[1] = _IDS.unpack_from(data, pos)
+        pos += _IDS.size
+    while pos < end:
+        tag, pos = _read_varint(data, pos)
+        if tag == _TRACE_ID_TAG or tag == _SPAN_ID_TAG:
+            if pos + 8 > end:
+                raise ValueError('truncated field')
+            state[0 if tag == _TRACE_ID_TAG else 1] = _FIXED64.unpack_from(data, pos)[0]
+            pos += 8
+        elif tag == _SAMPLED_TAG:
+            sampled, pos = _read_varint(data, pos)
+            state[2] = bool(sampled)
+        elif tag == _BAGGAGE_ITEM_TAG:
+            start, pos = _read_length(data, pos, end)
+            key, value = _decode_baggage_item(data, start, pos)
+            state[3][key] = value
+        else:
+            pos = _skip_field(data, pos, end, tag & 7)
+
+
+def _decode_carrier(data):
+    """Parse a serialized BinaryCarrier. Returns the trace id, span id,
+    sampled flag and baggage of its basic_ctx."""
+    state = [0, 0, False, {}]
+    pos = 0
+    end = len(data)
+    while pos < end:
+        tag, pos = _read_varint(data, pos)
+        if tag == _BASIC_CTX_TAG:
+            # A message field that occurs more than once is merged.
+            start, pos = _read_length(data, pos, end)
+            _decode_basic_ctx(data, start, pos, state)
+        else:
+            pos = _skip_field(data, pos, end, tag & 7)
+    return state
+
+
+class SplunkTracingBinaryPropagator(Propagator):
+    """A BasicTracer Propagator for SplunkTracingFormat.SPLUNK_BINARY.
+
+    The carrier is a base64-encoded BinaryCarrier message from
+    lightstep_carrier.proto. It is encoded and decoded by hand rather than
+    through the protobuf runtime, with scratch buffers kept per thread.
+    """
+
+    def __init__(self):
+        self._buffers = threading.local()
+
+    def inject(self, span_context, carrier):
         if type(carrier) is not bytearray:
             raise InvalidCarrierException()
-        serializedProto = standard_b64decode(carrier)
-        state = BinaryCarrier()
-        state.ParseFromString(bytes(serializedProto))
-        baggage = {}
-        for k in state.basic_ctx.baggage_items:
-            baggage[k] = state.basic_ctx.baggage_items[k]
+        buffers = self._buffers
+        try:
+            body = buffers.body
+            buf = buffers.buf
+        except AttributeError:
+            body = buffers.body = bytearray()
+            buf = buffers.buf = bytearray()
+        _encode_carrier(span_context, body, buf)
+        carrier.extend(standard_b64encode(buf))
 
+    def extract(self, carrier):
+        if type(carrier) is not bytearray:
+            raise InvalidCarrierException()
+        try:
+            trace_id, span_id, sampled, baggage = _decode_carrier(
+                bytearray(standard_b64decode(carrier)))
+        except (IndexError, ValueError, struct.error) as e:
+            raise SpanContextCorruptedException(str(e))
         return SpanContext(
-            span_id=state.basic_ctx.span_id,
-            trace_id=state.basic_ctx.trace_id,
+            span_id=span_id,
+            trace_id=trace_id,
             baggage=baggage,
-            sampled=state.basic_ctx.sampled)
+            sampled=sampled)
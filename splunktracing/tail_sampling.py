@@ -0,0 +1,153 @@
+"""
+Tail sampling: deciding whether to keep a trace once all of it has been seen.
+"""
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+
+from . import constants
+from .sampler import ProbabilisticSampler
+
+# Values of the `error` tag that mark a span as failed, before and after
+# span conversion coerces tag values to strings.
+_ERROR_VALUES = (True, 1, 'true', 'True', '1')
+
+
+def _has_error(tags):
+    return bool(tags) and tags.get('error') in _ERROR_VALUES
+
+
+class _Trace(object):
+    """The buffered spans of one trace, and what keep() needs to know."""
+
+    __slots__ = ('records', 'last_seen', 'error', 'max_duration')
+
+    def __init__(self):
+        self.records = []
+        self.last_seen = 0
+        self.error = False
+        self.max_duration = 0.0
+
+
+class TailSampler(object):
+    """Holds finished spans grouped by trace_id until the trace goes quiet,
+    then keeps or drops the trace as a whole.
+
+    A trace is quiet once none of its spans has been seen for
+    `decision_wait_seconds`. It is kept if one of its spans has a true
+    `error` tag (unless keep_errors is False), if its longest span took at
+    least `latency_threshold_seconds`, or otherwise at `sample_rate`, decided
+    from the trace_id like ProbabilisticSampler does. Override keep() for
+    other policies.
+
+    At most `max_traces` traces and `max_spans` spans wait for a decision;
+    past that, the traces seen least recently are decided early. Spans that
+    arrive after their trace was decided follow that decision.
+
+    Pass an instance to Tracer(tail_sampler=...). It is only used while
+    flushing; application threads never touch it.
+    """
+
+    def __init__(self,
+                 decision_wait_seconds=constants.TAIL_DECISION_WAIT_SECS,
+                 keep_errors=True,
+                 latency_threshold_seconds=None,
+                 sample_rate=0.0,
+                 max_traces=constants.DEFAULT_TAIL_MAX_TRACES,
+                 max_spans=constants.DEFAULT_TAIL_MAX_SPANS):
+        self.decision_wait_seconds = decision_wait_seconds
+        self.keep_errors = keep_errors
+        self.latency_threshold_seconds = latency_threshold_seconds
+        self._rate_sampler = ProbabilisticSampler(sample_rate)
+        self._max_traces = max_traces
+        self._max_spans = max_spans
+        self._lock = threading.Lock()
+        # trace_id -> _Trace, least recently seen first.
+        self._traces = OrderedDict()
+        # trace_id -> whether it was kept, for the latest max_traces decisions.
+        self._decided = OrderedDict()
+        self._span_count = 0
+
+    def __len__(self):
+        """Number of traces waiting for a decision."""
+        return len(self._traces)
+
+    @property
+    def span_count(self):
+        """Number of spans waiting for a decision."""
+        return self._span_count
+
+    def _after_fork(self):
+        """Forget the parent's traces in a forked child, and replace the
+        lock, which the fork may have caught held."""
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+        self._decided = OrderedDict()
+        self._span_count = 0
+
+    def keep(self, trace_id, trace):
+        """Return whether to keep the spans of a quiet trace.
+
+        `trace` has the buffered `records`, whether one of them had an
+        `error`, and the `max_duration` of its spans in seconds.
+        """
+        if self.keep_errors and trace.error:
+            return True
+        if (self.latency_threshold_seconds is not None and
+                trace.max_duration >= self.latency_threshold_seconds):
+            return True
+        return self._rate_sampler.sampled(trace_id)
+
+    def process(self, spans, now, flush_all=False):
+        """Buffer finished spans and decide the traces that went quiet.
+
+        `spans` are (trace_id, duration_seconds, has_error, record) tuples.
+        With flush_all, every buffered trace is decided right away.
+
+        Returns the records of kept traces, ready to be reported, and the
+        number of records dropped.
+        """
+        kept = []
+        dropped = 0
+        with self._lock:
+            traces = self._traces
+            for trace_id, duration, error, record in spans:
+                decision = self._decided.get(trace_id)
+                if decision is not None:
+                    if decision:
+                        kept.append(record)
+                    else:
+                        dropped += 1
+                    continue
+                trace = traces.pop(trace_id, None)
+                if trace is None:
+                    trace = _Trace()
+                # (Re-)inserting keeps the index ordered by last_seen.
+                traces[trace_id] = trace
+                trace.records.append(record)
+                trace.last_seen = now
+                trace.error = trace.error or error
+                if duration > trace.max_duration:
+                    trace.max_duration = duration
+                self._span_count += 1
+
+            horizon = now - self.decision_wait_seconds
+            while traces:
+                trace_id = next(iter(traces))
+                trace = traces[trace_id]
+                if not (flush_all or trace.last_seen <= horizon or
+                        len(traces) > self._max_traces or
+                        self._span_count > self._max_spans):
+                    break
+                del traces[trace_id]
+                self._span_count -= len(trace.records)
+                keep = self.keep(trace_id, trace)
+                self._decided[trace_id] = keep
+                if len(self._decided) > self._max_traces:
+                    self._decided.popitem(last=False)
+                if keep:
+                    kept.extend(trace.records)
+                else:
+                    dropped += len(trace.records)
+        return kept, dropped
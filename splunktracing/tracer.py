@@ -8,13 +8,30 @@ See the API definition for comments.
 """
 from __future__ import absolute_import
 
+import importlib
+
 from basictracer import BasicTracer
+from basictracer.propagator import Propagator
 from basictracer.text_propagator import TextPropagator
 from opentracing import Format
+from opentracing.ext import tags as ext_tags
 
-from splunktracing.splunk_binary_propagator import SplunkTracingBinaryPropagator
 from splunktracing.propagation import SplunkTracingFormat
 from .recorder import Recorder
+from .sampler import (OperationSampler, PerOperationSampler,  # noqa
+                      ProbabilisticSampler, RateLimitingSampler, _is_sampled)
+from .tail_sampling import TailSampler  # noqa
+
+
+def _sampling_priority(tags):
+    """Return the sampling.priority tag as an int, or None when it is absent
+    or not a number. It often comes from headers or config as a string."""
+    if not tags or ext_tags.SAMPLING_PRIORITY not in tags:
+        return None
+    try:
+        return int(tags[ext_tags.SAMPLING_PRIORITY])
+    except (ValueError, TypeError):
+        return None
 
 
 def Tracer(**kwargs):
@@ -29,11 +46,34 @@ def Tracer(**kwargs):
     :param int collector_port: Splunk collector port
     :param str collector_encryption: one of 'tls' or 'none'. If nothing is
         specified, the default is 'tls'.
+    :param list collector_endpoints: several collectors to spread reports
+        over, each given as 'host:port' (the port defaults to
+        collector_port) or a (host, port) tuple; overrides collector_host.
+        A report goes to the endpoint with the fewest reports in flight and
+        fails over to the others. Endpoints that keep failing or are much
+        slower than the rest are left out for a while, longer each time.
     :param dict tags: a string->string dict of tags for the Tracer itself (as
         opposed to the Spans it records)
+    :param str hostname: reported as the 'device' tag instead of the name
+        of the host.
+    :param str ip_address: reported as the 'ip_address' tag instead of the
+        address of the host. Otherwise that is looked up once per process
+        in the background, so creating a Tracer never waits on DNS; reports
+        carry it once known.
+    :param float metadata_timeout_seconds: how long creating a Tracer may
+        wait for that lookup. Defaults to 0.
     :param int max_span_records: Maximum number of spans records to buffer
+    :param int max_buffer_bytes: approximate memory budget for buffered span
+        records, or None for no limit beyond max_span_records.
+    :param int max_value_length: tag values and log field values longer than
+        this many characters are truncated, or None to keep them whole.
+    :param int max_log_bytes: log fields beyond this many bytes per log are
+        dropped, or None to keep them all.
     :param int periodic_flush_seconds: seconds between periodic background
         flushes, or 0 to disable background flushes entirely.
+    :param float flush_high_water_mark: fraction (0 to 1) of max_span_records
+        or max_buffer_bytes at which a background flush starts early instead
+        of waiting for the next period.
     :param int verbosity: verbosity for (debug) logging, all via logging.info().
         0 (default): log nothing
         1: log transient problems
@@ -46,7 +86,74 @@ def Tracer(**kwargs):
     :param ScopeManager scope_manager: the ScopeManager responsible for
         Span activation. Defaults to the implementation provided by the
         basictracer package, which uses thread-local storage.
+    :param Sampler sampler: decides, when a trace starts, whether it is
+        recorded; e.g. ProbabilisticSampler, RateLimitingSampler or
+        PerOperationSampler. The decision travels with the SpanContext.
+        Defaults to recording every trace.
     :param float timeout_seconds: Number of seconds allowed for the HTTP report transaction (fractions are permitted)
+    :param int connection_pool_size: maximum number of keep-alive connections
+        kept open to the collector.
+    :param float connection_idle_seconds: pooled connections left unused for
+        longer than this are closed before the next report, or None to keep
+        them for as long as the collector allows.
+    :param int flush_workers: number of reports that may be in flight to the
+        collector at once, each sent by its own worker thread; 1 (the
+        default) sends them one at a time from the flush thread. The
+        connection pool grows to at least this size.
+    :param int max_report_bytes: upper bound, in approximate buffered bytes,
+        for the spans of a single report; a larger buffer is flushed as
+        several reports. None (the default) sends the whole buffer at once.
+    :param bool deferred_conversion: if True, finishing a span only captures
+        its fields; conversion to the wire format happens in bulk on the
+        flush thread instead of on the thread that finished the span.
+    :param str json_encoder: JSON backend used to encode reports: 'orjson',
+        'ujson', 'json' (the standard library), or 'auto' (the default) to
+        use the fastest one installed (``pip install splunk-tracer[fast-json]``).
+        Values a backend cannot encode, such as integers beyond 64 bits for
+        orjson, are encoded with the standard library instead. Backends
+        differ in how they write application floats in exponent form
+        (1e16 vs 1e+16) and NaN or infinity (null vs NaN); see
+        splunktracing.json_encoder.
+    :param str compression: report body encoding, 'gzip' (the default) or
+        'none'.
+    :param int compression_level: gzip level from 1 (fastest) to 9 (smallest),
+        6 by default.
+    :param int compression_min_bytes: reports smaller than this many bytes
+        are sent uncompressed.
+    :param bool adaptive_compression: if True, lower the gzip level while
+        reports take longer than periodic_flush_seconds to send, and restore
+        it once they are fast again.
+    :param int retry_buffer_bytes: memory budget for reports that failed to
+        send and are kept, already compressed, to be re-sent; the oldest are
+        dropped first.
+    :param float retry_initial_backoff_seconds: wait before the first retry
+        after a failed report; it doubles with every consecutive failure.
+    :param float retry_max_backoff_seconds: upper bound for that wait.
+    :param str spill_directory: if set, reports that failed to send are kept
+        in segment files in this directory instead of in memory, and
+        replayed in order once the collector is back, including by the next
+        process to use the directory. retry_buffer_bytes does not apply.
+        Each Tracer in a process needs a directory of its own.
+    :param int spill_max_bytes: disk budget for spilled reports; the oldest
+        are deleted first.
+    :param float spill_max_age_seconds: spilled reports older than this are
+        discarded instead of being sent, or None to keep them.
+    :param bool emit_metrics: if True, every report also carries the tracer's
+        own counters (see Recorder.stats()) as a multiple-metric HEC event.
+    :param str metrics_index: Splunk metrics index for those events;
+        defaults to the HEC token's default index.
+    :param TailSampler tail_sampler: if set, finished spans are held, grouped
+        by trace, until the trace goes quiet, and only the traces it decides
+        to keep (errors, slow traces, a sample of the rest) are reported.
+    :param str collector_socket: path of the UNIX socket of a local
+        aggregator (started with the splunktracing-aggregator command). If
+        set, reports go to the aggregator, which batches the spans of all
+        local processes into large compressed uploads, instead of straight
+        to the collector. The aggregator listens on
+        splunktracing.aggregator.default_socket_path() unless told otherwise.
+    :param bool use_asyncio: if True, report from a task on the running
+        asyncio event loop, over non-blocking HTTP, instead of from a
+        background thread (see AsyncRecorder). Requires Python 3.5+.
     """
     enable_binary_format = True
     if 'disable_binary_format' in kwargs:
@@ -58,28 +165,96 @@ def Tracer(**kwargs):
         scope_manager = kwargs['scope_manager']
         del kwargs['scope_manager']
 
-    return _SplunkTracer(enable_binary_format, Recorder(**kwargs), scope_manager)
+    sampler = kwargs.pop('sampler', None)
+
+    if kwargs.pop('use_asyncio', False):
+        from splunktracing.async_recorder import AsyncRecorder
+        recorder = AsyncRecorder(**kwargs)
+    else:
+        recorder = Recorder(**kwargs)
+
+    return _SplunkTracer(enable_binary_format, recorder, scope_manager, sampler)
 
 
 class _SplunkTracer(BasicTracer):
-    def __init__(self, enable_binary_format, recorder, scope_manager):
+    def __init__(self, enable_binary_format, recorder, scope_manager, sampler=None):
         """Initialize the Splunk Tracer, deferring to BasicTracer."""
         super(_SplunkTracer, self).__init__(recorder, scope_manager=scope_manager)
+        # BasicTracer's own sampler keeps its default of sampling everything;
+        # start_span() consults this one instead, with the operation name.
+        self._head_sampler = sampler
         self.register_propagator(Format.TEXT_MAP, TextPropagator())
         self.register_propagator(Format.HTTP_HEADERS, TextPropagator())
         if enable_binary_format:
-            # We do this import lazily because protobuf versioning issues
-            # can cause process-level failure at import time.
-            from basictracer.binary_propagator import BinaryPropagator
-            self.register_propagator(Format.BINARY, BinaryPropagator())
-            self.register_propagator(SplunkTracingFormat.SPLUNK_BINARY, SplunkTracingBinaryPropagator())
+            # Only imported on first inject or extract. BinaryPropagator uses
+            # protobuf, which is slow to load and whose versioning issues can
+            # cause process-level failure at import time.
+            self.register_propagator(Format.BINARY, _LazyPropagator(
+                'basictracer.binary_propagator', 'BinaryPropagator'))
+            self.register_propagator(SplunkTracingFormat.SPLUNK_BINARY, _LazyPropagator(
+                'splunktracing.splunk_binary_propagator', 'SplunkTracingBinaryPropagator'))
+
+    def start_span(self,
+                   operation_name=None,
+                   child_of=None,
+                   references=None,
+                   tags=None,
+                   start_time=None,
+                   ignore_active_span=False):
+        """Per BasicTracer.start_span, deciding whether new traces are
+        sampled.
+
+        Child spans inherit the decision of their parent. For a root span, a
+        sampling.priority tag passed here wins, if it is an integer or a
+        string holding one; otherwise the sampler decides.
+        """
+        span = super(_SplunkTracer, self).start_span(
+            operation_name=operation_name,
+            child_of=child_of,
+            references=references,
+            tags=tags,
+            start_time=start_time,
+            ignore_active_span=ignore_active_span)
+        if span.parent_id is None:
+            priority = _sampling_priority(tags)
+            if priority is not None:
+                span.context.sampled = priority > 0
+            elif self._head_sampler is not None:
+                span.context.sampled = _is_sampled(
+                    self._head_sampler, span.context.trace_id, operation_name)
+        return span
 
     def flush(self):
-        """Force a flush of buffered Span data to the Splunk collector."""
-        self.recorder.flush()
+        """Force a flush of buffered Span data to the Splunk collector.
+
+        With use_asyncio, called from a coroutine, returns an awaitable.
+        """
+        return self.recorder.flush()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.flush()
+
+
+class _LazyPropagator(Propagator):
+    """Stands in for the Propagator class `name` of module `module`, which
+    is imported and instantiated on first use."""
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._propagator = None
+
+    def _get(self):
+        if self._propagator is None:
+            module = importlib.import_module(self._module)
+            self._propagator = getattr(module, self._name)()
+        return self._propagator
+
+    def inject(self, span_context, carrier):
+        return self._get().inject(span_context, carrier)
+
+    def extract(self, carrier):
+        return self._get().extract(carrier)
@@ -0,0 +1,171 @@
+"""Connection class sending reports to a local aggregator process (see
+splunktracing.aggregator) over a UNIX domain socket.
+"""
+import socket
+import struct
+import threading
+
+from collections import namedtuple
+
+from . import constants
+from .collector import ReportRequest
+from .http_connection import _Payload
+
+# Every frame is a header, giving the length of the body and the number of
+# spans in it, followed by the body: HEC events, serialized exactly as they
+# are sent to the collector, each followed by a newline.
+_FRAME_HEADER = struct.Struct('>II')
+
+_Frame = namedtuple('_Frame', ['body', 'span_count'])
+
+
+def _read_frame(rfile):
+    """Read one frame from a file-like object.
+
+    Returns a _Frame, or None at the end of the stream. Raises ValueError on
+    a frame larger than MAX_FRAME_BYTES.
+    """
+    header = rfile.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        return None
+    length, span_count = _FRAME_HEADER.unpack(header)
+    if length > constants.MAX_FRAME_BYTES:
+        raise ValueError('frame of {0} bytes exceeds the limit'.format(length))
+    body = rfile.read(length)
+    if len(body) < length:
+        return None
+    return _Frame(body, span_count)
+
+
+def _iter_span_events(report):
+    """Yield (events, span_count) for the metrics event of `report`, if any,
+    then for each span: its log events followed by the span event."""
+    if report.metrics is not None:
+        yield ReportRequest(report.reporter, [], report.encoder,
+                            report.metrics).iter_serialized(), 0
+    for span in report.spans:
+        yield ReportRequest(report.reporter, [span], report.encoder).iter_serialized(), 1
+
+
+class _UnixSocketConnection(object):
+    """Hands reports to a local aggregator instead of the collector.
+
+    Events are serialized here, so the aggregator only has to batch,
+    compress and upload them; there is no compression and no HTTP on the
+    worker side. Payloads from encode() can be queued for retry like those
+    of _HTTPConnection, should the aggregator be down; their bodies are
+    already split into frames of at most MAX_FRAME_BYTES.
+    """
+
+    def __init__(self, socket_path, timeout_seconds, stats=None):
+        self._socket_path = socket_path
+        self._timeout_seconds = timeout_seconds
+        self._stats = stats
+        self._lock = threading.Lock()
+        self._socket = None
+        self.ready = False
+
+    def open(self):
+        """Connect to the aggregator. Leaves `ready` False if it is not
+        listening."""
+        with self._lock:
+            if self._socket is not None:
+                return
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout_seconds)
+            try:
+                sock.connect(self._socket_path)
+            except socket.error:
+                sock.close()
+                return
+            self._socket = sock
+            self.ready = True
+
+    def close(self):
+        """Close the connection to the aggregator."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        self.ready = False
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _write(self, frames, raw_size):
+        if self._socket is None:
+            self.open()
+        with self._lock:
+            if self._socket is None:
+                raise socket.error('aggregator not listening on {0}'.format(self._socket_path))
+            try:
+                self._socket.sendall(frames)
+            except socket.error:
+                # A partial frame may have gone out; start over on a new
+                # connection.
+                self._close()
+                raise
+        if self._stats is not None:
+            self._stats.incr('bytes_uncompressed', raw_size)
+            self._stats.incr('bytes_compressed', raw_size)
+        return b''
+
+    def encode(self, report):
+        """Serialize `report` into a _Payload for send().
+
+        The events are split into as many frames as it takes to keep each
+        under MAX_FRAME_BYTES, which the aggregator refuses to read. A span
+        whose events alone exceed it is counted in spans_dropped and removed
+        from `report.spans`, so it is not counted as flushed either.
+        """
+        max_frame_bytes = constants.MAX_FRAME_BYTES
+        frames = []
+        frame = []
+        frame_size = 0
+        frame_spans = 0
+        raw_size = 0
+        kept = []
+        spans = iter(report.spans)
+        for events, span_count in _iter_span_events(report):
+            span = next(spans) if span_count else None
+            group = []
+            group_size = 0
+            for event in events:
+                group.append(event)
+                group.append(b'\n')
+                group_size += len(event) + 1
+            if group_size > max_frame_bytes:
+                if self._stats is not None:
+                    self._stats.incr('spans_dropped', span_count)
+                continue
+            if span is not None:
+                kept.append(span)
+            if frame and frame_size + group_size > max_frame_bytes:
+                frames.append(_FRAME_HEADER.pack(frame_size, frame_spans))
+                frames.extend(frame)
+                frame = []
+                frame_size = 0
+                frame_spans = 0
+            frame.extend(group)
+            frame_size += group_size
+            frame_spans += span_count
+            raw_size += group_size
+        if frame:
+            frames.append(_FRAME_HEADER.pack(frame_size, frame_spans))
+            frames.extend(frame)
+        if len(kept) < len(report.spans):
+            report.spans = kept
+        return _Payload(b''.join(frames), None, len(kept), raw_size)
+
+    # May throw an Exception on failure.
+    def report(self, auth, report):
+        """Send a report to the aggregator."""
+        if len(report.spans) > 0 or report.metrics:
+            payload = self.encode(report)
+            if payload.body:
+                return self._write(payload.body, payload.raw_size)
+
+    # May throw an Exception on failure.
+    def send(self, auth, payload):
+        """Send a _Payload produced by encode() to the aggregator."""
+        return self._write(payload.body, payload.raw_size)
@@ -3,7 +3,6 @@
 import random
 import sys
 import time
-import math
 import socket
 import struct
 from . import constants
@@ -25,14 +24,36 @@ def _collector_url_from_hostport(secure, host, port):
     return ''.join([protocol, host, ':', str(port), '/services/collector'])
 
 
+def _split_hostport(endpoint, default_port):
+    """
+    Split a collector endpoint, given as 'host:port', 'host' or a
+    (host, port) tuple, into a (host, port) tuple.
+    """
+    if isinstance(endpoint, (tuple, list)):
+        host, port = endpoint
+        return host, int(port)
+    host, sep, port = endpoint.rpartition(':')
+    if not sep or not port.isdigit() or (':' in host and not host.endswith(']')):
+        # No port, or a bare IPv6 address; IPv6 hosts with a port are
+        # written in brackets, e.g. '[::1]:8088'.
+        return endpoint, default_port
+    return host, int(port)
+
+
 def _generate_guid():
     """
     Construct a guid - a random 64 bit integer
     """
     return guid_rng.getrandbits(64) - 1
 
+def _reseed_guid_rng():
+    """
+    Reseed guid_rng, so a forked child does not repeat its parent's guids
+    """
+    guid_rng.seed()
+
 def _id_to_hex(id):
-    return '{0:x}'.format(id)
+    return '%x' % id
 
 def _now_micros():
     """
@@ -42,9 +63,17 @@ def _now_micros():
 
 def _time_to_micros(t):
     """
-    Convert a time.time()-style timestamp to microseconds.
+    Convert a non-negative time.time()-style timestamp or duration to
+    microseconds, rounding to the nearest.
+    """
+    return int(t * constants.SECONDS_TO_MICRO + 0.5)
+
+def _format_timestamp(t):
+    """
+    Format a time.time()-style timestamp as seconds with nine decimals,
+    the form span start times are reported in.
     """
-    return math.floor(round(t * constants.SECONDS_TO_MICRO))
+    return '%.9f' % t
 
 def _time_to_seconds_nanos(t):
     """
@@ -0,0 +1,221 @@
+import errno
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.tracer
+from splunktracing import aggregator
+from splunktracing import constants
+from splunktracing.aggregator import Aggregator
+from splunktracing.http_connection import _HTTPConnection
+from splunktracing.metrics import _Stats
+from splunktracing.recorder import Recorder
+from splunktracing.unix_connection import _UnixSocketConnection
+from tests.http_connection_test import StubCollector, dummy_report
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires UNIX domain sockets')
+class AggregatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = StubCollector()
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'aggregator.sock')
+        self.aggregator = Aggregator(socket_path=self.socket_path,
+                                     access_token='token',
+                                     collector_encryption='none',
+                                     collector_port=self.collector.server.server_port,
+                                     flush_seconds=60)
+        self.aggregator.start()
+
+    def tearDown(self):
+        self.aggregator.stop()
+        self.collector.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def make_recorder(self, name):
+        recorder = Recorder(component_name=name,
+                            collector_socket=self.socket_path,
+                            periodic_flush_seconds=0)
+        tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        return recorder, tracer
+
+    def record(self, recorder, tracer, name):
+        span = BasicSpan(tracer, operation_name=name,
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        recorder.record_span(span)
+
+    def wait_for_spans(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while (self.aggregator.stats()['spans_recorded'] < count and
+               time.time() < deadline):
+            time.sleep(0.01)
+
+    def events(self, body):
+        return [json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+    def test_reports_from_workers_are_uploaded_together(self):
+        workers = [self.make_recorder('worker-%d' % i) for i in range(3)]
+        for i, (recorder, tracer) in enumerate(workers):
+            self.record(recorder, tracer, 'op-%d' % i)
+            self.assertTrue(recorder.flush(recorder._create_connection()))
+        self.wait_for_spans(3)
+        self.assertEqual(len(self.collector.server.bodies), 0)
+
+        self.assertTrue(self.aggregator.flush())
+        self.assertEqual(len(self.collector.server.bodies), 1)
+        headers = self.collector.server.headers[0]
+        self.assertEqual(headers['Authorization'], 'Splunk token')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        events = self.events(self.collector.server.bodies[0])
+        self.assertEqual(sorted((e['event']['operation_name'], e['event']['component_name'])
+                                for e in events),
+                         [('op-0', 'worker-0'), ('op-1', 'worker-1'), ('op-2', 'worker-2')])
+        self.assertEqual(self.aggregator.stats()['spans_flushed'], 3)
+        for recorder, _ in workers:
+            recorder.shutdown(flush=False)
+
+    def test_large_batches_are_uploaded_early(self):
+        self.aggregator._report_bytes = 1000
+        connection = _UnixSocketConnection(self.socket_path, 5)
+        connection.report('ignored', dummy_report(20))
+        deadline = time.time() + 5
+        while not self.collector.server.bodies and time.time() < deadline:
+            time.sleep(0.01)
+        connection.close()
+        self.assertEqual(len(self.events(self.collector.server.bodies[0])), 20)
+
+    def test_large_reports_are_split_into_frames(self):
+        original = constants.MAX_FRAME_BYTES
+        constants.MAX_FRAME_BYTES = 2000
+        try:
+            stats = _Stats()
+            connection = _UnixSocketConnection(self.socket_path, 5, stats)
+            report = dummy_report(20)
+            report.spans[5].tags['blob'] = 'x' * 3000
+            connection.report('ignored', report)
+            connection.close()
+            self.wait_for_spans(19)
+        finally:
+            constants.MAX_FRAME_BYTES = original
+
+        # The span that does not fit in any frame is dropped, not flushed.
+        self.assertEqual(len(report.spans), 19)
+        self.assertEqual(stats.snapshot()['spans_dropped'], 1)
+        self.assertEqual(self.aggregator.stats()['spans_recorded'], 19)
+        self.assertTrue(self.aggregator.flush())
+        names = [e['event']['operation_name'] for e in
+                 self.events(self.collector.server.bodies[0])
+                 if e['sourcetype'] == 'splunktracing:span']
+        self.assertEqual(names, [str(i) for i in range(20) if i != 5])
+
+    def test_failed_uploads_are_retried(self):
+        connection = _UnixSocketConnection(self.socket_path, 5)
+        connection.report('ignored', dummy_report(2))
+        connection.close()
+        self.wait_for_spans(2)
+        self.collector.stop()
+        self.assertFalse(self.aggregator.flush())
+        self.assertEqual(self.aggregator.stats()['retry_queue_reports'], 1)
+
+        self.collector = StubCollector()
+        self.aggregator._connection = _HTTPConnection(self.collector.url, 5)
+        self.assertTrue(self.aggregator.flush())
+        self.assertEqual(len(self.events(self.collector.server.bodies[0])), 2)
+
+    def test_running_aggregator_is_not_replaced(self):
+        second = Aggregator(socket_path=self.socket_path, collector_encryption='none',
+                            collector_port=self.collector.server.server_port)
+        with self.assertRaises(OSError) as cm:
+            second.start()
+        self.assertEqual(cm.exception.errno, errno.EADDRINUSE)
+
+        recorder, tracer = self.make_recorder('worker')
+        self.record(recorder, tracer, 'op')
+        self.assertTrue(recorder.flush(recorder._create_connection()))
+        self.wait_for_spans(1)
+        self.assertEqual(self.aggregator.stats()['spans_recorded'], 1)
+
+    def test_stale_socket_is_replaced(self):
+        self.aggregator.stop()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()
+        self.aggregator = Aggregator(socket_path=self.socket_path, collector_encryption='none',
+                                     collector_port=self.collector.server.server_port)
+        self.aggregator.start()
+        self.assertTrue(aggregator._socket_in_use(self.socket_path))
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires UNIX domain sockets')
+class UnixSocketConnectionTest(unittest.TestCase):
+
+    def test_aggregator_not_listening(self):
+        recorder = Recorder(collector_socket='/nonexistent/aggregator.sock',
+                            periodic_flush_seconds=0)
+        tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        span = BasicSpan(tracer, operation_name='op',
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        recorder.record_span(span)
+
+        connection = recorder._create_connection()
+        connection.open()
+        self.assertFalse(connection.ready)
+        self.assertFalse(recorder.flush(connection))
+        # The spans stay buffered until the aggregator shows up.
+        self.assertEqual(len(recorder._span_records), 1)
+        recorder.shutdown(flush=False)
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'requires UNIX domain sockets')
+class DefaultSocketPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def test_runtime_dir(self):
+        os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+        path = aggregator.default_socket_path()
+        self.assertEqual(path, os.path.join(self.tmpdir, 'splunktracing', 'aggregator.sock'))
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+    def test_temporary_directory(self):
+        os.environ.pop('XDG_RUNTIME_DIR', None)
+        os.environ['TMPDIR'] = self.tmpdir
+        tempfile.tempdir = None
+        try:
+            path = aggregator.default_socket_path()
+        finally:
+            tempfile.tempdir = None
+        directory = os.path.dirname(path)
+        self.assertEqual(os.path.dirname(directory), self.tmpdir)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def test_shared_directory_is_refused(self):
+        os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+        directory = os.path.join(self.tmpdir, 'splunktracing')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        with self.assertRaises(ValueError):
+            aggregator.default_socket_path()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import sys
+import time
+import unittest
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.tracer
+from tests.http_connection_test import StubCollector, dummy_report
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from splunktracing.async_http_connection import _AsyncHTTPConnection
+    from splunktracing.async_recorder import AsyncRecorder
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio support requires Python 3.5+')
+class AsyncHTTPConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = StubCollector()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        # Let closed transports actually close their sockets.
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        self.collector.stop()
+
+    def test_reports_reuse_connection(self):
+        connection = _AsyncHTTPConnection(self.collector.url, 5)
+        connection.open()
+        for _ in range(5):
+            resp = self.loop.run_until_complete(connection.report('token', dummy_report()))
+            self.assertEqual(resp, b'{"text":"Success","code":0}')
+        connection.close()
+
+        self.assertEqual(len(self.collector.server.bodies), 5)
+        self.assertEqual(self.collector.server.connections, 1)
+        self.assertEqual(self.collector.server.headers[0]['Authorization'], 'Splunk token')
+
+    def test_report_body_is_streamed(self):
+        report = dummy_report(5000)
+        connection = _AsyncHTTPConnection(self.collector.url, 5)
+        self.loop.run_until_complete(connection.report('token', report))
+        connection.close()
+
+        headers = self.collector.server.headers[0]
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.collector.server.bodies[0],
+                         report.serialize_to_string().encode('utf-8') + b'\n')
+
+    def test_connect_counts_against_timeout(self):
+        connection = _AsyncHTTPConnection(self.collector.url, 0.2)
+        # A connect that is never answered.
+        connection._acquire = lambda: asyncio.sleep(30)
+
+        start = time.time()
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(connection.report('token', dummy_report()))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_send_payload(self):
+        connection = _AsyncHTTPConnection(self.collector.url, 5, compression_min_bytes=0)
+        payload = connection.encode(dummy_report())
+        self.loop.run_until_complete(connection.send('token', payload))
+        connection.close()
+
+        self.assertEqual(self.collector.server.bodies[0],
+                         dummy_report().serialize_to_string().encode('utf-8') + b'\n')
+
+    def test_idle_connections_are_reaped(self):
+        connection = _AsyncHTTPConnection(self.collector.url, 5, idle_seconds=0)
+        self.loop.run_until_complete(connection.report('token', dummy_report()))
+        time.sleep(0.01)
+        self.loop.run_until_complete(connection.report('token', dummy_report()))
+        connection.close()
+
+        self.assertEqual(self.collector.server.connections, 2)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio support requires Python 3.5+')
+class AsyncRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = StubCollector()
+        self.loop = asyncio.new_event_loop()
+        port = self.collector.server.server_port
+        self.recorder = AsyncRecorder(
+            access_token='token',
+            collector_encryption='none',
+            collector_host='127.0.0.1',
+            collector_port=port,
+            periodic_flush_seconds=60,
+            max_span_records=100,
+            flush_high_water_mark=0.2)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+
+    def tearDown(self):
+        if not self.recorder._disabled_runtime:
+            self.loop.run_until_complete(self.recorder.shutdown_async(flush=False))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        self.collector.stop()
+
+    def record(self, i):
+        span = BasicSpan(self.tracer, operation_name=str(i),
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        self.recorder.record_span(span)
+
+    def call_in_loop(self, fn, *args):
+        """Run fn(*args) as a callback on the event loop."""
+        future = self.loop.create_future()
+        self.loop.call_soon(lambda: future.set_result(fn(*args)))
+        return self.loop.run_until_complete(future)
+
+    def run_loop_until(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_flush_task_runs_on_loop(self):
+        self.call_in_loop(self.record, 0)
+        self.assertIsNotNone(self.recorder._flush_task)
+        self.assertIsNone(self.recorder._flush_thread)
+        # The task's first flush picks up the span right away.
+        self.run_loop_until(lambda: self.collector.server.bodies)
+        self.assertEqual(len(self.collector.server.bodies), 1)
+
+    def test_high_water_mark_wakes_flush_task(self):
+        self.call_in_loop(self.recorder._maybe_init_flush_thread)
+        self.run_loop_until(lambda: self.recorder._wakeup is not None)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+        for i in range(19):
+            self.call_in_loop(self.record, i)
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        self.assertEqual(len(self.collector.server.bodies), 0)
+
+        self.call_in_loop(self.record, 19)
+        self.run_loop_until(lambda: self.collector.server.bodies)
+        self.assertEqual(len(self.collector.server.bodies), 1)
+        self.assertEqual(self.recorder.stats()['spans_flushed'], 20)
+
+    def test_flush_task_moves_to_a_new_loop(self):
+        # Like two consecutive asyncio.run() calls.
+        self.call_in_loop(self.record, 0)
+        first_task = self.recorder._flush_task
+        self.run_loop_until(lambda: self.collector.server.bodies)
+        self.loop.close()
+
+        # Spans finished outside any loop must not touch the closed one.
+        for i in range(30):
+            self.record(i)
+        self.loop = asyncio.new_event_loop()
+        self.call_in_loop(self.record, 30)
+        self.assertIsNot(self.recorder._flush_task, first_task)
+        self.run_loop_until(lambda: len(self.collector.server.bodies) == 2)
+        self.assertEqual(self.recorder.stats()['spans_flushed'], 32)
+
+    def test_flush_from_coroutine_returns_task(self):
+        self.record(0)
+        task = self.call_in_loop(self.recorder.flush)
+        self.assertTrue(self.loop.run_until_complete(task))
+        self.assertEqual(len(self.collector.server.bodies), 1)
+
+    def test_flush_without_loop_is_synchronous(self):
+        self.record(0)
+        self.assertTrue(self.recorder.flush())
+        self.assertEqual(len(self.collector.server.bodies), 1)
+
+    def test_shutdown_async_stops_flush_task(self):
+        self.call_in_loop(self.record, 0)
+        task = self.recorder._flush_task
+        self.call_in_loop(self.record, 1)
+        self.loop.run_until_complete(self.recorder.shutdown_async())
+        self.assertTrue(task.done())
+        self.assertTrue(self.recorder._disabled_runtime)
+        self.assertEqual(self.recorder.stats()['spans_flushed'], 2)
+
+    def test_failed_report_is_queued_for_retry(self):
+        self.collector.stop()
+        self.record(0)
+        self.assertFalse(self.loop.run_until_complete(self.recorder.flush_async()))
+        self.assertEqual(self.recorder.stats()['retry_queue_reports'], 1)
+        self.assertEqual(self.recorder.stats()['reports_failed'], 1)
+        # Keep tearDown's stop() harmless.
+        self.collector = StubCollector()
+
+    def test_capped_reports_are_sent_concurrently(self):
+        self.recorder._max_report_bytes = 1
+        self.recorder._flush_workers = 3
+        for i in range(5):
+            self.record(i)
+        self.assertTrue(self.loop.run_until_complete(self.recorder.flush_async()))
+        # The flush task started by flush_async() may have taken some; the
+        # collector stores a body before the recorder has seen the response.
+        self.run_loop_until(lambda: self.recorder.stats()['spans_flushed'] == 5)
+        self.assertEqual(len(self.collector.server.bodies), 5)
+        self.assertEqual(self.recorder.stats()['spans_flushed'], 5)
+        self.assertTrue(self.collector.server.connections > 1)
+
+    def test_tracer_use_asyncio(self):
+        tracer = splunktracing.tracer.Tracer(use_asyncio=True,
+                                             collector_encryption='none',
+                                             periodic_flush_seconds=0)
+        self.assertIsInstance(tracer.recorder, AsyncRecorder)
+        tracer.recorder.shutdown(flush=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
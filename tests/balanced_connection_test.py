@@ -0,0 +1,122 @@
+import unittest
+
+import requests
+
+import splunktracing.recorder
+from splunktracing import constants
+from splunktracing.balanced_connection import _BalancedConnection
+from splunktracing.metrics import _Stats
+from tests.clock import FakeClock
+from tests.http_connection_test import StubCollector, dummy_report
+
+
+class BalancedConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collectors = [StubCollector() for _ in range(3)]
+        self.clock = FakeClock()
+        self.stats = _Stats()
+        self.connection = _BalancedConnection([c.url for c in self.collectors], 5,
+                                              stats=self.stats, clock=self.clock)
+        self.connection.open()
+
+    def tearDown(self):
+        self.connection.close()
+        for collector in self.collectors:
+            collector.stop()
+
+    def counts(self):
+        return [len(c.server.bodies) for c in self.collectors]
+
+    def test_reports_are_spread_round_robin(self):
+        for _ in range(6):
+            self.connection.report('token', dummy_report())
+        self.assertEqual(self.counts(), [2, 2, 2])
+
+    def test_least_outstanding_endpoint_is_preferred(self):
+        self.connection._endpoints[0].outstanding = 1
+        self.connection._endpoints[1].outstanding = 1
+        self.connection.report('token', dummy_report())
+        self.assertEqual(self.counts(), [0, 0, 1])
+
+    def test_failed_report_fails_over(self):
+        self.collectors[0].stop()
+        # Round robin comes back to the first endpoint every other report.
+        for _ in range(5):
+            self.connection.report('token', dummy_report())
+        self.assertEqual(sum(self.counts()), 5)
+        # Three failures in a row take the endpoint out of the rotation.
+        self.assertEqual(self.connection.healthy_endpoints(),
+                         [self.collectors[1].url, self.collectors[2].url])
+        self.assertEqual(self.stats.get('endpoint_ejections'), 1)
+
+        # It is tried again after the ejection delay.
+        self.collectors[0] = StubCollector()
+        endpoint = self.connection._endpoints[0]
+        endpoint.url = self.collectors[0].url
+        endpoint.connection._collector_url = endpoint.url
+        self.clock.now += constants.ENDPOINT_EJECT_SECS
+        self.assertEqual(len(self.connection.healthy_endpoints()), 3)
+        for _ in range(3):
+            self.connection.report('token', dummy_report())
+        self.assertEqual(len(self.collectors[0].server.bodies), 1)
+        self.assertEqual(endpoint.ejections, 0)
+
+    def test_ejection_delay_doubles(self):
+        endpoint = self.connection._endpoints[0]
+        for expected in (1, 2, 4):
+            for _ in range(constants.ENDPOINT_EJECT_FAILURES):
+                self.connection._acquire([])
+                self.connection._release(endpoint, None)
+            self.assertEqual(endpoint.ejected_until - self.clock.now,
+                             expected * constants.ENDPOINT_EJECT_SECS)
+            self.clock.now = endpoint.ejected_until
+
+    def test_slow_endpoint_is_ejected(self):
+        fast, slow = self.connection._endpoints[:2]
+        for endpoint, latency in ((fast, 0.05), (slow, 2.0)):
+            endpoint.outstanding += 1
+            self.connection._release(endpoint, latency)
+        self.assertTrue(slow.ejected_until > self.clock.now)
+        self.assertTrue(fast.ejected_until <= self.clock.now)
+
+    def test_every_endpoint_failing(self):
+        for collector in self.collectors:
+            collector.stop()
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.connection.report('token', dummy_report())
+        self.assertTrue(all(e.failures == 1 for e in self.connection._endpoints))
+
+    def test_all_ejected_uses_the_first_due_back(self):
+        for i, endpoint in enumerate(self.connection._endpoints):
+            endpoint.ejected_until = self.clock.now + 10 - i
+        self.connection.report('token', dummy_report())
+        self.assertEqual(self.counts(), [0, 0, 1])
+
+
+class RecorderEndpointsTest(unittest.TestCase):
+
+    def test_endpoints_become_urls(self):
+        recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_port=9000,
+            collector_endpoints=['a:8088', 'b', ('c', 8089)],
+            periodic_flush_seconds=0)
+        self.assertEqual(recorder._collector_urls,
+                         ['http://a:8088/services/collector',
+                          'http://b:9000/services/collector',
+                          'http://c:8089/services/collector'])
+        self.assertIsInstance(recorder._create_connection(), _BalancedConnection)
+        recorder.shutdown(flush=False)
+
+    def test_bad_endpoint_options(self):
+        with self.assertRaises(ValueError):
+            splunktracing.recorder.Recorder(collector_endpoints=[], periodic_flush_seconds=0)
+        with self.assertRaises(ValueError):
+            splunktracing.recorder.Recorder(collector_endpoints=['a'],
+                                            collector_socket='/tmp/s',
+                                            periodic_flush_seconds=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,9 @@
+class FakeClock(object):
+    """A clock for code that takes a `clock` callable; advance it by
+    changing `now`."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
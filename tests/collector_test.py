@@ -0,0 +1,143 @@
+import json
+import unittest
+
+from splunktracing import collector
+from splunktracing import json_encoder
+
+
+def dummy_report(n=3, reporter_tags=None):
+    if reporter_tags is None:
+        reporter_tags = {'component_name': 'test', 'guid': 'abc', 'device': 'host'}
+    reporter = collector.Reporter(reporter_id=1, tags=reporter_tags)
+    spans = []
+    for i in range(n):
+        context = collector.SpanContext(trace_id='%x' % (1000 + i),
+                                        span_id='%x' % (2000 + i),
+                                        parent_id='%x' % (3000 + i),
+                                        baggage={'user': 'u%d' % i})
+        logs = [{'timestamp': 1.25, 'event': 'step', 'n': i}]
+        spans.append(collector.Span(span_context=context,
+                                    operation_name=str(i),
+                                    start_timestamp='1.5',
+                                    duration_micros=10 + i,
+                                    tags={'http.method': 'GET'},
+                                    logs=logs))
+    return collector.ReportRequest(reporter, spans)
+
+
+class ReportRequestTest(unittest.TestCase):
+
+    def test_events(self):
+        report = dummy_report(2)
+        events = [json.loads(line) for line in report.serialize_to_string().split('\n')]
+        self.assertEqual(len(events), 4)
+
+        log_event, span_event = events[0], events[1]
+        self.assertEqual(log_event, {
+            'time': 1.25,
+            'sourcetype': 'splunktracing:log',
+            'event': {
+                'fields': {'timestamp': 1.25, 'event': 'step', 'n': 0},
+                'timestamp': 1.25,
+                'trace_id': '3e8',
+                'span_id': '7d0',
+                'parent_span_id': 'bb8',
+                'operation_name': '0',
+                'tags': {'http.method': 'GET'},
+                'baggage': {'user': 'u0'},
+                'component_name': 'test',
+                'guid': 'abc',
+                'device': 'host',
+            }})
+        self.assertEqual(span_event, {
+            'time': '1.5',
+            'sourcetype': 'splunktracing:span',
+            'event': {
+                'trace_id': '3e8',
+                'span_id': '7d0',
+                'parent_span_id': 'bb8',
+                'operation_name': '0',
+                'tags': {'http.method': 'GET'},
+                'baggage': {'user': 'u0'},
+                'timestamp': '1.5',
+                'duration': 10,
+                'component_name': 'test',
+                'guid': 'abc',
+                'device': 'host',
+            }})
+
+    def test_reporter_tags_do_not_override_event_keys(self):
+        report = dummy_report(1, reporter_tags={'trace_id': 'bogus', 'duration': 0, 'k': 'v'})
+        span_event = json.loads(report.serialize_to_string().split('\n')[-1])
+        self.assertEqual(span_event['event']['trace_id'], '3e8')
+        self.assertEqual(span_event['event']['duration'], 10)
+        self.assertEqual(span_event['event']['k'], 'v')
+
+    def test_empty_reporter_tags(self):
+        report = dummy_report(1, reporter_tags={})
+        for line in report.serialize_to_string().split('\n'):
+            json.loads(line)
+
+    def test_events_do_not_depend_on_key_order(self):
+        # Dicts without insertion order (Python < 3.6) may put "event" first.
+        class SortedEncoder(json_encoder.StdlibJSONEncoder):
+            name = 'sorted'
+
+            def __init__(self):
+                self._encoder = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+
+        report = dummy_report(2)
+        report.encoder = SortedEncoder()
+        report.metrics = collector.MetricSet(2.0, {'spans_sent': 3}, index='metrics')
+        events = [json.loads(line) for line in report.serialize_to_string().split('\n')]
+        self.assertEqual(len(events), 5)
+        self.assertEqual(events[0], {
+            'time': 2.0,
+            'event': 'metric',
+            'sourcetype': 'splunktracing:metrics',
+            'index': 'metrics',
+            'fields': {'metric_name:spans_sent': 3, 'component_name': 'test',
+                       'guid': 'abc', 'device': 'host'}})
+        for event in events[1:]:
+            self.assertEqual(sorted(event), ['event', 'sourcetype', 'time'])
+            self.assertEqual(event['event']['device'], 'host')
+            self.assertIn(event['event']['operation_name'], ('0', '1'))
+
+    def test_metric_event_without_values(self):
+        report = dummy_report(0)
+        report.metrics = collector.MetricSet(2.0, {})
+        event = json.loads(report.serialize_to_string())
+        self.assertEqual(event['fields'], {'component_name': 'test', 'guid': 'abc',
+                                           'device': 'host'})
+        self.assertNotIn('index', event)
+
+    def test_tags_fragment_is_cached(self):
+        encoder = json_encoder.StdlibJSONEncoder()
+        reporter = collector.Reporter(reporter_id=1, tags={'a': 'b'})
+        self.assertEqual(reporter.tags_fragment(encoder), b'"a":"b"')
+        self.assertIs(reporter.tags_fragment(encoder), reporter.tags_fragment(encoder))
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_default_containers_are_not_shared(self):
+        a = collector.Span(collector.SpanContext('1', '2', None), 'a', '1.5', 10)
+        b = collector.Span(collector.SpanContext('3', '4', None), 'b', '1.5', 10)
+        a.tags['k'] = 'v'
+        a.logs.append({'timestamp': 1.25})
+        a.span_context.baggage['user'] = 'u'
+        self.assertEqual(b.tags, {})
+        self.assertEqual(b.logs, [])
+        self.assertEqual(b.span_context.baggage, {})
+
+    def test_records_have_no_instance_dict(self):
+        records = [collector.Span(collector.SpanContext('1', '2', None), 'a', '1.5', 10),
+                   collector.SpanContext('1', '2', None),
+                   collector.Reporter(reporter_id=1, tags={}),
+                   collector.Timestamp(1, 2)]
+        for record in records:
+            self.assertFalse(hasattr(record, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
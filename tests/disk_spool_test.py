@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from splunktracing.disk_spool import _DiskSpool, _RECORD_HEADER
+from splunktracing.http_connection import _Payload
+
+
+def payload(i, size=100):
+    return _Payload(('%d:' % i).encode('ascii') + b'x' * size, 'gzip', i, size * 2)
+
+
+class DiskSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_spool(self, max_bytes=10 ** 6, max_age_seconds=None, segment_bytes=1000):
+        return _DiskSpool(self.directory, max_bytes, max_age_seconds, 1.0, 60.0,
+                          segment_bytes=segment_bytes)
+
+    def drain(self, spool):
+        result = []
+        while True:
+            p = spool.pop()
+            if p is None:
+                return result
+            result.append(p)
+
+    def segments(self):
+        return sorted(n for n in os.listdir(self.directory) if n.endswith('.seg'))
+
+    def test_payloads_round_trip_in_order(self):
+        spool = self.make_spool()
+        for i in range(30):
+            self.assertEqual(spool.push(payload(i)), [])
+        self.assertEqual(len(spool), 30)
+        self.assertTrue(len(self.segments()) > 1)
+
+        self.assertEqual(self.drain(spool), [payload(i) for i in range(30)])
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.bytes, 0)
+        self.assertEqual(self.segments(), [])
+
+    def test_push_after_partial_replay(self):
+        spool = self.make_spool()
+        for i in range(3):
+            spool.push(payload(i))
+        self.assertEqual(spool.pop(), payload(0))
+        spool.push(payload(3))
+        self.assertEqual(self.drain(spool), [payload(1), payload(2), payload(3)])
+
+    def test_push_front(self):
+        spool = self.make_spool()
+        spool.push(payload(0))
+        spool.push(payload(1))
+        p = spool.pop()
+        spool.push_front(p)
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(self.drain(spool), [payload(0), payload(1)])
+
+    def test_oldest_segments_are_dropped_past_max_bytes(self):
+        record = _RECORD_HEADER.size + len(payload(0).body)
+        spool = self.make_spool(max_bytes=record * 10, segment_bytes=record * 2)
+        dropped = []
+        for i in range(20):
+            dropped.extend(spool.push(payload(i)))
+        self.assertTrue(spool.bytes <= record * 10)
+        self.assertEqual([p.span_count for p in dropped], list(range(len(dropped))))
+        self.assertEqual([p.span_count for p in self.drain(spool)],
+                         list(range(len(dropped), 20)))
+
+    def test_expired_payloads_are_skipped(self):
+        spool = self.make_spool(max_age_seconds=0.05)
+        spool.push(payload(0))
+        time.sleep(0.1)
+        spool.push(payload(1))
+        self.assertEqual(self.drain(spool), [payload(1)])
+        self.assertEqual(spool.dropped_payloads, 1)
+        self.assertEqual([p.span_count for p in spool.take_dropped()], [0])
+        self.assertEqual(spool.take_dropped(), [])
+
+    def test_segments_survive_a_restart(self):
+        spool = self.make_spool()
+        for i in range(5):
+            spool.push(payload(i))
+        spool.pop()
+        # A process that died without replaying everything.
+        del spool
+        os.rename(os.path.join(self.directory, self.segments()[0]),
+                  os.path.join(self.directory, '999999999-000000000000.seg'))
+
+        spool = self.make_spool()
+        # Adopted on the first replay, not at construction.
+        self.assertEqual(len(spool), 0)
+        spool.push(payload(5))
+        self.assertEqual(self.drain(spool), [payload(i) for i in range(6)])
+        self.assertEqual(self.segments(), [])
+
+    def test_adopted_segments_over_max_bytes_are_dropped(self):
+        record = _RECORD_HEADER.size + len(payload(0).body)
+        spool = self.make_spool(segment_bytes=record * 2)
+        for i in range(6):
+            spool.push(payload(i))
+        del spool
+        for name in self.segments():
+            os.rename(os.path.join(self.directory, name),
+                      os.path.join(self.directory, '999999999-' + name.split('-')[1]))
+
+        spool = self.make_spool(max_bytes=record * 4, segment_bytes=record * 2)
+        self.assertEqual(spool.pop(), payload(2))
+        self.assertEqual([p.span_count for p in spool.take_dropped()], [0, 1])
+
+    def test_torn_record_is_cut_off(self):
+        spool = self.make_spool()
+        spool.push(payload(0))
+        spool.push(payload(1))
+        path = os.path.join(self.directory, self.segments()[0])
+        del spool
+        with open(path, 'ab') as f:
+            f.write(b'\x00' * 7)
+
+        spool = self.make_spool()
+        self.assertEqual(self.drain(spool), [payload(0), payload(1)])
+
+    def test_after_fork_starts_empty(self):
+        spool = self.make_spool()
+        spool.push(payload(0))
+        spool._after_fork()
+        # The pid of a forked child differs from its (running) parent's.
+        spool._pid = os.getppid()
+        self.assertEqual(len(spool), 0)
+        self.assertIsNone(spool.pop())
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_forked_child_adopts_segments_of_dead_processes(self):
+        spool = self.make_spool()
+        spool.push(payload(0))
+        del spool
+        os.rename(os.path.join(self.directory, self.segments()[0]),
+                  os.path.join(self.directory, '999999999-000000000000.seg'))
+
+        # A pre-fork server's master creates the spool but never replays.
+        spool = self.make_spool()
+        spool._after_fork()
+        spool._pid = os.getppid()
+        self.assertEqual(spool.pop(), payload(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
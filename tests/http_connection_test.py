@@ -0,0 +1,222 @@
+import threading
+import unittest
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from splunktracing import collector
+from splunktracing.http_connection import _HTTPConnection
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+                body += chunk
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.server.bodies.append(body)
+        self.server.headers.append(dict(self.headers))
+        response = b'{"text":"Success","code":0}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubCollector(object):
+    """StubCollector is a minimal HEC endpoint running on a local port.
+
+    Each connection is served by its own thread, so idle keep-alive
+    connections do not hold up new ones.
+    """
+
+    def __init__(self):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _CollectorHandler)
+        self.server.connections = 0
+        self.server.lock = threading.Lock()
+        self.server.bodies = []
+        self.server.headers = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/services/collector' % self.server.server_port
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def dummy_report(n=3):
+    reporter = collector.Reporter(reporter_id=1, tags={'component_name': 'test'})
+    spans = []
+    for i in range(n):
+        context = collector.SpanContext(trace_id='%x' % (1000 + i),
+                                        span_id='%x' % (2000 + i),
+                                        parent_id=None,
+                                        baggage={})
+        spans.append(collector.Span(span_context=context,
+                                    operation_name=str(i),
+                                    start_timestamp='1.5',
+                                    duration_micros=10,
+                                    tags={},
+                                    logs=[]))
+    return collector.ReportRequest(reporter, spans)
+
+
+class HTTPConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = StubCollector()
+
+    def tearDown(self):
+        self.collector.stop()
+
+    def test_open_and_close(self):
+        connection = _HTTPConnection(self.collector.url, 5)
+        self.assertFalse(connection.ready)
+        connection.open()
+        self.assertTrue(connection.ready)
+        connection.close()
+        self.assertFalse(connection.ready)
+        # Closing twice must be harmless.
+        connection.close()
+
+    def test_reports_reuse_connection(self):
+        connection = _HTTPConnection(self.collector.url, 5)
+        connection.open()
+        for _ in range(5):
+            connection.report('token', dummy_report())
+        connection.close()
+
+        self.assertEqual(len(self.collector.server.bodies), 5)
+        self.assertEqual(self.collector.server.connections, 1)
+        self.assertEqual(self.collector.server.headers[0]['Authorization'], 'Splunk token')
+
+    def test_concurrent_reports(self):
+        connection = _HTTPConnection(self.collector.url, 5, pool_size=4)
+        connection.open()
+        threads = [threading.Thread(target=connection.report, args=('token', dummy_report()))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        connection.close()
+
+        self.assertEqual(len(self.collector.server.bodies), 8)
+        self.assertTrue(self.collector.server.connections <= 4)
+        self.assertEqual(connection._in_flight, 0)
+
+    def test_idle_connections_are_reaped(self):
+        connection = _HTTPConnection(self.collector.url, 5, idle_seconds=0)
+        connection.open()
+        connection.report('token', dummy_report())
+        connection._last_used -= 1
+        connection.report('token', dummy_report())
+        connection.close()
+
+        self.assertEqual(len(self.collector.server.bodies), 2)
+        self.assertEqual(self.collector.server.connections, 2)
+
+    def test_report_body_is_streamed(self):
+        report = dummy_report(5000)
+        body, encoding, _ = _HTTPConnection(self.collector.url, 5)._encode_body(report)
+        self.assertEqual(encoding, 'gzip')
+        self.assertTrue(len(list(body)) > 1)
+
+        connection = _HTTPConnection(self.collector.url, 5)
+        connection.open()
+        connection.report('token', report)
+        connection.close()
+
+        headers = self.collector.server.headers[0]
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(self.collector.server.bodies[0],
+                         report.serialize_to_string().encode('utf-8') + b'\n')
+
+    def test_small_reports_are_not_compressed(self):
+        connection = _HTTPConnection(self.collector.url, 5, compression_min_bytes=10 ** 6)
+        connection.open()
+        connection.report('token', dummy_report())
+        connection.close()
+
+        headers = self.collector.server.headers[0]
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(self.collector.server.bodies[0],
+                         dummy_report().serialize_to_string().encode('utf-8') + b'\n')
+
+    def test_compression_none(self):
+        connection = _HTTPConnection(self.collector.url, 5, compression='none',
+                                     compression_min_bytes=0)
+        connection.open()
+        connection.report('token', dummy_report(2000))
+        connection.close()
+
+        headers = self.collector.server.headers[0]
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(self.collector.server.bodies[0],
+                         dummy_report(2000).serialize_to_string().encode('utf-8') + b'\n')
+
+    def test_compression_level(self):
+        report = dummy_report(2000)
+        sizes = []
+        for level in (1, 9):
+            connection = _HTTPConnection(self.collector.url, 5, compression_level=level)
+            body, _, _ = connection._encode_body(report)
+            sizes.append(len(b''.join(body)))
+        self.assertTrue(sizes[1] < sizes[0])
+
+    def test_adaptive_compression(self):
+        connection = _HTTPConnection(self.collector.url, 5, compression_level=6,
+                                     adaptive_compression=True,
+                                     latency_budget_seconds=1.0)
+        connection._adapt_compression_level(2.0)
+        connection._adapt_compression_level(2.0)
+        self.assertEqual(connection.compression_level, 4)
+        connection._adapt_compression_level(0.5)
+        self.assertEqual(connection.compression_level, 4)
+        for _ in range(5):
+            connection._adapt_compression_level(0.1)
+        self.assertEqual(connection.compression_level, 6)
+
+    def test_empty_report_is_not_sent(self):
+        connection = _HTTPConnection(self.collector.url, 5)
+        connection.open()
+        self.assertIsNone(connection.report('token', dummy_report(0)))
+        connection.close()
+        self.assertEqual(len(self.collector.server.bodies), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
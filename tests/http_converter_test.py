@@ -0,0 +1,55 @@
+import unittest
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+from splunktracing import constants
+from splunktracing.http_converter import HttpConverter
+
+
+def make_span(i, parent_id=None):
+    span = BasicSpan(None, operation_name='op-%d' % i,
+                     context=SpanContext(trace_id=1000, span_id=2000 + i),
+                     parent_id=parent_id,
+                     start_time=1500000000.25 + i)
+    span.duration = 0.0015
+    return span
+
+
+class HttpConverterTest(unittest.TestCase):
+
+    def test_create_span_record(self):
+        record = HttpConverter().create_span_record(make_span(1, parent_id=255), 1)
+        self.assertEqual(record.span_context.trace_id, '3e8')
+        self.assertEqual(record.span_context.span_id, '7d1')
+        self.assertEqual(record.span_context.parent_id, 'ff')
+        self.assertEqual(record.operation_name, 'op-1')
+        self.assertEqual(record.start_timestamp, '1500000001.250000000')
+        self.assertEqual(record.duration_micros, 1500)
+
+    def test_root_span_keeps_empty_parent(self):
+        record = HttpConverter().create_span_record(make_span(1), 1)
+        self.assertIsNone(record.span_context.parent_id)
+
+    def test_batch_matches_single_conversion(self):
+        converter = HttpConverter()
+        spans = [make_span(i, parent_id=2000) for i in range(5)] + [make_span(5)]
+        batch = converter.create_span_records(spans, 1)
+        for span, record in zip(spans, batch):
+            single = converter.create_span_record(span, 1)
+            for name in ('trace_id', 'span_id', 'parent_id'):
+                self.assertEqual(getattr(record.span_context, name),
+                                 getattr(single.span_context, name))
+            self.assertEqual(record.start_timestamp, single.start_timestamp)
+            self.assertEqual(record.duration_micros, single.duration_micros)
+            self.assertEqual(record.operation_name, single.operation_name)
+
+    def test_hex_cache_is_bounded(self):
+        converter = HttpConverter()
+        for i in range(constants.HEX_ID_CACHE_SIZE + 10):
+            self.assertEqual(converter._hex_id(i), '%x' % i)
+        self.assertTrue(len(converter._hex_ids) <= constants.HEX_ID_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import subprocess
+import sys
+import unittest
+
+from opentracing import Format
+
+import splunktracing
+from splunktracing.propagation import SplunkTracingFormat
+
+# Imported on first use only: the HTTP transport, protobuf and the binary
+# propagators built on it, TLS settings and asyncio.
+LAZY_MODULES = ('requests', 'urllib3', 'ssl', 'asyncio', 'google.protobuf',
+                'basictracer.binary_propagator',
+                'splunktracing.lightstep_carrier_pb2',
+                'splunktracing.splunk_binary_propagator',
+                'splunktracing.async_recorder')
+
+
+def imported_modules(code):
+    """Run `code` under python -X importtime and return the names of the
+    modules it imported."""
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    modules = set()
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'imported package':
+                modules.add(name)
+    return modules
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def assertNotImported(self, modules):
+        self.assertIn('splunktracing.tracer', modules)
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, modules)
+
+    def test_import(self):
+        self.assertNotImported(imported_modules('import splunktracing'))
+
+    def test_tracer_construction_and_first_span(self):
+        self.assertNotImported(imported_modules(
+            'import splunktracing\n'
+            'tracer = splunktracing.Tracer(periodic_flush_seconds=0, '
+            'ip_address="127.0.0.1")\n'
+            'tracer.start_span("op").finish()\n'))
+
+
+class LazyPropagatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = splunktracing.Tracer(periodic_flush_seconds=0)
+
+    def test_binary_round_trip(self):
+        span = self.tracer.start_span('op')
+        span.set_baggage_item('k', 'v')
+        for fmt in (Format.BINARY, SplunkTracingFormat.SPLUNK_BINARY):
+            carrier = bytearray()
+            self.tracer.inject(span.context, fmt, carrier)
+            context = self.tracer.extract(fmt, carrier)
+            self.assertEqual(context.trace_id, span.context.trace_id)
+            self.assertEqual(context.span_id, span.context.span_id)
+            self.assertEqual(context.baggage, {'k': 'v'})
+        span.finish()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import os
+import sys
+import unittest
+
+from splunktracing import json_encoder
+from tests.collector_test import dummy_report
+
+
+# Set by the tox env that installs the optional backends, so that they are
+# actually compared with the standard library rather than skipped.
+REQUIRED_BACKENDS = [name for name in
+                     os.environ.get('SPLUNKTRACING_JSON_BACKENDS', '').split(',') if name]
+
+
+def installed_backends():
+    backends = []
+    for name in ('json', 'orjson', 'ujson'):
+        try:
+            backends.append(json_encoder.get_encoder(name))
+        except ImportError:
+            if name in REQUIRED_BACKENDS:
+                raise
+    return backends
+
+
+SAMPLES = [
+    {},
+    {'a': 'b', 'n': 1, 'neg': -7, 'big': 2 ** 63 - 1, 'f': 1500000000.25,
+     't': True, 'none': None},
+    {'nested': {'list': [1, 'two', 3.5, False], 'empty': []}},
+    {'unicode': u'non-ascii: ​ é \U0001f600', 'slash': 'a/b',
+     'quote': 'say "hi"\n\ttab\\'},
+    {'time': '1500000000.123456', 'event': {'tags': {'http.url': 'http://x/y?z=1'}}},
+    # A path decoded with 'surrogateescape'.
+    {'path': u'/srv/caf\udce9', u'caf\udce9': 1},
+]
+
+
+# Written differently by each backend, see the json_encoder docstring.
+FLOAT_SAMPLES = [
+    {'big': 1e16, 'small': 1e-7, 'huge': 1.5e300, 'tiny': 5e-324,
+     'long': 123456789012345678.0, 'neg': -2.5e-10},
+    {'nan': float('nan'), 'inf': float('inf'), 'ninf': float('-inf')},
+]
+
+
+class Unserializable(object):
+    def __str__(self):
+        return 'unserializable!'
+
+
+class JSONEncoderTest(unittest.TestCase):
+
+    def test_stdlib_output(self):
+        encoder = json_encoder.StdlibJSONEncoder()
+        self.assertEqual(encoder.dumps({'a': 'b', 'c': [1, 2]}), b'{"a":"b","c":[1,2]}')
+        self.assertEqual(encoder.dumps({'u': u'é'}), u'{"u":"é"}'.encode('utf-8'))
+
+    @unittest.skipIf(sys.version_info < (3,), 'Python 2 encodes lone surrogates as UTF-8')
+    def test_lone_surrogates_are_escaped(self):
+        encoder = json_encoder.StdlibJSONEncoder()
+        self.assertEqual(encoder.dumps({'path': u'caf\udce9 é'}),
+                         u'{"path":"caf\\udce9 é"}'.encode('utf-8'))
+
+    def test_span_with_lone_surrogate_does_not_fail_report(self):
+        report = dummy_report(3)
+        report.spans[1].tags['path'] = u'/srv/caf\udce9'
+        expected = list(report.iter_serialized())
+        self.assertIn(b'"path":"/srv/caf\\udce9"', b''.join(expected))
+        for encoder in installed_backends():
+            report.encoder = encoder
+            self.assertEqual(list(report.iter_serialized()), expected, encoder.name)
+
+    def test_unknown_values_are_stringified(self):
+        for encoder in installed_backends():
+            self.assertEqual(encoder.dumps({'obj': Unserializable()}),
+                             b'{"obj":"unserializable!"}', encoder.name)
+
+    def test_values_a_backend_refuses_fall_back_to_stdlib(self):
+        reference = json_encoder.StdlibJSONEncoder()
+        sample = {'big': 2 ** 70, 'neg': -2 ** 64, 'n': 1}
+        for encoder in installed_backends():
+            self.assertEqual(encoder.dumps(sample), reference.dumps(sample), encoder.name)
+
+    def test_large_int_in_log_does_not_fail_report(self):
+        report = dummy_report(1)
+        report.spans[0].logs[0]['n'] = 2 ** 80
+        expected = list(report.iter_serialized())
+        for encoder in installed_backends():
+            report.encoder = encoder
+            self.assertEqual(list(report.iter_serialized()), expected, encoder.name)
+
+    def test_required_backends_are_installed(self):
+        names = [encoder.name for encoder in installed_backends()]
+        for name in REQUIRED_BACKENDS:
+            self.assertIn(name, names)
+
+    def test_backends_are_byte_compatible(self):
+        reference = json_encoder.StdlibJSONEncoder()
+        for encoder in installed_backends():
+            for sample in SAMPLES:
+                self.assertEqual(encoder.dumps(sample), reference.dumps(sample),
+                                 '{0}: {1!r}'.format(encoder.name, sample))
+
+    def test_floats_decode_to_the_same_values(self):
+        reference = json_encoder.StdlibJSONEncoder()
+        for encoder in installed_backends():
+            for sample in FLOAT_SAMPLES:
+                expected = json.loads(reference.dumps(sample).decode('utf-8'))
+                decoded = json.loads(encoder.dumps(sample).decode('utf-8'))
+                for key, value in expected.items():
+                    if math.isnan(value) or math.isinf(value):
+                        # orjson writes null for non-finite floats.
+                        if decoded[key] is None:
+                            continue
+                        self.assertEqual(repr(decoded[key]), repr(value), encoder.name)
+                    else:
+                        self.assertEqual(decoded[key], value, encoder.name)
+
+    def test_reports_are_byte_compatible(self):
+        reference = dummy_report(5)
+        expected = list(reference.iter_serialized())
+        for encoder in installed_backends():
+            report = dummy_report(5)
+            report.encoder = encoder
+            self.assertEqual(list(report.iter_serialized()), expected, encoder.name)
+
+    def test_get_encoder(self):
+        self.assertIn(json_encoder.get_encoder().name, ('orjson', 'ujson', 'json'))
+        self.assertEqual(json_encoder.get_encoder('json').name, 'json')
+        encoder = json_encoder.StdlibJSONEncoder()
+        self.assertIs(json_encoder.get_encoder(encoder), encoder)
+        self.assertRaises(ValueError, json_encoder.get_encoder, 'yaml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import threading
+import unittest
+
+from splunktracing.metrics import _Stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_concurrent_increments_are_not_lost(self):
+        stats = _Stats()
+
+        def work():
+            for _ in range(10000):
+                stats.incr('spans_recorded')
+            stats.incr('bytes_truncated', 5)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(stats.get('spans_recorded'), 80000)
+        self.assertEqual(stats.snapshot()['bytes_truncated'], 40)
+
+    def test_shards_of_exited_threads_are_folded(self):
+        stats = _Stats()
+        for _ in range(200):
+            t = threading.Thread(target=stats.incr, args=('spans_recorded', 2))
+            t.start()
+            t.join()
+        self.assertTrue(len(stats._shards) <= 1)
+        stats.incr('spans_recorded')
+        self.assertEqual(stats.get('spans_recorded'), 401)
+        self.assertEqual(stats.snapshot()['spans_recorded'], 401)
+        self.assertEqual(len(stats._shards), 1)
+
+    def test_flush_duration_histogram(self):
+        stats = _Stats()
+        for seconds in (0.001, 0.02, 0.02, 3.0, 100.0):
+            stats.observe_flush(seconds)
+        histogram = stats.snapshot()['flush_duration_seconds']
+        buckets = dict(histogram['buckets'])
+        self.assertEqual(buckets[0.005], 1)
+        self.assertEqual(buckets[0.025], 3)
+        self.assertEqual(buckets[5.0], 4)
+        self.assertEqual(buckets[float('inf')], 5)
+        self.assertEqual(histogram['count'], 5)
+        self.assertEqual(histogram['max'], 100.0)
+        self.assertAlmostEqual(histogram['sum'], 103.041)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,18 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 
+import requests
+
 import splunktracing.constants
 import splunktracing.recorder
 import splunktracing.tracer
 import splunktracing.recorder
+from splunktracing.http_connection import _HTTPConnection, _Payload
 from basictracer.span import BasicSpan
 from basictracer.context import SpanContext
 import pytest
@@ -154,5 +162,580 @@ def check_spans(converter, report):
             start_time=time.time())
 
 
+class RecorderBufferTest(unittest.TestCase):
+    """Exercises the span buffer shared by record_span and the flush path."""
+
+    def setUp(self):
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            component_name='python/runtime_test',
+            periodic_flush_seconds=0,
+            max_span_records=100000)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+
+    def tearDown(self):
+        self.recorder._disabled_runtime = True
+
+    def dummy_basic_span(self, i):
+        span = BasicSpan(
+            self.tracer,
+            operation_name=str(i),
+            context=SpanContext(trace_id=1000+i, span_id=2000+i),
+            start_time=time.time())
+        span.duration = 0.001
+        return span
+
+    def test_drain_preserves_order(self):
+        for i in range(10):
+            self.recorder.record_span(self.dummy_basic_span(i))
+        report = self.recorder._construct_report_request()
+        self.assertEqual([s.operation_name for s in report.spans],
+                         [str(i) for i in range(10)])
+        self.assertEqual(len(self.recorder._span_records), 0)
+
+    def test_concurrent_record_and_drain(self):
+        threads_count = 8
+        per_thread = 500
+        drained = []
+        done = threading.Event()
+
+        def produce(offset):
+            for i in range(per_thread):
+                self.recorder.record_span(self.dummy_basic_span(offset + i))
+
+        def consume():
+            while not done.is_set():
+                drained.extend(self.recorder._construct_report_request().spans)
+            drained.extend(self.recorder._construct_report_request().spans)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        producers = [threading.Thread(target=produce, args=(n * per_thread,))
+                     for n in range(threads_count)]
+        for t in producers:
+            t.start()
+        for t in producers:
+            t.join()
+        done.set()
+        consumer.join()
+
+        names = sorted(int(s.operation_name) for s in drained)
+        self.assertEqual(names, list(range(threads_count * per_thread)))
+
+    def test_deferred_conversion_matches_immediate(self):
+        deferred = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            deferred_conversion=True)
+        tracer = splunktracing.tracer._SplunkTracer(False, deferred, None)
+        spans = []
+        for i in range(5):
+            span = self.dummy_basic_span(i)
+            span.parent_id = 3000 + i
+            span.log_kv({'event': 'step', 'i': i})
+            spans.append(span)
+            self.recorder.record_span(span)
+            deferred.record_span(span)
+        deferred._disabled_runtime = True
+
+        self.assertTrue(all(type(r) is splunktracing.recorder._SpanSnapshot
+                            for _, r in deferred._span_records))
+        expected = self.recorder._construct_report_request().spans
+        actual = deferred._construct_report_request().spans
+        self.assertEqual(len(actual), len(expected))
+        for a, e in zip(actual, expected):
+            self.assertEqual(a.operation_name, e.operation_name)
+            self.assertEqual(a.span_context.trace_id, e.span_context.trace_id)
+            self.assertEqual(a.span_context.span_id, e.span_context.span_id)
+            self.assertEqual(a.span_context.parent_id, e.span_context.parent_id)
+            self.assertEqual(a.start_timestamp, e.start_timestamp)
+            self.assertEqual(a.duration_micros, e.duration_micros)
+            self.assertEqual(a.tags, e.tags)
+            self.assertEqual(a.logs, e.logs)
+
+    def test_byte_budget(self):
+        recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            max_buffer_bytes=10000)
+        tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        for i in range(100):
+            span = self.dummy_basic_span(i)
+            span.tags = {'payload': 'x' * 500}
+            recorder.record_span(span)
+        recorder._disabled_runtime = True
+
+        buffered = len(recorder._span_records)
+        self.assertTrue(10 <= buffered < 20, buffered)
+        self.assertTrue(recorder._buffered_bytes >= 10000)
+        recorder._construct_report_request()
+        self.assertEqual(recorder._buffered_bytes, 0)
+
+    def test_oversized_values_are_truncated(self):
+        recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            max_value_length=10,
+            max_log_bytes=90)
+        tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        span = self.dummy_basic_span(0)
+        span.tags = {'short': 'abc', 'long': 'y' * 25}
+        span.log_kv({'a': 'z' * 30, 'n': 5})
+        span.log_kv({'b': '1' * 9, 'c': '2' * 9, 'd': '3' * 9})
+        recorder.record_span(span)
+        recorder._disabled_runtime = True
+
+        record = recorder._construct_report_request().spans[0]
+        self.assertEqual(record.tags['short'], 'abc')
+        self.assertEqual(record.tags['long'], 'y' * 10)
+        logs = record.logs[-2:]
+        self.assertEqual(logs[0]['a'], 'z' * 10)
+        self.assertEqual(logs[0]['n'], 5)
+        # The third field no longer fits in max_log_bytes.
+        self.assertEqual(sorted(k for k in logs[1] if k != 'timestamp'), ['b', 'c'])
+        self.assertEqual(recorder.stats()['bytes_truncated'], 15 + 20 + 10)
+
+    def test_restore_puts_records_back_in_front(self):
+        for i in range(3):
+            self.recorder.record_span(self.dummy_basic_span(i))
+        report = self.recorder._construct_report_request()
+        self.recorder.record_span(self.dummy_basic_span(3))
+        self.recorder._restore_spans(report)
+        report = self.recorder._construct_report_request()
+        self.assertEqual([s.operation_name for s in report.spans],
+                         ['0', '1', '2', '3'])
+
+
+class FlakyConnection(_HTTPConnection):
+    """An _HTTPConnection whose requests never leave the process; they either
+    fail or are recorded, depending on `failing`."""
+
+    def __init__(self):
+        super(FlakyConnection, self).__init__('http://localhost:8088', 1,
+                                              compression_min_bytes=10 ** 9)
+        self.failing = False
+        self.bodies = []
+
+    def _post(self, auth, body, content_encoding):
+        if self.failing:
+            raise requests.exceptions.ConnectionError('collector down')
+        if not isinstance(body, bytes):
+            body = b''.join(body)
+        self.bodies.append(body)
+        return b''
+
+
+class RecorderRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            retry_initial_backoff_seconds=60)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+        self.connection = FlakyConnection()
+        self.connection._stats = self.recorder._stats
+        self.connection.open()
+
+    def tearDown(self):
+        self.recorder._disabled_runtime = True
+
+    def record(self, name):
+        span = BasicSpan(self.tracer, operation_name=name,
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        self.recorder.record_span(span)
+
+    def operation_names(self, body):
+        events = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        return [e['event']['operation_name'] for e in events
+                if e['sourcetype'] == 'splunktracing:span']
+
+    def test_failed_report_is_queued_and_resent_first(self):
+        self.connection.failing = True
+        self.record('a')
+        self.assertFalse(self.recorder._flush_worker(self.connection))
+        self.assertEqual(len(self.recorder._retry_queue), 1)
+        self.assertEqual(len(self.recorder._span_records), 0)
+
+        # Still backing off: nothing is attempted and new spans stay buffered.
+        self.connection.failing = False
+        self.record('b')
+        self.assertFalse(self.recorder._flush_worker(self.connection))
+        self.assertEqual(self.connection.bodies, [])
+        self.assertEqual(len(self.recorder._span_records), 1)
+
+        self.recorder._retry_queue._next_attempt = 0
+        self.assertTrue(self.recorder._flush_worker(self.connection))
+        self.assertEqual([self.operation_names(b) for b in self.connection.bodies],
+                         [['a'], ['b']])
+        self.assertEqual(len(self.recorder._retry_queue), 0)
+        self.assertTrue(self.recorder._retry_queue.ready(time.time()))
+
+    def test_failed_retry_stays_at_head(self):
+        self.connection.failing = True
+        self.record('a')
+        self.recorder._flush_worker(self.connection)
+        self.record('b')
+        self.assertFalse(self.recorder.flush(self.connection))
+        self.assertEqual(len(self.recorder._retry_queue), 1)
+        self.assertEqual(len(self.recorder._span_records), 1)
+
+        self.connection.failing = False
+        self.assertTrue(self.recorder.flush(self.connection))
+        self.assertEqual([self.operation_names(b) for b in self.connection.bodies],
+                         [['a'], ['b']])
+
+    def test_stats(self):
+        self.connection.failing = True
+        self.record('a')
+        self.record('b')
+        self.recorder._flush_worker(self.connection)
+        self.connection.failing = False
+        self.record('c')
+        self.recorder.flush(self.connection)
+
+        stats = self.recorder.stats()
+        self.assertEqual(stats['spans_recorded'], 3)
+        self.assertEqual(stats['spans_dropped'], 0)
+        self.assertEqual(stats['spans_retried'], 2)
+        self.assertEqual(stats['spans_flushed'], 3)
+        self.assertEqual(stats['reports_failed'], 1)
+        self.assertEqual(stats['reports_sent'], 2)
+        self.assertEqual(stats['bytes_uncompressed'],
+                         sum(len(b) for b in self.connection.bodies))
+        self.assertEqual(stats['flush_duration_seconds']['count'], 2)
+        self.assertIn('collector down', stats['last_error'])
+        self.assertEqual(stats['buffered_spans'], 0)
+        self.assertEqual(stats['retry_queue_reports'], 0)
+
+    def test_emit_metrics(self):
+        self.recorder._emit_metrics = True
+        self.recorder._metrics_index = 'tracer_metrics'
+        self.record('a')
+        self.recorder.flush(self.connection)
+
+        events = [json.loads(line) for line in
+                  self.connection.bodies[0].decode('utf-8').splitlines()]
+        metric = events[0]
+        self.assertEqual(metric['event'], 'metric')
+        self.assertEqual(metric['index'], 'tracer_metrics')
+        self.assertEqual(metric['fields']['metric_name:splunktracing.spans_recorded'], 1)
+        self.assertIn('guid', metric['fields'])
+
+
+class RecorderSpillTest(RecorderRetryTest):
+    """Runs the retry tests again with failed reports spilled to disk."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            retry_initial_backoff_seconds=60,
+            spill_directory=self.directory)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+        self.connection = FlakyConnection()
+        self.connection._stats = self.recorder._stats
+        self.connection.open()
+
+    def tearDown(self):
+        RecorderRetryTest.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_spilled_reports_outlive_the_recorder(self):
+        self.connection.failing = True
+        self.record('a')
+        self.assertFalse(self.recorder._flush_worker(self.connection))
+        self.assertTrue(os.listdir(self.directory))
+        self.recorder._disabled_runtime = True
+
+        # The next process using the directory sends them.
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            spill_directory=self.directory)
+        self.connection.failing = False
+        self.recorder._flush_worker(self.connection)
+        self.assertEqual([self.operation_names(b) for b in self.connection.bodies], [['a']])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_expired_spans_are_counted_as_retry_dropped(self):
+        self.recorder._retry_queue._max_age_seconds = 0
+        self.connection.failing = True
+        self.record('a')
+        self.record('b')
+        self.recorder._flush_worker(self.connection)
+        time.sleep(0.01)
+
+        self.connection.failing = False
+        self.recorder._retry_queue._next_attempt = 0
+        self.recorder._flush_worker(self.connection)
+        self.assertEqual(self.connection.bodies, [])
+        stats = self.recorder.stats()
+        self.assertEqual(stats['spans_retried'], 2)
+        self.assertEqual(stats['spans_retry_dropped'], 2)
+
+
+class RecorderFlushThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FlakyConnection()
+        connection = self.connection
+
+        class TestRecorder(splunktracing.recorder.Recorder):
+            def _create_connection(self):
+                return connection
+
+        self.recorder = TestRecorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=60,
+            max_span_records=100,
+            flush_high_water_mark=0.2)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+
+    def tearDown(self):
+        self.recorder.shutdown(flush=False)
+
+    def record(self, i):
+        span = BasicSpan(self.tracer, operation_name=str(i),
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        self.recorder.record_span(span)
+
+    def wait_for_bodies(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.connection.bodies) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self.connection.bodies)
+
+    def test_high_water_mark_triggers_flush(self):
+        # Let the flush thread get past its initial, empty flush.
+        self.recorder._maybe_init_flush_thread()
+        time.sleep(0.1)
+
+        for i in range(19):
+            self.record(i)
+        time.sleep(0.2)
+        self.assertEqual(len(self.connection.bodies), 0)
+
+        self.record(19)
+        self.assertEqual(self.wait_for_bodies(1), 1)
+
+    def test_shutdown_stops_flush_thread(self):
+        self.recorder._maybe_init_flush_thread()
+        self.recorder.shutdown(flush=False)
+        self.recorder._flush_thread.join(5)
+        self.assertFalse(self.recorder._flush_thread.is_alive())
+
+
+class SlowConnection(FlakyConnection):
+    """A FlakyConnection whose requests take `delay` seconds, keeping track
+    of how many were in flight at once."""
+
+    def __init__(self, delay):
+        super(SlowConnection, self).__init__()
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counter_lock = threading.Lock()
+
+    def _post(self, auth, body, content_encoding):
+        with self.counter_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return super(SlowConnection, self)._post(auth, body, content_encoding)
+        finally:
+            with self.counter_lock:
+                self.in_flight -= 1
+
+
+class RecorderFlushWorkersTest(RecorderRetryTest):
+
+    def setUp(self):
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=0,
+            retry_initial_backoff_seconds=60,
+            # Two spans per report.
+            max_report_bytes=3 * splunktracing.constants.SPAN_RECORD_OVERHEAD_BYTES,
+            flush_workers=4)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+        self.connection = FlakyConnection()
+        self.connection._stats = self.recorder._stats
+        self.connection.open()
+
+    def all_operation_names(self):
+        return [n for b in self.connection.bodies for n in self.operation_names(b)]
+
+    def test_reports_are_capped(self):
+        self.recorder._emit_metrics = True
+        for i in range(9):
+            self.record(str(i))
+        self.assertTrue(self.recorder.flush(self.connection))
+        self.assertEqual(len(self.connection.bodies), 5)
+        self.assertEqual(self.all_operation_names(), [str(i) for i in range(9)])
+        metrics = [b.count(b'splunktracing:metrics') for b in self.connection.bodies]
+        self.assertEqual(metrics, [1, 0, 0, 0, 0])
+        self.assertEqual(self.recorder.stats()['reports_sent'], 5)
+
+    def test_failure_leaves_the_rest_buffered(self):
+        for i in range(6):
+            self.record(str(i))
+        self.connection.failing = True
+        self.assertFalse(self.recorder.flush(self.connection))
+        self.assertEqual(len(self.recorder._retry_queue), 1)
+        self.assertEqual(len(self.recorder._span_records), 4)
+
+        self.connection.failing = False
+        self.assertTrue(self.recorder.flush(self.connection))
+        self.assertEqual(self.all_operation_names(), [str(i) for i in range(6)])
+
+    def test_reports_are_sent_concurrently(self):
+        self.connection = SlowConnection(0.2)
+        self.connection._stats = self.recorder._stats
+        self.connection.open()
+        pool = splunktracing.recorder._FlushWorkers(4, 'test')
+        for i in range(8):
+            self.record(str(i))
+        start = time.time()
+        self.assertTrue(self.recorder._flush_worker(self.connection, pool=pool))
+        self.assertTrue(pool.wait(5))
+        elapsed = time.time() - start
+        pool.stop()
+        self.assertEqual(self.connection.max_in_flight, 4)
+        self.assertTrue(elapsed < 0.6, elapsed)
+        self.assertEqual(sorted(self.all_operation_names()), [str(i) for i in range(8)])
+        self.assertEqual(self.recorder.stats()['spans_flushed'], 8)
+
+    def test_shutdown_waits_for_workers(self):
+        connection = SlowConnection(0.1)
+
+        class TestRecorder(splunktracing.recorder.Recorder):
+            def _create_connection(self):
+                return connection
+
+        recorder = TestRecorder(collector_encryption='none',
+                                collector_host='localhost',
+                                periodic_flush_seconds=60,
+                                max_span_records=10,
+                                max_report_bytes=1,
+                                flush_workers=3)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        self.recorder = recorder
+        for i in range(10):
+            self.record(str(i))
+        recorder.shutdown()
+        deadline = time.time() + 5
+        while len(connection.bodies) < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(n for b in connection.bodies for n in self.operation_names(b)),
+                         [str(i) for i in range(10)])
+
+    def test_flush_workers_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            splunktracing.recorder.Recorder(periodic_flush_seconds=0, flush_workers=0)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class RecorderForkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = splunktracing.recorder.Recorder(
+            collector_encryption='none',
+            collector_host='localhost',
+            periodic_flush_seconds=60)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, self.recorder, None)
+
+    def tearDown(self):
+        self.recorder.shutdown(flush=False)
+
+    def record(self):
+        span = BasicSpan(self.tracer, operation_name='op',
+                         context=SpanContext(trace_id=1, span_id=2),
+                         start_time=time.time())
+        span.duration = 0.001
+        self.recorder.record_span(span)
+
+    def state(self):
+        return {'pid': os.getpid(),
+                'guid': self.recorder.guid,
+                'runtime_guid': self.recorder._runtime.tags['guid'],
+                'buffered': len(self.recorder._span_records),
+                'retries': len(self.recorder._retry_queue),
+                'recorded': self.recorder.stats()['spans_recorded'],
+                'flush_thread': self.recorder._flush_thread is not None}
+
+    def run_in_child(self, fn):
+        """Fork, run fn() in the child and return what it returned."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                os.write(write_fd, json.dumps(fn()).encode('utf-8'))
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as f:
+            result = json.loads(f.read().decode('utf-8'))
+        os.waitpid(pid, 0)
+        return result
+
+    def test_child_starts_afresh(self):
+        self.record()
+        self.recorder._retry_queue.push(
+            _Payload(b'x', None, 1, 1))
+        parent = self.state()
+        self.assertEqual(parent['buffered'], 1)
+        self.assertTrue(parent['flush_thread'])
+
+        child = self.run_in_child(self.state)
+        self.assertNotEqual(child['pid'], parent['pid'])
+        self.assertNotEqual(child['guid'], parent['guid'])
+        self.assertEqual(child['runtime_guid'], '%x' % child['guid'])
+        self.assertEqual((child['buffered'], child['retries'], child['recorded']), (0, 0, 0))
+        self.assertFalse(child['flush_thread'])
+
+        # The parent keeps its state.
+        self.assertEqual(self.state(), parent)
+
+    def test_child_records_and_starts_flush_thread(self):
+        def child():
+            self.record()
+            return self.state()
+
+        state = self.run_in_child(child)
+        self.assertEqual((state['buffered'], state['recorded']), (1, 1))
+        self.assertTrue(state['flush_thread'])
+
+    def test_pid_check_without_fork_hooks(self):
+        self.record()
+        guid = self.recorder.guid
+        self.recorder._pid = -1
+        old_hooks = splunktracing.recorder._FORK_HOOKS
+        splunktracing.recorder._FORK_HOOKS = False
+        try:
+            self.record()
+        finally:
+            splunktracing.recorder._FORK_HOOKS = old_hooks
+        self.assertEqual(self.recorder._pid, os.getpid())
+        self.assertNotEqual(self.recorder.guid, guid)
+        self.assertEqual(len(self.recorder._span_records), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+import random
+import unittest
+
+from splunktracing.http_connection import _Payload
+from splunktracing.retry_queue import _RetryQueue
+
+
+def payload(size, tag=0):
+    return _Payload(b'x' * size, 'gzip', tag, size)
+
+
+class RetryQueueTest(unittest.TestCase):
+
+    def test_fifo(self):
+        queue = _RetryQueue(100, 1, 60)
+        for i in range(3):
+            queue.push(payload(10, i))
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.bytes, 30)
+        self.assertEqual([queue.pop().span_count for _ in range(3)], [0, 1, 2])
+        self.assertIsNone(queue.pop())
+        self.assertEqual(queue.bytes, 0)
+
+    def test_push_front(self):
+        queue = _RetryQueue(100, 1, 60)
+        queue.push(payload(10, 1))
+        queue.push_front(payload(10, 0))
+        self.assertEqual([queue.pop().span_count for _ in range(2)], [0, 1])
+
+    def test_byte_cap_drops_oldest(self):
+        queue = _RetryQueue(25, 1, 60)
+        self.assertEqual(queue.push(payload(10, 0)), [])
+        self.assertEqual(queue.push(payload(10, 1)), [])
+        self.assertEqual([p.span_count for p in queue.push(payload(10, 2))], [0])
+        self.assertEqual(queue.bytes, 20)
+        self.assertEqual(queue.pop().span_count, 1)
+        self.assertEqual(len(queue.push(payload(26))), 1)
+        self.assertEqual(queue.dropped_payloads, 2)
+
+    def test_backoff(self):
+        queue = _RetryQueue(100, 1, 8, rng=random.Random(1))
+        self.assertTrue(queue.ready(0))
+        for failures in range(1, 7):
+            queue.record_failure(100)
+            delay = queue._next_attempt - 100
+            expected = min(8, 2 ** (failures - 1))
+            self.assertTrue(expected / 2.0 <= delay <= expected, (failures, delay))
+            self.assertFalse(queue.ready(100))
+            self.assertTrue(queue.ready(100 + expected))
+        queue.record_success()
+        self.assertTrue(queue.ready(100))
+
+    def test_jitter_spreads_retries(self):
+        delays = set()
+        for seed in range(20):
+            queue = _RetryQueue(100, 4, 60, rng=random.Random(seed))
+            queue.record_failure(0)
+            delays.add(queue._next_attempt)
+        self.assertTrue(len(delays) > 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
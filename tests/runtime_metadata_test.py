@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+
+from splunktracing import json_encoder
+from splunktracing import runtime_metadata
+from splunktracing.recorder import Recorder
+from splunktracing.runtime_metadata import _HostMetadata
+
+
+class SlowResolver(object):
+    """Stands in for util.local_ip, returning once released."""
+
+    def __init__(self, ip='10.1.2.3'):
+        self.ip = ip
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.ip
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class HostMetadataTest(unittest.TestCase):
+
+    def test_lookup_runs_once_in_the_background(self):
+        resolver = SlowResolver()
+        host = _HostMetadata(resolve_ip=resolver)
+        results = []
+        start = time.time()
+        self.assertIsNone(host.ip_address(callback=results.append))
+        self.assertIsNone(host.ip_address(0.05))
+        self.assertTrue(time.time() - start < 1)
+
+        resolver.release.set()
+        self.assertTrue(wait_for(lambda: results == ['10.1.2.3']))
+        self.assertEqual(host.ip_address(), '10.1.2.3')
+        self.assertEqual(resolver.calls, 1)
+
+    def test_failed_lookup(self):
+        def fail():
+            raise IOError('no network')
+        host = _HostMetadata(resolve_ip=fail)
+        self.assertIsNone(host.ip_address(1))
+        self.assertTrue(host._resolved.is_set())
+
+    def test_after_fork_restarts_a_pending_lookup(self):
+        resolver = SlowResolver()
+        host = _HostMetadata(resolve_ip=resolver)
+        host.ip_address(callback=lambda ip: None)
+        host._after_fork()
+        self.assertIsNone(host._thread)
+        self.assertEqual(host._callbacks, [])
+        resolver.release.set()
+        self.assertEqual(host.ip_address(1), '10.1.2.3')
+
+    def test_after_fork_keeps_a_known_address(self):
+        host = _HostMetadata(resolve_ip=lambda: '10.1.2.3')
+        self.assertEqual(host.ip_address(1), '10.1.2.3')
+        host._after_fork()
+        self.assertEqual(host.ip_address(), '10.1.2.3')
+
+
+class RecorderRuntimeMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original = runtime_metadata.host
+        self.resolver = SlowResolver()
+        runtime_metadata.host = _HostMetadata(resolve_ip=self.resolver)
+
+    def tearDown(self):
+        self.resolver.release.set()
+        runtime_metadata.host = self.original
+
+    def create_recorder(self, **kwargs):
+        return Recorder(periodic_flush_seconds=0, **kwargs)
+
+    def test_construction_does_not_wait_for_the_lookup(self):
+        start = time.time()
+        recorder = self.create_recorder()
+        self.assertTrue(time.time() - start < 1)
+        reporter = recorder._runtime
+        self.assertNotIn('ip_address', reporter.tags)
+        encoder = json_encoder.get_encoder('json')
+        self.assertNotIn(b'ip_address', reporter.tags_fragment(encoder))
+
+        self.resolver.release.set()
+        self.assertTrue(wait_for(lambda: 'ip_address' in reporter.tags))
+        self.assertEqual(reporter.tags['ip_address'], '10.1.2.3')
+        self.assertIn(b'"ip_address":"10.1.2.3"',
+                      reporter.tags_fragment(encoder).replace(b' ', b''))
+
+    def test_metadata_timeout(self):
+        threading.Timer(0.05, self.resolver.release.set).start()
+        recorder = self.create_recorder(metadata_timeout_seconds=2)
+        self.assertEqual(recorder._runtime.tags['ip_address'], '10.1.2.3')
+
+    def test_static_override(self):
+        recorder = self.create_recorder(hostname='web-1', ip_address='192.0.2.7')
+        self.assertEqual(recorder._runtime.tags['device'], 'web-1')
+        self.assertEqual(recorder._runtime.tags['ip_address'], '192.0.2.7')
+        self.assertEqual(self.resolver.calls, 0)
+
+        recorder._after_fork()
+        self.assertEqual(recorder._runtime.tags['ip_address'], '192.0.2.7')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+
+from basictracer.recorder import DefaultSampler
+from opentracing import Format
+from opentracing.ext import tags as ext_tags
+
+import splunktracing.tracer
+from splunktracing.sampler import (PerOperationSampler, ProbabilisticSampler,
+                                   RateLimitingSampler)
+from tests.clock import FakeClock
+
+
+class SamplerTest(unittest.TestCase):
+
+    def test_probabilistic_sampler(self):
+        self.assertFalse(ProbabilisticSampler(0.0).sampled(0))
+        self.assertTrue(ProbabilisticSampler(1.0).sampled((1 << 64) - 1))
+
+        sampler = ProbabilisticSampler(0.25)
+        step = (1 << 64) // 1000
+        kept = sum(sampler.sampled(i * step) for i in range(1000))
+        self.assertTrue(245 <= kept <= 255)
+        # The decision only depends on the trace_id.
+        self.assertEqual(sampler.sampled(12345), ProbabilisticSampler(0.25).sampled(12345))
+
+        with self.assertRaises(ValueError):
+            ProbabilisticSampler(1.5)
+
+    def test_rate_limiting_sampler(self):
+        clock = FakeClock()
+        sampler = RateLimitingSampler(2, burst=3, clock=clock)
+        self.assertEqual([sampler.sampled(i) for i in range(4)],
+                         [True, True, True, False])
+        clock.now += 0.5
+        self.assertEqual([sampler.sampled(i) for i in range(2)], [True, False])
+        clock.now += 10
+        self.assertEqual(sum(sampler.sampled(i) for i in range(10)), 3)
+
+    def test_per_operation_sampler(self):
+        clock = FakeClock()
+        sampler = PerOperationSampler({'health': 0.0,
+                                       'checkout': RateLimitingSampler(1, clock=clock)},
+                                      default_sampler=ProbabilisticSampler(1.0))
+        self.assertFalse(sampler.sampled(1, 'health'))
+        self.assertTrue(sampler.sampled(1, 'checkout'))
+        self.assertFalse(sampler.sampled(1, 'checkout'))
+        self.assertTrue(sampler.sampled(1, 'other'))
+        self.assertTrue(PerOperationSampler({}).sampled(1, 'other'))
+
+
+class TracerSamplingTest(unittest.TestCase):
+
+    def make_tracer(self, sampler):
+        return splunktracing.tracer.Tracer(sampler=sampler,
+                                           periodic_flush_seconds=0,
+                                           collector_encryption='none',
+                                           disable_binary_format=True)
+
+    def tearDown(self):
+        self.tracer.recorder.shutdown(flush=False)
+
+    def buffered(self):
+        return len(self.tracer.recorder._span_records)
+
+    def test_unsampled_traces_are_not_recorded(self):
+        self.tracer = self.make_tracer(PerOperationSampler({'health': 0.0}))
+        with self.tracer.start_active_span('health') as scope:
+            self.assertFalse(scope.span.context.sampled)
+            with self.tracer.start_active_span('db') as child:
+                self.assertFalse(child.span.context.sampled)
+        self.assertEqual(self.buffered(), 0)
+
+        with self.tracer.start_active_span('checkout'):
+            pass
+        self.assertEqual(self.buffered(), 1)
+
+    def test_decision_is_propagated(self):
+        self.tracer = self.make_tracer(ProbabilisticSampler(0.0))
+        span = self.tracer.start_span('outbound')
+        carrier = {}
+        self.tracer.inject(span.context, Format.TEXT_MAP, carrier)
+        context = self.tracer.extract(Format.TEXT_MAP, carrier)
+        self.assertFalse(context.sampled)
+        # A remote parent's decision wins over the local sampler.
+        context.sampled = True
+        self.tracer.start_span('inbound', child_of=context).finish()
+        self.assertEqual(self.buffered(), 1)
+
+    def test_sampling_priority_overrides_sampler(self):
+        self.tracer = self.make_tracer(ProbabilisticSampler(0.0))
+        span = self.tracer.start_span('forced', tags={ext_tags.SAMPLING_PRIORITY: 1})
+        self.assertTrue(span.context.sampled)
+
+    def test_string_sampling_priority(self):
+        self.tracer = self.make_tracer(ProbabilisticSampler(0.0))
+        for priority, sampled in (('1', True), ('0', False), (' 2 ', True)):
+            span = self.tracer.start_span('op', tags={ext_tags.SAMPLING_PRIORITY: priority})
+            self.assertEqual(span.context.sampled, sampled, priority)
+        # Not a number: the sampler decides.
+        for priority in ('yes', '', None, [1]):
+            span = self.tracer.start_span('op', tags={ext_tags.SAMPLING_PRIORITY: priority})
+            self.assertFalse(span.context.sampled, priority)
+
+    def test_basictracer_sampler(self):
+        self.tracer = self.make_tracer(DefaultSampler(1))
+        self.assertTrue(self.tracer.start_span('op').context.sampled)
+
+
+if __name__ == '__main__':
+    unittest.main()
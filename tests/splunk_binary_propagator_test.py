@@ -0,0 +1,112 @@
+from base64 import standard_b64decode, standard_b64encode
+import unittest
+
+from basictracer.context import SpanContext
+from opentracing import InvalidCarrierException, SpanContextCorruptedException
+
+from splunktracing.lightstep_carrier_pb2 import BinaryCarrier
+from splunktracing.splunk_binary_propagator import SplunkTracingBinaryPropagator
+
+MAX_ID = 2 ** 64 - 1
+
+
+def protobuf_carrier(trace_id, span_id, sampled, baggage=None, text_ctx=None):
+    """Serialize a BinaryCarrier the way the protobuf runtime does."""
+    state = BinaryCarrier()
+    state.basic_ctx.trace_id = trace_id
+    state.basic_ctx.span_id = span_id
+    state.basic_ctx.sampled = sampled
+    for key, value in (baggage or {}).items():
+        state.basic_ctx.baggage_items[key] = value
+    for key, value in (text_ctx or {}).items():
+        pair = state.text_ctx.add()
+        pair.key = key
+        pair.value = value
+    return state.SerializeToString()
+
+
+def parse_protobuf(serialized):
+    state = BinaryCarrier()
+    state.ParseFromString(bytes(serialized))
+    ctx = state.basic_ctx
+    return ctx.trace_id, ctx.span_id, ctx.sampled, dict(ctx.baggage_items)
+
+
+class SplunkTracingBinaryPropagatorTest(unittest.TestCase):
+
+    CONTEXTS = [
+        (1, 2, True, {}),
+        (MAX_ID, MAX_ID - 1, False, {}),
+        (0, 0, False, {}),
+        (3, 0, True, {}),
+        (0x0123456789abcdef, 42, True, {'k': 'v'}),
+        (7, 8, True, {'': ''}),
+        (7, 8, True, {u'clé': u'☃' * 200}),
+        (9, 10, True, {'a': '1', 'b': '', 'long': 'x' * 300}),
+    ]
+
+    def setUp(self):
+        self.propagator = SplunkTracingBinaryPropagator()
+
+    def inject(self, trace_id, span_id, sampled, baggage):
+        carrier = bytearray()
+        self.propagator.inject(SpanContext(trace_id=trace_id, span_id=span_id,
+                                           sampled=sampled, baggage=baggage), carrier)
+        return carrier
+
+    def assertContext(self, context, trace_id, span_id, sampled, baggage):
+        self.assertEqual((context.trace_id, context.span_id, context.sampled, context.baggage),
+                         (trace_id, span_id, sampled, baggage))
+
+    def test_matches_protobuf_serialization(self):
+        for trace_id, span_id, sampled, baggage in self.CONTEXTS:
+            carrier = self.inject(trace_id, span_id, sampled, baggage)
+            if len(baggage) <= 1:
+                # The order of map entries is up to the serializer.
+                self.assertEqual(bytes(carrier), standard_b64encode(
+                    protobuf_carrier(trace_id, span_id, sampled, baggage)))
+            self.assertEqual(parse_protobuf(standard_b64decode(bytes(carrier))),
+                             (trace_id, span_id, sampled, baggage))
+
+    def test_extracts_protobuf_carriers(self):
+        for trace_id, span_id, sampled, baggage in self.CONTEXTS:
+            carrier = bytearray(standard_b64encode(
+                protobuf_carrier(trace_id, span_id, sampled, baggage,
+                                 text_ctx={'ot-tracer-traceid': 'abc'})))
+            self.assertContext(self.propagator.extract(carrier),
+                               trace_id, span_id, sampled, baggage)
+
+    def test_round_trip(self):
+        for trace_id, span_id, sampled, baggage in self.CONTEXTS:
+            context = self.propagator.extract(self.inject(trace_id, span_id, sampled, baggage))
+            self.assertContext(context, trace_id, span_id, sampled, baggage)
+
+    def test_buffers_are_reused(self):
+        first = self.inject(1, 2, True, {'k': 'x' * 100})
+        second = self.inject(3, 4, False, {})
+        self.assertContext(self.propagator.extract(first), 1, 2, True, {'k': 'x' * 100})
+        self.assertContext(self.propagator.extract(second), 3, 4, False, {})
+
+    def test_unknown_fields_are_skipped(self):
+        serialized = protobuf_carrier(5, 6, True, {'k': 'v'})
+        # Field 9 of each wire type, before the known fields.
+        unknown = b'\x48\x96\x01' + b'\x49' + b'\x00' * 8 + b'\x4a\x02hi' + b'\x4d' + b'\x00' * 4
+        carrier = bytearray(standard_b64encode(unknown + serialized))
+        self.assertContext(self.propagator.extract(carrier), 5, 6, True, {'k': 'v'})
+
+    def test_corrupted_carrier(self):
+        serialized = protobuf_carrier(5, 6, True, {'k': 'value'})
+        for data in (serialized[:-3], serialized[:3], b'\x12\xff', b'\x0b'):
+            with self.assertRaises(SpanContextCorruptedException):
+                self.propagator.extract(bytearray(standard_b64encode(data)))
+
+    def test_carrier_must_be_bytearray(self):
+        context = SpanContext(trace_id=1, span_id=2)
+        with self.assertRaises(InvalidCarrierException):
+            self.propagator.inject(context, bytes())
+        with self.assertRaises(InvalidCarrierException):
+            self.propagator.extract(bytes(self.inject(1, 2, True, {})))
+
+
+if __name__ == '__main__':
+    unittest.main()
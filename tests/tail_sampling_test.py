@@ -0,0 +1,116 @@
+import time
+import unittest
+
+from basictracer.context import SpanContext
+from basictracer.span import BasicSpan
+
+import splunktracing.tracer
+from splunktracing.recorder import Recorder
+from splunktracing.tail_sampling import TailSampler
+
+
+class TailSamplerTest(unittest.TestCase):
+
+    def test_traces_are_decided_once_quiet(self):
+        sampler = TailSampler(decision_wait_seconds=5, sample_rate=1.0)
+        kept, dropped = sampler.process([(1, 0.1, False, 'a'), (1, 0.2, False, 'b')], 100)
+        self.assertEqual((kept, dropped), ([], 0))
+        self.assertEqual((len(sampler), sampler.span_count), (1, 2))
+
+        kept, _ = sampler.process([(1, 0.1, False, 'c')], 103)
+        self.assertEqual(kept, [])
+        kept, _ = sampler.process([], 107)
+        self.assertEqual(kept, [])
+        kept, _ = sampler.process([], 108)
+        self.assertEqual(kept, ['a', 'b', 'c'])
+        self.assertEqual((len(sampler), sampler.span_count), (0, 0))
+
+    def test_keep_policies(self):
+        sampler = TailSampler(decision_wait_seconds=0, latency_threshold_seconds=1.0)
+        kept, dropped = sampler.process([(1, 0.1, False, 'fast'),
+                                         (2, 0.1, True, 'error'),
+                                         (3, 0.1, False, 'slow-child'),
+                                         (3, 2.0, False, 'slow-root')], 100)
+        self.assertEqual(kept, ['error', 'slow-child', 'slow-root'])
+        self.assertEqual(dropped, 1)
+
+        sampler = TailSampler(decision_wait_seconds=0, keep_errors=False)
+        self.assertEqual(sampler.process([(2, 0.1, True, 'error')], 100), ([], 1))
+
+    def test_late_spans_follow_decision(self):
+        sampler = TailSampler(decision_wait_seconds=0)
+        sampler.process([(1, 0.1, True, 'a'), (2, 0.1, False, 'b')], 100)
+        self.assertEqual(sampler.process([(1, 0.1, False, 'late-a'),
+                                          (2, 0.1, False, 'late-b')], 200),
+                         (['late-a'], 1))
+
+    def test_bounds_force_early_decisions(self):
+        sampler = TailSampler(decision_wait_seconds=60, sample_rate=1.0, max_traces=2)
+        kept, _ = sampler.process([(i, 0.1, False, i) for i in range(5)], 100)
+        self.assertEqual(kept, [0, 1, 2])
+        self.assertEqual(len(sampler), 2)
+
+        sampler = TailSampler(decision_wait_seconds=60, sample_rate=1.0, max_spans=3)
+        kept, _ = sampler.process([(1, 0.1, False, 'a'), (1, 0.1, False, 'b'),
+                                   (2, 0.1, False, 'c'), (2, 0.1, False, 'd')], 100)
+        self.assertEqual(kept, ['a', 'b'])
+
+    def test_flush_all(self):
+        sampler = TailSampler(decision_wait_seconds=60, sample_rate=1.0)
+        self.assertEqual(sampler.process([(1, 0.1, False, 'a')], 100, flush_all=True),
+                         (['a'], 0))
+
+
+class RecorderTailSamplingTest(unittest.TestCase):
+
+    def make_recorder(self, **kwargs):
+        recorder = Recorder(collector_encryption='none',
+                            periodic_flush_seconds=0,
+                            tail_sampler=TailSampler(decision_wait_seconds=0,
+                                                     latency_threshold_seconds=1.0),
+                            **kwargs)
+        self.tracer = splunktracing.tracer._SplunkTracer(False, recorder, None)
+        return recorder
+
+    def record(self, recorder, trace_id, span_id, duration, tags=None):
+        span = BasicSpan(self.tracer, operation_name='op-%d' % span_id,
+                         context=SpanContext(trace_id=trace_id, span_id=span_id),
+                         tags=tags,
+                         start_time=time.time())
+        span.duration = duration
+        recorder.record_span(span)
+
+    def check_kept_traces(self, **kwargs):
+        recorder = self.make_recorder(**kwargs)
+        self.record(recorder, 1, 10, 0.01)
+        self.record(recorder, 2, 20, 0.01, tags={'error': True})
+        self.record(recorder, 2, 21, 0.01)
+        self.record(recorder, 3, 30, 5.0)
+        self.record(recorder, 4, 40, 0.01, tags={'error': False})
+
+        report = recorder._construct_report_request()
+        self.assertEqual(sorted(span.operation_name for span in report.spans),
+                         ['op-20', 'op-21', 'op-30'])
+        self.assertEqual(recorder.stats()['spans_sampled_out'], 2)
+        recorder.shutdown(flush=False)
+
+    def test_tail_sampling(self):
+        self.check_kept_traces()
+
+    def test_tail_sampling_with_deferred_conversion(self):
+        self.check_kept_traces(deferred_conversion=True)
+
+    def test_shutdown_decides_pending_traces(self):
+        recorder = self.make_recorder()
+        recorder._tail_sampler.decision_wait_seconds = 60
+        self.record(recorder, 1, 10, 5.0)
+        self.assertEqual(len(recorder._construct_report_request().spans), 0)
+        self.assertEqual(recorder.stats()['tail_spans'], 1)
+
+        recorder._draining = True
+        self.assertEqual(len(recorder._construct_report_request().spans), 1)
+        recorder.shutdown(flush=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,5 +44,14 @@ class UtilTest(unittest.TestCase):
         self.assertEqual(777, seconds)
         self.assertEqual(987654321, nanos)
 
+    def test_format_timestamp(self):
+        self.assertEqual('777.000000000', util._format_timestamp(777))
+        self.assertEqual('1500000000.250000000', util._format_timestamp(1500000000.25))
+        self.assertEqual('1.007812500', util._format_timestamp(1.0078125))
+
+    def test_time_to_micros(self):
+        self.assertEqual(1500000, util._time_to_micros(1.5))
+        self.assertIsInstance(util._time_to_micros(0.0000015), int)
+
 if __name__ == '__main__':
     unittest.main()